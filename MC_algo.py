@@ -1,371 +1,729 @@
+import itertools
 import math
-import random
-from MC_reading_csv import get_coefficients_for
+import time
+import numpy as np
+from MC_reading_csv import get_coefficients_many
 from MC_reading_tumor_coef import get_optical_properties
+from MC_scene import Scene, layer_tissue
+from MC_stats import timed_scene
+from MC_tables import hg_table, fresnel_table
+from MC_vector import iter_mc_vectorized, SimulationCancelled
+
+ENGINE_VERSION = 3
 
 BINS = 51
-mu_a = 5.0  # поглощение, 1/cm
-mu_s = 95.0  # рассеяние, 1/cm
-g = 0.5  # анизотропия
-n = 1.5  # преломление
 microns_per_bin = 100.0
 
 photons = 20000
-wave = 650
-
-x = y = z = 0.0
-u = v = 0.0
-w = 1.0
-weight = 0.0
-
-rs = 0.0
-albedo = 0.0
-crit_angle = 0.0
-bins_per_mfp = 0.0
-heat = [0.0] * BINS
-rd = 0.0
-bit = 0.0 
-
-final_x = []
-final_z = []
-
-is_vessel = True
-is_heterogeneous = True
-is_tumor = True
-
-X_TRANS = 5.0
+# Сколько конечных точек копится в списках перед раскладкой по гистограмме и выборке
+END_POINT_FLUSH = 4096
+# Сколько точек взаимодействия копится перед раскладкой по сеткам вокселей и (r, z)
+TALLY_FLUSH = 65536
+# Как часто (в фотонах) скалярный движок проверяет отмену: проверка дешёвая, а 1% от миллионов фотонов — десятки секунд
+CANCEL_CHECK = 256
 
 VESSEL_CENTER_X = -8.0
-VESSEL_CENTER_Z = 3.5  
-VESSEL_RADIUS = 0.2  
+VESSEL_CENTER_Z = 3.5
+VESSEL_RADIUS = 0.2
 BOUNDARY_THICKNESS = 0.2
 
-TUMOR_CENTER_X = 7.5
-TUMOR_CENTER_Z = 4.4
-TUMOR_RADIUS_X = 2.6
-TUMOR_RADIUS_Z = 1.7
-
-MU_A_T = 5
-MU_S_T = 180
-G_T = 0.85
-N_T = 1.39
-
-MU_A_BG = mu_a
-MU_S_BG = mu_s
-G_BG = g
-N_BG = n
-
-MU_A_VESSEL = MU_A_BG * 20.0
-MU_S_VESSEL = MU_S_BG * 0.9
 G_VESSEL = 0.35
 N_VESSEL = 1.36
 
-MODE = "A"
-data_mode = []
-COEF = []
-
-
-def _vessel_weight(x, z, x0=VESSEL_CENTER_X, z0=VESSEL_CENTER_Z,
-                   r_v=VESSEL_RADIUS, t=BOUNDARY_THICKNESS):
-    r = math.hypot(x - x0, z - z0)
-    return 1.0 / (1.0 + math.exp((r - r_v) / t))
-
-
-def coef_for_vessel(coef, coef_v):
-    w = _vessel_weight(x, z)
-    return coef * (1.0 - w) + coef_v * w
-
-
-def coef_for_tumor(coef_tumor):
-    x0, z0, rx, rz = TUMOR_CENTER_X, TUMOR_CENTER_Z, TUMOR_RADIUS_X, TUMOR_RADIUS_Z
-    r2 = ((x - x0) / rx) ** 2 + ((z - z0) / rz) ** 2
-    return coef_tumor * (1.0 + 4.0 * math.exp(-r2))
-
-def coef_for_hetero(coef_main, coef_bg, coef_v, x0, z0):
-    if is_vessel and is_tumor:
-        if _vessel_weight(x0, z0) < 10 ** -3:
-            return coef_for_tumor(coef_main)
-        else:
-            return coef_for_vessel(coef_bg, coef_v)
-    if is_vessel:
-        return coef_for_vessel(coef_bg, coef_v)
-    if is_tumor:
-        return coef_for_tumor(coef_main)
-    return coef_main
-
-
-def mu_a_at(x, z, mu_a_bg=MU_A_BG, mu_a_v=MU_A_VESSEL):
-    mu_a_local_1 = COEF[0][0]
-    mu_a_local_2 = COEF[1][0]
-    mu_a_local_3 = COEF[2][0]
-    if is_heterogeneous:
-        if (MODE == 'A' and z < data_mode[0][2]) or (MODE == 'B' and z < data_mode[0][2]):
-            return coef_for_hetero(mu_a_local_1, mu_a_bg, mu_a_v, x, z)
-        else:
-            if (MODE == 'A' and z >= data_mode[0][2]) or (MODE == 'B' and z < data_mode[1][2]):
-                return coef_for_hetero(mu_a_local_2, mu_a_bg * 3, mu_a_v, x, z)
-            elif MODE == 'B' and z >= data_mode[1][2]:
-                return coef_for_hetero(mu_a_local_3, mu_a_bg * 1.5, mu_a_v, x, z)
-    return mu_a
-
-
-def mu_s_at(x, z, mu_s_bg=MU_S_BG, mu_s_v=MU_S_VESSEL):
-    if is_heterogeneous:
-        if is_vessel:
-            return coef_for_vessel(mu_s_bg, mu_s_v)
+TUMOR_TYPES = ["Меланома", "Базалиома"]
+PS_TYPES = ["PpIX", "Вертепорфин", "Фотофрин"]
+
+
+RANDOM_BLOCK = 65536
+
+
+class RandomStream:
+    # Случайные величины из numpy.random.Generator (PCG64), которые считаются в numpy блоками по block штук:
+    # random() — равномерное на [0, 1), exponential() — длина пробега -ln(r), disk() — точка (x1, x2, x1² + x2²),
+    # равномерная в единичном круге (азимут рассеяния). Каждая — метод итератора по готовому списку, поэтому
+    # логарифм и отбор точек круга на шаге фотона не считаются в Python. Блоки берутся из одного генератора
+    # в порядке расхода, так что seed (число, SeedSequence или None) однозначно задаёт расчёт
+    __slots__ = ('generator', 'block', 'random', 'exponential', 'disk')
+
+    def __init__(self, seed=None, block=RANDOM_BLOCK):
+        self.generator = np.random.default_rng(seed)
+        self.block = block
+        self.random = self._stream(self._uniform)
+        self.exponential = self._stream(self._exponential)
+        self.disk = self._stream(self._disk)
+
+    @staticmethod
+    def _stream(fill):
+        def blocks():
+            while True:
+                yield fill()
+        return itertools.chain.from_iterable(blocks()).__next__
+
+    def _uniform(self):
+        return self.generator.random(self.block).tolist()
+
+    def _exponential(self):
+        return self.generator.standard_exponential(self.block).tolist()
+
+    def _disk(self):
+        x1, x2 = 2.0 * self.generator.random((2, self.block)) - 1.0
+        r2 = x1 * x1 + x2 * x2
+        keep = r2 <= 1.0
+        return list(zip(x1[keep].tolist(), x2[keep].tolist(), r2[keep].tolist()))
+
+
+class PhotonTransport:
+    __slots__ = ('scene', 'photons', 'seed', 'rng',
+                 'x', 'y', 'z', 'u', 'v', 'w', 'weight',
+                 'rs', 'crit_angle', 'bins_per_mfp', 'hg', 'fresnel', 'delta_tracking', 'majorant', 'tops', 'bottoms',
+                 'heat', 'rd', 'bit', 'final_x', 'final_z', 'tumor_dose', 'histogram', 'hist',
+                 'reservoir', 'ends', 'lost', 'stats', 'voxels', 'cylinder', 'tally_points',
+                 'reflectance', 'escapes', 'steps', 'tumor_box')
+
+    def __init__(self, scene, photons=photons, seed=None, delta_tracking=False, tables=False, histogram=None,
+                 reservoir=None, voxels=None, cylinder=None, reflectance=None):
+        self.scene = scene
+        self.photons = photons
+        self.seed = seed
+        self.rng = RandomStream(seed)
+        # Дельта-трекинг имеет смысл только в неоднородной среде
+        self.delta_tracking = delta_tracking and scene.is_heterogeneous
+        # Сетка гистограммы конечных точек (MC_histogram.PositionHistogram); без неё точки хранятся списками
+        self.histogram = histogram
+        # Выборка конечных точек (MC_reservoir.EndPointReservoir) пополняется на месте
+        self.reservoir = reservoir
+        self.lost = 0.0
+        # Сетки вокселей (MC_voxels.VoxelTally) и (r, z) (MC_cylinder.CylinderTally) тоже пополняются на месте
+        self.voxels = voxels
+        self.cylinder = cylinder
+        # Отражение по r, углу выхода и x–y (MC_reflectance.ReflectanceTally) — тоже на месте
+        self.reflectance = reflectance
+        # Счётчики (MC_stats.RunStats) ведёт только InstrumentedTransport
+        self.stats = None
+
+        self.x = self.y = self.z = 0.0
+        self.u = self.v = 0.0
+        self.w = 1.0
+        self.weight = 0.0
+
+        n_bg = scene.n
+        self.rs = (n_bg - 1.0) * (n_bg - 1.0) / ((n_bg + 1.0) * (n_bg + 1.0))
+        self.crit_angle = math.sqrt(max(0.0, 1.0 - 1.0 / (n_bg * n_bg)))
+        self.bins_per_mfp = 1e4 / microns_per_bin / (scene.mu_a + scene.mu_s)
+        # Прямоугольник вокруг эллипса опухоли (с запасом на округление): точную проверку in_tumor
+        # проходят только точки внутри него
+        self.tumor_box = None
+        if scene.is_tumor:
+            rx, rz = abs(scene.tumor_rx) * (1.0 + 1e-9), abs(scene.tumor_rz) * (1.0 + 1e-9)
+            self.tumor_box = (scene.tumor_x - rx, scene.tumor_x + rx, scene.tumor_z - rz, scene.tumor_z + rz)
+        # Таблицы рассеяния и отражения по значениям g и n сцены (MC_tables) вместо формул
+        self.hg = hg_table(scene) if tables else None
+        self.fresnel = fresnel_table(scene) if tables else None
+        if self.delta_tracking:
+            self.majorant = (scene.majorant_layers() / (scene.mu_a + scene.mu_s)).tolist()
+            tops, bottoms = scene.layer_slabs()
+            self.tops, self.bottoms = tops.tolist(), bottoms.tolist()
+        self.reset()
+
+    def reset(self):
+        self.heat = [0.0] * BINS
+        self.rd = 0.0
+        self.bit = 0.0
+        self.tumor_dose = 0.0
+        # Число взаимодействий за расчёт (для замеров взаимодействий в секунду)
+        self.steps = 0
+        self.final_x = []
+        self.final_z = []
+        self.hist = None if self.histogram is None else self.histogram.empty()
+        # (x, y, z, вес перед гибелью, число взаимодействий) фотонов, ещё не переданные в выборку
+        self.ends = None if self.reservoir is None else []
+        # (x, y, z, поглощённый вес, вклад во флюенс) взаимодействий, ещё не разложенные по сеткам
+        self.tally_points = None if self.voxels is None and self.cylinder is None else []
+        # (x, y, косинус внутри, n, вышедший вес) выходов через поверхность, ещё не разложенные по сетке отражения
+        self.escapes = None if self.reflectance is None else []
+
+    def flush(self):
+        if self.hist is not None and self.final_x:
+            self.hist.add(self.final_x, self.final_z)
+            self.final_x.clear()
+            self.final_z.clear()
+        if self.ends:
+            self.reservoir.add(*zip(*self.ends))
+            self.ends.clear()
+        if self.tally_points:
+            x, y, z, absorbed, fluence = np.array(self.tally_points).T
+            if self.voxels is not None:
+                self.voxels.add(x, y, z, absorbed, fluence)
+            if self.cylinder is not None:
+                self.cylinder.add(np.hypot(x, y), z, absorbed, self.scene.layer_index_array(z))
+            self.tally_points.clear()
+        if self.escapes:
+            self.reflectance.add(*zip(*self.escapes))
+            self.escapes.clear()
+
+    def end_points(self):
+        # Конечные точки фотонов: списки x и z или, если задана гистограмма, (гистограмма, None)
+        if self.hist is not None:
+            self.flush()
+            return self.hist, None
+        return self.final_x, self.final_z
+
+    def launch(self):
+        self.x = self.y = self.z = 0.0
+        self.u = self.v = 0.0
+        self.w = 1.0
+        self.weight = 1.0 - self.rs
+
+    def bounce(self):
+        scene = self.scene
+        n_local = scene.n
+
+        if scene.is_heterogeneous:
+            n_local = scene.n_at(self.x, self.z)
+
+        w = self.w = -self.w
+        self.z = -self.z
+        if w <= self.crit_angle:
+            return
+        if self.fresnel is not None:
+            rf = self.fresnel.sample(n_local, w)
         else:
-            if (MODE == 'A' and z < data_mode[0][2]) or (MODE == 'B' and z < data_mode[0][2]):
-                return COEF[0][1]
+            t = math.sqrt(max(0.0, 1.0 - n_local * n_local * (1.0 - w * w)))
+            temp1 = (w - n_local * t) / (w + n_local * t)
+            temp = (t - n_local * w) / (t + n_local * w)
+            rf = (temp1 * temp1 + temp * temp) / 2.0
+        escaped = (1.0 - rf) * self.weight
+        self.rd += escaped
+        self.weight -= escaped
+        if self.escapes is not None:
+            self.escapes.append((self.x, self.y, w, n_local, escaped))
+
+    def move(self):
+        d = self.rng.exponential()
+        self.x += d * self.u
+        self.y += d * self.v
+        self.z += d * self.w
+        if self.z <= 0.0:
+            self.bounce()
+
+    def move_delta(self):
+        # Дельта-трекинг: оптическая толщина разыгрывается по мажоранте слоя, на границе слоя остаток
+        # переносится в соседний, на поверхности фотон отражается. Столкновение настоящее с вероятностью
+        # mu_t / мажоранта, иначе фотон летит дальше
+        scene = self.scene
+        rng = self.rng
+        mu_ref = scene.mu_a + scene.mu_s
+        majorant, tops, bottoms = self.majorant, self.tops, self.bottoms
+        k = scene.layer_index(self.z)
+        tau = rng.exponential()
+        while True:
+            m = majorant[k]
+            w = self.w
+            if w > 0.0:
+                to_bound = (bottoms[k] - self.z) / w
+            elif w < 0.0:
+                to_bound = (tops[k] - self.z) / w
             else:
-                if (MODE == 'A' and z >= data_mode[0][2]) or (MODE == 'B' and z < data_mode[1][2]):
-                    return COEF[1][1]
-                elif MODE == 'B' and z >= data_mode[1][2]:
-                    return COEF[2][1]
-    return mu_s
-
-
-def g_at(x, z, g_bg=G_BG, g_v=G_VESSEL):
-    if is_heterogeneous:
-        if is_vessel:
-            coef_for_vessel(g_bg, g_v)
-        else:
-            if (MODE == 'A' and z < data_mode[0][2]) or (MODE == 'B' and z < data_mode[0][2]):
-                return COEF[0][2]
+                to_bound = math.inf
+            step = tau / m
+            if step < to_bound:
+                self.x += step * self.u
+                self.y += step * self.v
+                self.z += step * w
+                if rng.random() * m * mu_ref <= scene.mu_t_at(self.x, self.z):
+                    return
+                tau = rng.exponential()
+                continue
+            self.x += to_bound * self.u
+            self.y += to_bound * self.v
+            tau -= m * to_bound
+            if w > 0.0:
+                self.z = bottoms[k]
+                k += 1
+            elif k > 0:
+                self.z = tops[k]
+                k -= 1
             else:
-                if (MODE == 'A' and z >= data_mode[0][2]) or (MODE == 'B' and z < data_mode[1][2]):
-                    return COEF[1][2]
-                elif MODE == 'B' and z >= data_mode[1][2]:
-                    return COEF[2][2]
-    return g
+                self.z = 0.0
+                self.bounce()
 
+    def absorb(self, albedo=None):
+        # albedo передаёт absorb_tallies, уже нашедший его в этой точке
+        scene = self.scene
+        x, y, z = self.x, self.y, self.z
 
-def n_at(z, n_bg=N_BG, n_v=N_VESSEL):
-    if is_heterogeneous:
-        if is_vessel:
-            return coef_for_vessel(n_bg, n_v)
-        else:
-            if (MODE == 'A' and z < data_mode[0][2]) or (MODE == 'B' and z < data_mode[0][2]):
-                return COEF[0][3]
+        if albedo is None:
+            if scene.is_heterogeneous:
+                albedo = scene.albedo_at(x, z)
+            else:
+                albedo = scene.mu_s / (scene.mu_a + scene.mu_s)
+
+        dist = math.sqrt(x * x + y * y + z * z)
+        bin_idx = int(dist * self.bins_per_mfp)
+        if bin_idx < 0:
+            bin_idx = 0
+        if bin_idx >= BINS:
+            bin_idx = BINS - 1
+        weight = self.weight
+        deposit = (1.0 - albedo) * weight
+        self.heat[bin_idx] += deposit
+        box = self.tumor_box
+        if box is not None and box[0] <= x <= box[1] and box[2] <= z <= box[3] and scene.in_tumor(x, z):
+            self.tumor_dose += deposit
+        weight *= albedo
+
+        if weight < 0.001:
+            self.bit -= weight
+            if self.rng.random() > 0.1:
+                self.final_x.append(x)
+                self.final_z.append(z)
+                self.lost = weight
+                weight = 0.0
             else:
-                if (MODE == 'A' and z >= data_mode[0][2]) or (MODE == 'B' and z < data_mode[1][2]):
-                    return COEF[1][3]
-                elif MODE == 'B' and z >= data_mode[1][2]:
-                    return COEF[2][3]
-    return n
-
-
-def launch():
-    global x, y, z, u, v, w, weight
-    x = y = z = 0.0
-    u = v = 0.0
-    w = 1.0
-    weight = 1.0 - rs
-
-
-def bounce():
-    global z, w, rd, weight
-    n_local = n
-
-    if is_heterogeneous:
-        n_local = n_at(z)
-
-    w = -w
-    z = -z
-    if w <= crit_angle:
-        return
-    t = math.sqrt(max(0.0, 1.0 - n_local * n_local * (1.0 - w * w)))
-    temp1 = (w - n_local * t) / (w + n_local * t)
-    temp = (t - n_local * w) / (t + n_local * w)
-    rf = (temp1 * temp1 + temp * temp) / 2.0
-    rd += (1.0 - rf) * weight
-    weight -= (1.0 - rf) * weight
-
-
-def move():
-    global x, y, z, u, v, w
-    r = random.random()
-    d = -math.log(r if r > 0.0 else 1e-15)
-    x += d * u
-    y += d * v
-    z += d * w
-    if z <= 0.0:
-        bounce()
-
-
-def absorb():
-    global heat, weight, bit
-
-    mu_a_local = mu_a
-    mu_s_local = mu_s
-
-    if is_heterogeneous:
-        mu_a_local = mu_a_at(x, z)
-        mu_s_local = mu_s_at(x, z)
-
-    albedo = mu_s_local / (mu_a_local + mu_s_local)
-
-    dist = math.sqrt(x * x + y * y + z * z)
-    bin_idx = int(dist * bins_per_mfp)
-    if bin_idx < 0:
-        bin_idx = 0
-    if bin_idx >= BINS:
-        bin_idx = BINS - 1
-    heat[bin_idx] += (1.0 - albedo) * weight
-    weight *= albedo
-
-    if weight < 0.001:
-        bit -= weight
-        if random.random() > 0.1:
-            final_x.append(x)
-            final_z.append(z)
-            weight = 0.0
+                weight /= 0.1
+            self.bit += weight
+        self.weight = weight
+
+    def absorb_tallies(self):
+        # absorb с записью точки для сеток вокселей и (r, z): поглощённый вес и вес, пришедший во взаимодействие,
+        # делённый на частоту взаимодействий (при дельта-трекинге она равна mu_t в точке, иначе mu_a + mu_s сцены)
+        scene = self.scene
+        x, z = self.x, self.z
+        weight = self.weight
+        if scene.is_heterogeneous:
+            albedo = scene.albedo_at(x, z)
+        else:
+            albedo = scene.mu_s / (scene.mu_a + scene.mu_s)
+        fluence = weight
+        if self.delta_tracking:
+            fluence = weight * (scene.mu_a + scene.mu_s) / scene.mu_t_at(x, z)
+        self.absorb(albedo)
+        points = self.tally_points
+        points.append((x, self.y, z, (1.0 - albedo) * weight, fluence))
+        if len(points) >= TALLY_FLUSH:
+            self.flush()
+
+    def scatter(self):
+        # Новое направление
+        scene = self.scene
+        rng = self.rng
+        u, v, w = self.u, self.v, self.w
+
+        g_local = scene.g
+
+        if scene.is_heterogeneous:
+            g_local = scene.g_at(self.x, self.z)
+
+        # Точка в единичном круге: x1, x2 и x3 = x1² + x2²
+        x1, x2, x3 = rng.disk()
+
+        if g_local == 0.0:
+            # изотропия
+            u = 2.0 * x3 - 1.0
+            denom = max(x3, 1e-12)
+            factor = math.sqrt(max(0.0, (1.0 - u * u) / denom))
+            self.u, self.v, self.w = u, x1 * factor, x2 * factor
+            return
+
+        # Гамма-раскрытие Хение-Гринштейна
+        r = rng.random()
+        if self.hg is not None:
+            mu = self.hg.sample(g_local, r)
+        else:
+            mu = (1.0 - g_local * g_local) / (1.0 - g_local + 2.0 * g_local * r)
+            mu = (1.0 + g_local * g_local - mu * mu) / (2.0 * g_local)
+        if abs(w) < 0.9:
+            denom1 = max(1.0 - w * w, 1e-12)
+            a = math.sqrt(max(0.0, (1.0 - mu * mu) / denom1 / x3))
+            t = mu * u + a * (x1 * u * w - x2 * v)
+            v = mu * v + a * (x1 * v * w + x2 * u)
+            c = math.sqrt(max(0.0, (1.0 - mu * mu) * (1.0 - w * w) / x3))
+            w = mu * w - c * x1
         else:
-            weight /= 0.1
-        bit += weight
-
-
-def scatter():
-    global u, v, w  # Новое направление
-
-    g_local = g
-
-    if is_heterogeneous:
-        g_local = g_at(x, z)
-
-    while True:
-        x1 = 2.0 * random.random() - 1.0
-        x2 = 2.0 * random.random() - 1.0
-        x3 = x1 * x1 + x2 * x2
-        if x3 <= 1.0:
-            break
-
-    if g_local == 0.0:
-        # изотропия
-        u = 2.0 * x3 - 1.0
-        denom = max(x3, 1e-12)
-        factor = math.sqrt(max(0.0, (1.0 - u * u) / denom))
-        v = x1 * factor
-        w = x2 * factor
-        return
-
-    # Гамма-раскрытие Хение-Гринштейна
-    r = random.random()
-    mu = (1.0 - g_local * g_local) / (1.0 - g_local + 2.0 * g_local * r)
-    mu = (1.0 + g_local * g_local - mu * mu) / (2.0 * g_local)
-    if abs(w) < 0.9:
-        denom1 = max(1.0 - w * w, 1e-12)
-        a = math.sqrt(max(0.0, (1.0 - mu * mu) / denom1 / x3))
-        t = mu * u + a * (x1 * u * w - x2 * v)
-        b = math.sqrt(max(0.0, (1.0 - mu * mu) / denom1 / x3))
-        v = mu * v + b * (x1 * v * w + x2 * u)
-        c = math.sqrt(max(0.0, (1.0 - mu * mu) * (1.0 - w * w) / x3))
-        w = mu * w - c * x1
-        u = t
+            denom2 = max(1.0 - v * v, 1e-12)
+            a = math.sqrt(max(0.0, (1.0 - mu * mu) / denom2 / x3))
+            t = mu * u + a * (x1 * u * v + x2 * w)
+            w = mu * w + a * (x1 * v * w - x2 * u)
+            c = math.sqrt(max(0.0, (1.0 - mu * mu) * (1.0 - v * v) / x3))
+            v = mu * v - c * x1
+        self.u, self.v, self.w = t, v, w
+
+    def snapshot(self, done):
+        if self.hist is not None:
+            self.flush()
+            return done, list(self.heat), self.bit, self.hist.copy(), None, self.rd, self.tumor_dose
+        return (done, list(self.heat), self.bit, np.array(self.final_x), np.array(self.final_z), self.rd,
+                self.tumor_dose)
+
+    def _transport(self, chunk=None, progress=None, cancel=None):
+        # Основной цикл по фотонам; отдаёт число готовых фотонов каждые chunk фотонов и в конце
+        photons_total = self.photons
+        check_every = max(photons_total // 100, 1)
+        launch, absorb, scatter = self.launch, self.absorb, self.scatter
+        if self.tally_points is not None:
+            absorb = self.absorb_tallies
+        move = self.move_delta if self.delta_tracking else self.move
+        flush = self.hist is not None or self.reservoir is not None or self.reflectance is not None
+        ends = self.ends
+        pending = 0
+        for i in range(photons_total):
+            if cancel is not None and i % CANCEL_CHECK == 0 and cancel.is_set():
+                raise SimulationCancelled()
+            if progress is not None and i % check_every == 0:
+                progress(i, photons_total)
+            if chunk and i and i % chunk == 0:
+                yield i
+            if i == photons_total // 4:
+                print('...25%')
+            elif i == photons_total // 2:
+                print('...50%')
+            elif i == 3 * photons_total // 4:
+                print('...75%')
+            elif i == photons_total - 1:
+                print('..100%')
+            launch()
+            steps = 0
+            while self.weight > 0:
+                move()
+                absorb()
+                scatter()
+                steps += 1
+            self.steps += steps
+            if ends is not None:
+                ends.append((self.x, self.y, self.z, self.lost, steps))
+            if flush:
+                pending += 1
+                if pending >= END_POINT_FLUSH:
+                    self.flush()
+                    pending = 0
+        self.flush()
+        yield photons_total
+
+    def iter_run(self, engine='python', chunk=None, progress=None, cancel=None):
+        # Генератор: каждые chunk фотонов отдаёт (готово, heat, bit, final_x, final_z, rd, tumor_dose)
+        # нарастающим итогом
+        self.reset()
+        if engine == 'numpy':
+            rng = np.random.default_rng(self.seed)
+            snapshots = iter_mc_vectorized(self.scene, self.photons, chunk=chunk, rng=rng, progress=progress,
+                                           cancel=cancel, delta_tracking=self.delta_tracking,
+                                           tables=self.hg is not None, histogram=self.histogram,
+                                           reservoir=self.reservoir, stats=self.stats, voxels=self.voxels,
+                                           cylinder=self.cylinder, reflectance=self.reflectance)
+            while True:
+                try:
+                    snapshot = next(snapshots)
+                except StopIteration as stop:
+                    # Генератор возвращает число взаимодействий
+                    self.steps = stop.value
+                    return
+                _, self.heat, self.bit, self.final_x, self.final_z, self.rd, self.tumor_dose = snapshot
+                if self.histogram is not None:
+                    self.hist, self.final_x, self.final_z = self.final_x, [], []
+                yield snapshot
+
+        for done in self._transport(chunk, progress, cancel):
+            yield self.snapshot(done)
+
+    def run(self, engine='python', progress=None, cancel=None):
+        if engine == 'numpy':
+            for _ in self.iter_run(engine, progress=progress, cancel=cancel):
+                pass
+        else:
+            self.reset()
+            for _ in self._transport(progress=progress, cancel=cancel):
+                pass
+        return self.heat, self.bit
+
+    def print_results(self):
+        scene = self.scene
+        total = self.bit + self.photons
+        print(f"Scattering = {scene.mu_s:8.3f}/cm\nAbsorption = {scene.mu_a:8.3f}/cm")
+        print(f"Anisotropy = {scene.g:8.3f}\nRefr Index = {scene.n:8.3f}\nPhotons = {self.photons:8d}")
+        print(f"\n\nSpecular Refl = {self.rs:10.5f}\nBackscattered Refl = {self.rd / total:10.5f}")
+        print(f"\n\n Depth Heat\n[microns] [W/cm^3]\n")
+        for i in range(BINS - 1):
+            depth = i * microns_per_bin
+            value = self.heat[i] / microns_per_bin * 1e4 / total
+            print(f"{depth:6.0f} {value:12.5f}")
+        extra = self.heat[BINS - 1] / total
+        print(f" extra {extra:12.5f}")
+
+
+class InstrumentedTransport(PhotonTransport):
+    # Тот же перенос со счётчиками и замерами времени в stats (MC_stats.RunStats). Отдельный класс, чтобы
+    # в PhotonTransport на горячем пути не было проверок
+    __slots__ = ()
+
+    def __init__(self, scene, stats, **kwargs):
+        super().__init__(timed_scene(scene, stats), **kwargs)
+        self.stats = stats
+
+    def launch(self):
+        self.stats.photons += 1
+        super().launch()
+
+    def bounce(self):
+        stats = self.stats
+        stats.bounces += 1
+        if -self.w <= self.crit_angle:
+            stats.internal_reflections += 1
+        super().bounce()
+
+    def move(self):
+        start = time.perf_counter()
+        super().move()
+        self.stats.add_time('move', time.perf_counter() - start)
+
+    def move_delta(self):
+        start = time.perf_counter()
+        super().move_delta()
+        self.stats.add_time('move', time.perf_counter() - start)
+
+    def absorb(self, albedo=None):
+        stats = self.stats
+        bit = self.bit
+        start = time.perf_counter()
+        super().absorb(albedo)
+        stats.add_time('absorb', time.perf_counter() - start)
+        stats.steps += 1
+        # Рулетка меняет bit: погибший фотон уменьшает его на свой вес, выживший увеличивает
+        if self.weight == 0.0:
+            stats.roulette_kills += 1
+        elif self.bit != bit:
+            stats.roulette_survivals += 1
+
+    def scatter(self):
+        start = time.perf_counter()
+        super().scatter()
+        stats = self.stats
+        stats.add_time('scatter', time.perf_counter() - start)
+        # После гибели в рулетке scatter тоже вызывается, но направление уже не нужно
+        if self.weight > 0.0:
+            stats.scatters += 1
+
+    def flush(self):
+        start = time.perf_counter()
+        super().flush()
+        self.stats.add_time('end points', time.perf_counter() - start)
+
+    def _timed(self, snapshots):
+        # Время переноса — только внутри генератора, без обработки промежуточных результатов снаружи
+        stats = self.stats
+        while True:
+            start = time.perf_counter()
+            snapshot = next(snapshots, None)
+            stats.add_time('transport', time.perf_counter() - start)
+            if snapshot is None:
+                return
+            yield snapshot
+
+    def _transport(self, chunk=None, progress=None, cancel=None):
+        return self._timed(super()._transport(chunk, progress, cancel))
+
+    def iter_run(self, engine='python', chunk=None, progress=None, cancel=None):
+        snapshots = super().iter_run(engine, chunk, progress, cancel)
+        return self._timed(snapshots) if engine == 'numpy' else snapshots
+
+
+def build_scene(new_mu_a, new_mu_s, new_g, new_n, new_is_vessel=True, new_is_heterogeneous=True, new_is_tumor=True,
+                new_wave=680, new_cx=7.5, new_cz=4.5, new_rx=2.5, new_rz=1.5, new_mode=None,
+                tt_index=0, ps_index=0):
+    tumor = get_optical_properties(TUMOR_TYPES[tt_index], new_wave, PS_TYPES[ps_index])
+    print(f'mu_a_tumor: {tumor["mu_a"]}')
+
+    mode, layers = new_mode if new_mode is not None else ("", [])
+    if layers:
+        coef = get_coefficients_many([layer_tissue(layer) for layer in layers], new_wave, method='linear')[:, 0]
     else:
-        denom2 = max(1.0 - v * v, 1e-12)
-        a = math.sqrt(max(0.0, (1.0 - mu * mu) / denom2 / x3))
-        t = mu * u + a * (x1 * u * v + x2 * w)
-        b = math.sqrt(max(0.0, (1.0 - mu * mu) / denom2 / x3))
-        w = mu * w + b * (x1 * v * w - x2 * u)
-        c = math.sqrt(max(0.0, (1.0 - mu * mu) * (1.0 - v * v) / x3))
-        v = mu * v - c * x1
-        u = t
-
-
-def print_results():
-    print(f"Scattering = {mu_s:8.3f}/cm\nAbsorption = {mu_a:8.3f}/cm")
-    print(f"Anisotropy = {g:8.3f}\nRefr Index = {n:8.3f}\nPhotons = {photons:8d}")
-    print(f"\n\nSpecular Refl = {rs:10.5f}\nBackscattered Refl = {rd / (bit + photons):10.5f}")
-    print(f"\n\n Depth Heat\n[microns] [W/cm^3]\n")
-    for i in range(BINS - 1):
-        depth = i * microns_per_bin
-        value = heat[i] / microns_per_bin * 1e4 / (bit + photons)
-        print(f"{depth:6.0f} {value:12.5f}")
-    extra = heat[BINS - 1] / (bit + photons)
-    print(f" extra {extra:12.5f}")
-
-
-def run_mc():
-    global rs, albedo, crit_angle, bins_per_mfp, heat, rd, bit
-
-    albedo = mu_s / (mu_s + mu_a)
-    rs = (n - 1.0) * (n - 1.0) / ((n + 1.0) * (n + 1.0))
-    crit_angle = math.sqrt(max(0.0, 1.0 - 1.0 / (n * n)))
-    bins_per_mfp = 1e4 / microns_per_bin / (mu_a + mu_s)
-
-    heat = [0.0] * BINS
-    rd = 0.0
-    bit = 0.0
-
-    for i in range(photons):
-        if i == photons // 4:
-            print('...25%')
-        elif i == photons // 2:
-            print('...50%')
-        elif i == 3 * photons // 4:
-            print('...75%')
-        elif i == photons - 1:
-            print('..100%')
-        launch()
-        while weight > 0:
-            move()
-            absorb()
-            scatter()
-
-    return heat, bit
+        coef = []
+    print(new_wave, ':', np.asarray(coef).tolist())
+
+    return make_scene(new_mu_a, new_mu_s, new_g, new_n, new_is_vessel, new_is_heterogeneous, new_is_tumor,
+                      new_cx, new_cz, new_rx, new_rz, mode, layers, coef, tumor)
+
+
+def make_scene(new_mu_a, new_mu_s, new_g, new_n, new_is_vessel, new_is_heterogeneous, new_is_tumor,
+               new_cx, new_cz, new_rx, new_rz, mode, layers, coef, tumor):
+    # Сцена из уже найденных коэффициентов слоёв и свойств опухоли (без чтения таблиц)
+    return Scene(new_mu_a, new_mu_s, new_g, new_n,
+                 is_vessel=new_is_vessel, is_heterogeneous=new_is_heterogeneous, is_tumor=new_is_tumor,
+                 mode=mode, layers=layers, coef=coef,
+                 g_vessel=G_VESSEL, n_vessel=N_VESSEL,
+                 vessel_x=VESSEL_CENTER_X, vessel_z=VESSEL_CENTER_Z, vessel_r=VESSEL_RADIUS,
+                 vessel_t=BOUNDARY_THICKNESS,
+                 tumor_x=new_cx, tumor_z=new_cz, tumor_rx=new_rx, tumor_rz=new_rz,
+                 mu_a_tumor=tumor['mu_a'], mu_s_tumor=tumor['mu_s'], g_tumor=tumor['g'], n_tumor=tumor['n'])
+
+
+def create_simulation(new_mu_a, new_mu_s, new_g, new_n, new_is_vessel=True, new_is_heterogeneous=True,
+                      new_is_tumor=True, new_photons=20000, new_wave=680, new_cx=7.5, new_cz=4.5, new_rx=2.5,
+                      new_rz=1.5, new_mode=None, tt_index=0, ps_index=0, seed=None, grid_step=None, scene=None,
+                      delta_tracking=False, histogram=None, reservoir=None, stats=None, voxels=None,
+                      cylinder=None, reflectance=None):
+    start = time.perf_counter()
+    if scene is None:
+        scene = build_scene(new_mu_a, new_mu_s, new_g, new_n, new_is_vessel=new_is_vessel,
+                            new_is_heterogeneous=new_is_heterogeneous, new_is_tumor=new_is_tumor,
+                            new_wave=new_wave, new_cx=new_cx, new_cz=new_cz, new_rx=new_rx, new_rz=new_rz,
+                            new_mode=new_mode, tt_index=tt_index, ps_index=ps_index)
+    if grid_step and scene.is_heterogeneous:
+        scene = scene.compile(grid_step)
+    if stats is not None:
+        sim = InstrumentedTransport(scene, stats, photons=new_photons // 2, seed=seed,
+                                    delta_tracking=delta_tracking, histogram=histogram, reservoir=reservoir,
+                                    voxels=voxels, cylinder=cylinder, reflectance=reflectance)
+        stats.add_time('setup', time.perf_counter() - start)
+        return sim
+    return PhotonTransport(scene, photons=new_photons // 2, seed=seed, delta_tracking=delta_tracking,
+                           histogram=histogram, reservoir=reservoir, voxels=voxels, cylinder=cylinder,
+                           reflectance=reflectance)
+
+
+def _cached(cache, new_mu_a, new_mu_s, new_g, new_n, engine, workers, params):
+    # Возвращает (ключ, сцена, результат из кэша или None)
+    from MC_cache import result_key
+    scene = build_scene(new_mu_a, new_mu_s, new_g, new_n, new_is_vessel=params['new_is_vessel'],
+                        new_is_heterogeneous=params['new_is_heterogeneous'], new_is_tumor=params['new_is_tumor'],
+                        new_wave=params['new_wave'], new_cx=params['new_cx'], new_cz=params['new_cz'],
+                        new_rx=params['new_rx'], new_rz=params['new_rz'], new_mode=params['new_mode'],
+                        tt_index=params['tt_index'], ps_index=params['ps_index'])
+    key = result_key(scene, photons=params['new_photons'], wave=params['new_wave'], tt_index=params['tt_index'],
+                     ps_index=params['ps_index'], seed=params['seed'], engine=engine, workers=workers,
+                     grid_step=params['grid_step'], delta_tracking=params['delta_tracking'],
+                     histogram=None if params['histogram'] is None else params['histogram'].spec(),
+                     version=ENGINE_VERSION)
+    return key, scene, cache.get(key)
+
+
+def _use_history(history, engine, workers, delta_tracking):
+    # История взаимодействий записывается пакетным движком NumPy в одном процессе и без дельта-трекинга
+    return history is not None and engine == 'numpy' and workers == 1 and not delta_tracking
+
+
+def _bin_end_points(res, histogram):
+    # Истории (MC_perturb, MC_scaled) отдают конечные точки массивами; с гистограммой они раскладываются по ней
+    if histogram is None:
+        return res
+    hist = histogram.empty()
+    hist.add(res[2], res[3])
+    return res[0], res[1], hist, None
+
+
+def _history_scene(scene, new_mu_a, new_mu_s, new_g, new_n, params):
+    if scene is None:
+        scene = build_scene(new_mu_a, new_mu_s, new_g, new_n, new_is_vessel=params['new_is_vessel'],
+                            new_is_heterogeneous=params['new_is_heterogeneous'],
+                            new_is_tumor=params['new_is_tumor'], new_wave=params['new_wave'],
+                            new_cx=params['new_cx'], new_cz=params['new_cz'], new_rx=params['new_rx'],
+                            new_rz=params['new_rz'], new_mode=params['new_mode'], tt_index=params['tt_index'],
+                            ps_index=params['ps_index'])
+    if params['grid_step'] and scene.is_heterogeneous:
+        scene = scene.compile(params['grid_step'])
+    return scene
 
 
 def get_data(new_mu_a, new_mu_s, new_g, new_n, new_is_vessel=True, new_is_heterogeneous=True, new_is_tumor=True,
              new_photons=20000, new_wave=680, new_cx=7.5, new_cz=4.5, new_rx=2.5, new_rz=1.5, new_mode=None,
-             tt_index=0, ps_index=0):
-    global MU_A_T
-
-    MU_A_T = get_optical_properties(["Меланома", "Базалиома"][tt_index], new_wave,
-                                    ["PpIX", "Вертепорфин", "Фотофрин"][ps_index])['mu_a']
-    print(f'mu_a_tumor: {MU_A_T}')
-    global MODE, data_mode
-    MODE = new_mode[0]
-    data_mode = new_mode[1]
-    # print(f'ALGO: {MODE} {data_mode}')
-    global is_vessel, is_heterogeneous, is_tumor
-    global photons, wave
-    photons = new_photons // 2
-    wave = new_wave
-    is_vessel, is_heterogeneous, is_tumor = new_is_vessel, new_is_heterogeneous, new_is_tumor
-    final_x.clear()
-    final_z.clear()
-    global mu_a, mu_s, g, n
-    global MU_A_BG, MU_S_BG, G_BG, N_BG, MU_S_VESSEL, MU_A_VESSEL
-    MU_A_BG, MU_S_BG, G_BG, N_BG = new_mu_a, new_mu_s, new_g, new_n
-    MU_A_VESSEL, MU_S_VESSEL = MU_A_BG * 20.0, MU_S_BG * 0.9
-
-    global TUMOR_CENTER_X, TUMOR_CENTER_Z, TUMOR_RADIUS_X, TUMOR_RADIUS_Z
-    TUMOR_CENTER_X, TUMOR_CENTER_Z, TUMOR_RADIUS_X, TUMOR_RADIUS_Z = new_cx, new_cz, new_rx, new_rz
-
-    mu_a_1, mu_s_1, g_1, n_1 = get_coefficients_for(tissue="Эпидермис_светлый", wavelength=wave,
-                                                    method='linear').values()
-    mu_a_2, mu_s_2, g_2, n_2 = get_coefficients_for(tissue="Дерма_человека", wavelength=wave,
-                                                    method='linear').values()
-    mu_a_3, mu_s_3, g_3, n_3 = get_coefficients_for(tissue="Подкожный_жир_n10", wavelength=wave,
-                                                    method='linear').values()
-    # mu_a = new_mu_a
-
-    mu_a, mu_s, g, n = new_mu_a, new_mu_s, new_g, new_n
-    global COEF
-    COEF = [[mu_a_1, mu_s_1, g_1, n_1], [mu_a_2, mu_s_2, g_2, n_2], [mu_a_3, mu_s_3, g_3, n_3]]
-    # mu_s, g, n = COEF[0]
-    print(888, new_g)
-    print(1, wave, ':', mu_a, mu_s, g, n)
-    print(wave, ':', COEF)
-
-    heat_res, bit_res = run_mc()
-    return heat, bit_res, final_x, final_z
+             tt_index=0, ps_index=0, engine='python', seed=None, workers=1, grid_step=None, delta_tracking=False,
+             histogram=None, reservoir=None, stats=None, voxels=None, cylinder=None, reflectance=None, cache=None,
+             history=None, progress=None, cancel=None):
+    # Возвращает (heat, bit, final_x, final_z). Если задана histogram (MC_histogram.PositionHistogram),
+    # конечные точки сразу раскладываются по её сетке и вместо final_x, final_z возвращается (гистограмма, None).
+    # reservoir (MC_reservoir.EndPointReservoir) пополняется конечными точками этого расчёта на месте,
+    # stats (MC_stats.RunStats) — счётчиками и временем этапов, voxels (MC_voxels.VoxelTally) — поглощённым
+    # весом и флюенсом по вокселям, cylinder (MC_cylinder.CylinderTally) — поглощённым весом по (r, z) и слоям,
+    # reflectance (MC_reflectance.ReflectanceTally) — отражением по r, углу выхода и x–y
+    params = dict(new_is_vessel=new_is_vessel, new_is_heterogeneous=new_is_heterogeneous,
+                  new_is_tumor=new_is_tumor, new_photons=new_photons, new_wave=new_wave, new_cx=new_cx,
+                  new_cz=new_cz, new_rx=new_rx, new_rz=new_rz, new_mode=new_mode, tt_index=tt_index,
+                  ps_index=ps_index, seed=seed, grid_step=grid_step, delta_tracking=delta_tracking,
+                  histogram=histogram, reservoir=reservoir, stats=stats, voxels=voxels, cylinder=cylinder,
+                  reflectance=reflectance)
+    if any(tally is not None for tally in (reservoir, stats, voxels, cylinder, reflectance)):
+        # Выборку, счётчики и сетки пополняет только настоящий расчёт, не кэш и не пересчёт по истории
+        cache = history = None
+
+    key = scene = None
+    if cache is not None:
+        key, scene, res = _cached(cache, new_mu_a, new_mu_s, new_g, new_n, engine, workers, params)
+        if res is not None:
+            return res
+
+    if _use_history(history, engine, workers, delta_tracking):
+        scene = _history_scene(scene, new_mu_a, new_mu_s, new_g, new_n, params)
+        res = history.reweight(scene, new_photons // 2)
+        if res is not None:
+            return _bin_end_points(res[:4], histogram)
+        res = history.record(scene, new_photons // 2, seed, progress=progress, cancel=cancel)[:4]
+        res = _bin_end_points(res, histogram)
+    elif workers > 1:
+        from MC_parallel import get_data_parallel
+        heat_res, bit_res, final_x_res, final_z_res, _ = get_data_parallel(
+            new_mu_a, new_mu_s, new_g, new_n, engine=engine, workers=workers, progress=progress, cancel=cancel,
+            **params)
+        res = heat_res, bit_res, final_x_res, final_z_res
+    else:
+        sim = create_simulation(new_mu_a, new_mu_s, new_g, new_n, scene=scene, **params)
+        heat_res, bit_res = sim.run(engine, progress=progress, cancel=cancel)
+        res = (heat_res, bit_res) + sim.end_points()
+
+    if cache is not None:
+        res = cache.put(key, res)
+    return res
+
+
+def iter_data(new_mu_a, new_mu_s, new_g, new_n, new_is_vessel=True, new_is_heterogeneous=True, new_is_tumor=True,
+              new_photons=20000, new_wave=680, new_cx=7.5, new_cz=4.5, new_rx=2.5, new_rz=1.5, new_mode=None,
+              tt_index=0, ps_index=0, engine='python', seed=None, grid_step=None, delta_tracking=False,
+              histogram=None, reservoir=None, stats=None, voxels=None, cylinder=None, reflectance=None, cache=None,
+              history=None, chunk=10000, progress=None, cancel=None):
+    # Как get_data, но каждые chunk фотонов отдаёт (готово, (heat, bit, final_x, final_z)).
+    # Потребитель может прервать цикл в любой момент.
+    params = dict(new_is_vessel=new_is_vessel, new_is_heterogeneous=new_is_heterogeneous,
+                  new_is_tumor=new_is_tumor, new_photons=new_photons, new_wave=new_wave, new_cx=new_cx,
+                  new_cz=new_cz, new_rx=new_rx, new_rz=new_rz, new_mode=new_mode, tt_index=tt_index,
+                  ps_index=ps_index, seed=seed, grid_step=grid_step, delta_tracking=delta_tracking,
+                  histogram=histogram, reservoir=reservoir, stats=stats, voxels=voxels, cylinder=cylinder,
+                  reflectance=reflectance)
+    if any(tally is not None for tally in (reservoir, stats, voxels, cylinder, reflectance)):
+        cache = history = None
+
+    key = scene = None
+    if cache is not None:
+        key, scene, res = _cached(cache, new_mu_a, new_mu_s, new_g, new_n, engine, 1, params)
+        if res is not None:
+            yield new_photons // 2, res
+            return
+
+    photons_total = new_photons // 2
+    if _use_history(history, engine, 1, delta_tracking):
+        scene = _history_scene(scene, new_mu_a, new_mu_s, new_g, new_n, params)
+        res = history.reweight(scene, photons_total)
+        if res is not None:
+            yield photons_total, _bin_end_points(res[:4], histogram)
+            return
+        snapshots = history.iter_record(scene, photons_total, seed, chunk, progress=progress, cancel=cancel)
+        binned = False
+    else:
+        sim = create_simulation(new_mu_a, new_mu_s, new_g, new_n, scene=scene, **params)
+        snapshots = sim.iter_run(engine, chunk, progress, cancel)
+        binned = True
+    for done, heat_res, bit_res, final_x_res, final_z_res, *_ in snapshots:
+        res = heat_res, bit_res, final_x_res, final_z_res
+        if not binned:
+            res = _bin_end_points(res, histogram)
+        if done == photons_total and cache is not None:
+            res = cache.put(key, res)
+        yield done, res
 
 
 def main():
-    get_data(5.0, 95.0, 0.5, 1.5, new_is_vessel=False,
-             new_is_heterogeneous=True, new_is_tumor=True, new_photons=16000, new_wave=680)
-    return
+    sim = create_simulation(5.0, 95.0, 0.5, 1.5, new_is_vessel=False, new_is_heterogeneous=True, new_is_tumor=True,
+                            new_photons=16000, new_wave=680,
+                            new_mode=('A', [("Эпидермис", 0.0, 3.5), ("Дерма", 3.5, 10.0)]))
+    sim.run()
+    sim.print_results()
 
 
 if __name__ == "__main__":
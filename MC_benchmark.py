@@ -0,0 +1,196 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from MC_algo import create_simulation, build_scene, BINS, ENGINE_VERSION
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5), ("Дерма", 3.5, 10.0)]
+LAYERS_B = [("Эпидермис", 0.0, 2.5), ("Дерма", 2.5, 7.0), ("Гипподерма", 7.0, 12.0)]
+
+# Набор сцен для замеров: однородная среда при нескольких g и все сочетания режима, опухоли и сосуда
+SUITE = [(f'homogeneous g={g}', dict(new_g=g, new_is_heterogeneous=False, new_is_tumor=False, new_is_vessel=False))
+         for g in (0.0, 0.5, 0.9)]
+SUITE += [(f'mode {mode}{" tumor" if tumor else ""}{" vessel" if vessel else ""}',
+           dict(new_g=0.5, new_mode=(mode, layers), new_is_tumor=tumor, new_is_vessel=vessel))
+          for mode, layers in (('A', LAYERS_A), ('B', LAYERS_B))
+          for tumor in (False, True) for vessel in (False, True)]
+SUITE += [(f'mode A vessel g={g}', dict(new_g=g, new_mode=('A', LAYERS_A), new_is_tumor=False, new_is_vessel=True))
+          for g in (0.0, 0.9)]
+
+HISTORY = 'benchmark_history.jsonl'
+THRESHOLD = 0.1
+
+
+def heat_difference(heat, reference):
+    # Относительное отличие кривых нагрева по глубине (без последнего «лишнего» бина)
+    a = np.asarray(heat[:BINS - 1])
+    b = np.asarray(reference[:BINS - 1])
+    return float(np.linalg.norm(a - b) / max(np.linalg.norm(b), 1e-300))
+
+
+def time_run(photons, engine='python', seed=1, grid_step=None, mode=('A', LAYERS_A),
+             is_vessel=False, is_tumor=True):
+    sim = create_simulation(5.0, 95.0, 0.5, 1.5, new_is_vessel=is_vessel, new_is_heterogeneous=True,
+                            new_is_tumor=is_tumor, new_photons=2 * photons, new_wave=650, new_mode=mode,
+                            seed=seed, grid_step=grid_step)
+    start = time.perf_counter()
+    sim.run(engine)
+    elapsed = time.perf_counter() - start
+    return photons / elapsed, list(sim.heat)
+
+
+def compare_grid(photons=20000, engine='python', grid_steps=(0.2, 0.1, 0.05), **scene):
+    rate, reference = time_run(photons, engine, seed=1, **scene)
+    _, other_seed = time_run(photons, engine, seed=2, **scene)
+    rows = [('analytic', rate, 1.0, 0.0)]
+    for step in grid_steps:
+        grid_rate, heat = time_run(photons, engine, seed=1, grid_step=step, **scene)
+        rows.append((f'grid {step}', grid_rate, grid_rate / rate, heat_difference(heat, reference)))
+
+    print(f"\nEngine: {engine}, photons: {photons}")
+    print(f"Noise floor (analytic, seed 1 vs 2): {heat_difference(other_seed, reference):.4f}")
+    print(f"{'lookup':>12} {'photons/s':>12} {'speedup':>8} {'heat diff':>10}")
+    for name, r, speedup, diff in rows:
+        print(f"{name:>12} {r:12.0f} {speedup:8.2f} {diff:10.4f}")
+    return rows
+
+
+def time_case(photons, engine, params, repeat=3, seed=1, delta_tracking=False):
+    # Лучшее из repeat времён счёта одной сцены (без построения сцены). Число взаимодействий считает сам
+    # движок (sim.steps); при одном seed оно во всех повторах одно и то же
+    with contextlib.redirect_stdout(io.StringIO()):
+        scene = build_scene(5.0, 95.0, params.get('new_g', 0.5), 1.5, new_wave=650,
+                            **{k: v for k, v in params.items() if k != 'new_g'})
+        best = float('inf')
+        for _ in range(repeat):
+            sim = create_simulation(0, 0, 0, 0, new_photons=2 * photons, seed=seed, scene=scene,
+                                    delta_tracking=delta_tracking)
+            start = time.perf_counter()
+            sim.run(engine)
+            best = min(best, time.perf_counter() - start)
+    steps = sim.steps
+    return {'seconds': best, 'photons_per_s': photons / best, 'steps_per_s': steps / best,
+            'steps_per_photon': steps / photons}
+
+
+def _revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(photons=20000, engine='python', repeat=3, cases=None, delta_tracking=False):
+    # Одна запись истории: условия замера и результаты по сценам
+    record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': _revision(), 'engine': engine,
+              'engine_version': ENGINE_VERSION, 'delta_tracking': delta_tracking, 'photons': photons,
+              'repeat': repeat, 'python': platform.python_version(), 'numpy': np.__version__,
+              'machine': platform.platform(), 'results': {}}
+    print(f"\nEngine: {engine}, photons: {photons}, best of {repeat}")
+    print(f"{'scene':>26} {'photons/s':>12} {'steps/s':>12} {'steps/photon':>13}")
+    for name, params in SUITE:
+        if cases and not any(case in name for case in cases):
+            continue
+        result = time_case(photons, engine, params, repeat, delta_tracking=delta_tracking)
+        record['results'][name] = result
+        print(f"{name:>26} {result['photons_per_s']:12.0f} {result['steps_per_s']:12.0f} "
+              f"{result['steps_per_photon']:13.1f}")
+    return record
+
+
+def append_history(path, record):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def load_baseline(path, engine, photons, delta_tracking=False):
+    # Последняя запись файла (истории или сохранённой базы) с тем же движком и числом фотонов
+    baseline = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if (record['engine'] == engine and record['photons'] == photons
+                    and record.get('delta_tracking', False) == delta_tracking):
+                baseline = record
+    return baseline
+
+
+def compare_baseline(record, baseline, threshold=THRESHOLD):
+    # Возвращает список сцен, где фотонов в секунду меньше базы больше чем на threshold
+    print(f"\nBaseline: {baseline['time']} ({baseline.get('revision')}), threshold {threshold:.0%}")
+    print(f"{'scene':>26} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    regressions = []
+    for name, result in record['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = result['photons_per_s'] / base['photons_per_s']
+        slower = ratio < 1.0 - threshold
+        if slower:
+            regressions.append(name)
+        print(f"{name:>26} {base['photons_per_s']:12.0f} {result['photons_per_s']:12.0f} {ratio:7.2f}"
+              f"{'  REGRESSION' if slower else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры производительности: набор сцен (--suite) или сравнение "
+                                                 "аналитических коэффициентов и сетки свойств")
+    parser.add_argument('--photons', type=int, default=20000)
+    parser.add_argument('--engine', choices=('python', 'numpy'), default='python')
+    parser.add_argument('--steps', type=float, nargs='+', default=[0.2, 0.1, 0.05])
+    parser.add_argument('--mode', choices=('A', 'B'), default='A')
+    parser.add_argument('--vessel', action='store_true')
+    parser.add_argument('--no-tumor', action='store_true')
+    parser.add_argument('--suite', action='store_true', help="замер фотонов и взаимодействий в секунду по набору сцен")
+    parser.add_argument('--cases', nargs='+', help="только сцены, в названии которых есть одна из строк")
+    parser.add_argument('--repeat', type=int, default=3, help="число замеров каждой сцены, берётся лучший")
+    parser.add_argument('--delta-tracking', action='store_true')
+    parser.add_argument('--history', default=HISTORY, help="файл истории замеров (JSON, запись на строку)")
+    parser.add_argument('--no-history', action='store_true')
+    parser.add_argument('--baseline', help="файл истории или базы для сравнения")
+    parser.add_argument('--save-baseline', help="сохранить замер как базу в этот файл")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help="допустимое относительное замедление, при превышении код выхода 1")
+    args = parser.parse_args(argv)
+
+    if not args.suite:
+        mode = ('A', LAYERS_A) if args.mode == 'A' else ('B', LAYERS_B)
+        compare_grid(args.photons, args.engine, tuple(args.steps), mode=mode,
+                     is_vessel=args.vessel, is_tumor=not args.no_tumor)
+        return 0
+
+    # База читается до записи замера: если --baseline — это файл истории, замер не сравнивается сам с собой
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        baseline = load_baseline(args.baseline, args.engine, args.photons, args.delta_tracking)
+    record = run_suite(args.photons, args.engine, args.repeat, args.cases, args.delta_tracking)
+    if not args.no_history:
+        append_history(args.history, record)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    if args.baseline:
+        if baseline is None:
+            print(f"\nВ {args.baseline} нет замера с движком {args.engine} и {args.photons} фотонами")
+            return 1
+        regressions = compare_baseline(record, baseline, args.threshold)
+        if regressions:
+            print(f"Замедление больше {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
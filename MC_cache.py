@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+from MC_histogram import PositionHistogram
+from MC_scene import Scene
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'junior_mc')
+
+
+def _plain(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, np.random.SeedSequence):
+        return [value.entropy, list(value.spawn_key)]
+    return value
+
+
+def result_key(scene, **params):
+    # Ключ — хэш всех входных данных: разрешённых коэффициентов сцены и параметров запуска
+    payload = {name: _plain(getattr(scene, name)) for name in Scene.__slots__}
+    payload.update({name: _plain(value) for name, value in params.items()})
+    text = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_entries=16, directory=DEFAULT_DIR, max_disk_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                if 'hist_counts' in data:
+                    hist = PositionHistogram(data['hist_x_range'], data['hist_z_range'], data['hist_counts'].shape)
+                    hist.counts = data['hist_counts']
+                    hist.total = int(data['hist_total'])
+                    result = (data['heat'].tolist(), float(data['bit']), hist, None)
+                else:
+                    result = (data['heat'].tolist(), float(data['bit']), data['final_x'], data['final_z'])
+        except FileNotFoundError:
+            return None
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            # Обрезанный или испорченный файл — промах, запись удаляется
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        os.utime(path)
+        self._remember(key, result)
+        return result
+
+    def put(self, key, result):
+        heat, bit, final_x, final_z = result
+        if final_z is None:
+            # Вместо конечных точек — гистограмма (get_data(histogram=...))
+            result = (list(heat), bit, final_x, None)
+        else:
+            result = (list(heat), bit, np.asarray(final_x), np.asarray(final_z))
+        self._remember(key, result)
+        if self.directory:
+            self._store(key, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.npz'):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._memory[key] = result
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _store(self, key, result):
+        heat, bit, final_x, final_z = result
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            if final_z is None:
+                np.savez(f, heat=np.asarray(heat), bit=np.float64(bit), hist_counts=final_x.counts,
+                         hist_total=np.int64(final_x.total), hist_x_range=np.array(final_x.x_range),
+                         hist_z_range=np.array(final_x.z_range))
+            else:
+                np.savez(f, heat=np.asarray(heat), bit=np.float64(bit), final_x=final_x, final_z=final_z)
+        os.replace(tmp, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        # На диске удаляются самые давно использованные файлы, пока не уложимся в лимит
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
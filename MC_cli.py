@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from MC_algo import get_data, TUMOR_TYPES, PS_TYPES, BINS, microns_per_bin
+from MC_sweep import run_sweep, wavelength_range
+
+# Значения по умолчанию совпадают с окном программы. photons — число моделируемых фотонов: окно программы и
+# get_data считают половину new_photons, поэтому scenario_kwargs передаёт удвоенное значение
+DEFAULTS = {
+    'mu_a': 5.0,
+    'mu_s': 95.0,
+    'g': 0.5,
+    'n': 1.5,
+    'wavelength': 680,
+    'wavelengths': None,
+    'photons': 10000,
+    'seed': None,
+    'engine': 'numpy',
+    'workers': 1,
+    'grid_step': None,
+    'delta_tracking': False,
+    'heterogeneous': True,
+    'mode': 'A',
+    # Слои режима A окна программы: [имя, верх, низ, ткань]
+    'layers': [['Эпидермис', 0.0, 3.5, 'Эпидермис_светлый'], ['Дерма', 3.5, 10.0, 'Дерма_человека']],
+    'vessel': False,
+    'tumor': {},
+}
+TUMOR_DEFAULTS = {'enabled': True, 'cx': 7.5, 'cz': 4.5, 'rx': 2.5, 'rz': 1.5, 'type': 0, 'ps': 0}
+
+
+def load_scenario(path):
+    # Сценарий в JSON или TOML; формат определяется по расширению
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as f:
+            data = tomllib.load(f)
+    else:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    unknown = set(data) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Неизвестные поля сценария: {', '.join(sorted(unknown))}")
+    scenario = dict(DEFAULTS, **data)
+    scenario['tumor'] = dict(TUMOR_DEFAULTS, **scenario['tumor'])
+    if scenario['heterogeneous'] and not scenario['layers']:
+        raise ValueError("Для неоднородной среды (heterogeneous) нужен хотя бы один слой в layers")
+    if isinstance(scenario['wavelengths'], dict):
+        w = scenario['wavelengths']
+        scenario['wavelengths'] = wavelength_range(w['start'], w['stop'], w['step']).tolist()
+    return scenario
+
+
+def _index(value, names, what):
+    if isinstance(value, int):
+        if not 0 <= value < len(names):
+            raise ValueError(f"Неизвестный {what}: {value}. Допустимо: 0–{len(names) - 1} или {', '.join(names)}")
+        return value
+    if value not in names:
+        raise ValueError(f"Неизвестный {what}: {value}. Допустимо: {', '.join(names)}")
+    return names.index(value)
+
+
+def _layer(layer):
+    # Слой задаётся списком [имя, верх, низ, ткань?] или словарём {name, top, bottom, tissue?}
+    if isinstance(layer, dict):
+        row = (layer['name'], float(layer['top']), float(layer['bottom']))
+        return row + (layer['tissue'],) if layer.get('tissue') else row
+    name, top, bottom, *tissue = layer
+    return (name, float(top), float(bottom)) + tuple(tissue[:1])
+
+
+def scenario_kwargs(scenario):
+    tumor = scenario['tumor']
+    layers = [_layer(layer) for layer in scenario['layers']]
+    return dict(
+        new_mu_a=scenario['mu_a'], new_mu_s=scenario['mu_s'], new_g=scenario['g'], new_n=scenario['n'],
+        new_is_vessel=scenario['vessel'], new_is_heterogeneous=scenario['heterogeneous'],
+        new_is_tumor=tumor['enabled'], new_photons=2 * scenario['photons'], new_wave=scenario['wavelength'],
+        new_cx=tumor['cx'], new_cz=tumor['cz'], new_rx=tumor['rx'], new_rz=tumor['rz'],
+        new_mode=(scenario['mode'], layers) if layers else None,
+        tt_index=_index(tumor['type'], TUMOR_TYPES, 'тип опухоли'),
+        ps_index=_index(tumor['ps'], PS_TYPES, 'фотосенсибилизатор'),
+        engine=scenario['engine'], seed=scenario['seed'], workers=scenario['workers'],
+        grid_step=scenario['grid_step'], delta_tracking=scenario['delta_tracking'])
+
+
+def write_results(output, scenario, res, elapsed, reservoir=None, stats=None, voxels=None, cylinder=None,
+                  reflectance=None):
+    # Результат — .npz с массивами и .json рядом с ним: сценарий, время счёта и нагрев по глубине.
+    # Выборка конечных точек (--sample) сохраняется в тот же .npz с префиксом sample_, счётчики (--stats) — в .json,
+    # сетка вокселей (--voxels) — в <результат>_voxels_absorbed.npy, _fluence.npy и _voxels.json, сетка (r, z)
+    # (--rz) — в .npz с префиксом rz_, доли поглощения по слоям — в .json, отражение по r, углу и x–y
+    # (--reflectance) — в .npz с префиксом rd_, его полная доля — в .json
+    heat, bit, final_x, final_z = res
+    base = _output_base(output)
+    photons = scenario['photons']
+    extra = {}
+    if reservoir is not None:
+        extra = {'sample_' + name: column for name, column in reservoir.data().items()}
+        extra['sample_seen'] = np.int64(reservoir.seen)
+    if cylinder is not None:
+        extra.update(cylinder.arrays(photons))
+    if reflectance is not None:
+        extra.update(reflectance.arrays(photons))
+    np.savez(base + '.npz', heat=np.asarray(heat), bit=np.float64(bit),
+             final_x=np.asarray(final_x), final_z=np.asarray(final_z), **extra)
+
+    depth = [(i + 0.5) * microns_per_bin for i in range(BINS - 1)]
+    summary = {
+        'scenario': scenario,
+        'elapsed': elapsed,
+        'photons': photons,
+        'bit': bit,
+        'depth_um': depth,
+        'heat': [h / microns_per_bin * 1e4 / photons for h in heat[:BINS - 1]],
+        'extra': heat[BINS - 1] / photons,
+    }
+    if stats is not None:
+        summary['stats'] = stats.as_dict()
+    if voxels is not None:
+        voxels.save(base + '_voxels')
+        summary['voxels'] = base + '_voxels'
+    if cylinder is not None:
+        summary['absorbed_fraction'] = cylinder.absorbed_fraction(photons)
+        summary['layer_fractions'] = cylinder.layer_fractions(photons).tolist()
+    if reflectance is not None:
+        summary['reflectance_fraction'] = reflectance.fraction(photons)
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return base + '.npz', base + '.json'
+
+
+def _output_base(output):
+    base = output[:-4] if output.endswith('.npz') else output
+    directory = os.path.dirname(base)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return base
+
+
+def write_sweep(output, scenario, sweep, elapsed):
+    base = _output_base(output)
+    sweep.save(base + '.npz')
+    summary = {
+        'scenario': scenario,
+        'elapsed': elapsed,
+        'photons': sweep.photons,
+        'wavelengths': sweep.wavelengths.tolist(),
+        'specular': sweep.specular.tolist(),
+        'reflectance': sweep.reflectance.tolist(),
+        'tumor_dose': sweep.tumor_dose.tolist(),
+    }
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return base + '.npz', base + '.json'
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Запуск моделирования Монте-Карло без графического интерфейса")
+    parser.add_argument('scenario', help="файл сценария (.json или .toml)")
+    parser.add_argument('-o', '--output', default='result', help="путь результата без расширения или .npz")
+    parser.add_argument('--engine', choices=('python', 'numpy'), help="переопределяет engine из сценария")
+    parser.add_argument('--photons', type=int, help="переопределяет photons (число моделируемых фотонов) из сценария")
+    parser.add_argument('--seed', type=int, help="переопределяет seed из сценария")
+    parser.add_argument('--workers', type=int, help="переопределяет workers из сценария")
+    parser.add_argument('--cache', action='store_true', help="использовать кэш результатов на диске")
+    parser.add_argument('--sample', type=int, metavar='N',
+                        help="сохранить равномерную выборку из N конечных точек (x, y, z, вес, число шагов)")
+    parser.add_argument('--stats', action='store_true',
+                        help="счётчики переноса и время этапов (медленнее; кэш не используется)")
+    parser.add_argument('--voxels', type=int, nargs=3, metavar=('NX', 'NY', 'NZ'),
+                        help="сетка вокселей поглощённого веса и флюенса с таким числом бинов по x, y, z")
+    parser.add_argument('--rz', type=float, nargs=4, metavar=('DR', 'DZ', 'NR', 'NZ'),
+                        help="поглощение по ячейкам (r, z) и по слоям, как в MCML")
+    parser.add_argument('--reflectance', type=float, nargs=3, metavar=('DR', 'NR', 'NA'),
+                        help="диффузное отражение по расстоянию r и углу выхода, как Rd_ra в MCML")
+    parser.add_argument('--reflectance-xy', type=float, nargs=3, metavar=('MIN', 'MAX', 'BINS'),
+                        help="изображение отражения на поверхности x–y в квадрате [MIN, MAX] (с --reflectance)")
+    parser.add_argument('--sweep', type=float, nargs=3, metavar=('START', 'STOP', 'STEP'),
+                        help="расчёт для диапазона длин волн вместо wavelength")
+    parser.add_argument('--white', action='store_true',
+                        help="считать все длины волн за один проход (белый Монте-Карло, только для --sweep)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        scenario = load_scenario(args.scenario)
+        for name in ('engine', 'photons', 'seed', 'workers'):
+            if getattr(args, name) is not None:
+                scenario[name] = getattr(args, name)
+        if args.sweep:
+            scenario['wavelengths'] = wavelength_range(*args.sweep).tolist()
+        kwargs = scenario_kwargs(scenario)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Ошибка сценария: {e}", file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    if scenario['wavelengths']:
+        del kwargs['new_wave']
+        try:
+            if args.white:
+                from MC_white import run_white
+                for name in ('engine', 'workers', 'grid_step', 'delta_tracking'):
+                    del kwargs[name]
+                sweep = run_white(scenario['wavelengths'], reference_wave=scenario['wavelength'], **kwargs)
+            else:
+                sweep = run_sweep(scenario['wavelengths'], **kwargs)
+        except (ValueError, KeyError, IndexError) as e:
+            print(f"Ошибка сценария: {e}", file=sys.stderr)
+            return 2
+        elapsed = time.perf_counter() - start
+        npz_path, json_path = write_sweep(args.output, scenario, sweep, elapsed)
+    else:
+        if args.cache:
+            from MC_cache import ResultCache
+            kwargs['cache'] = ResultCache()
+        if args.sample:
+            from MC_reservoir import EndPointReservoir
+            kwargs['reservoir'] = EndPointReservoir(args.sample, seed=scenario['seed'])
+        if args.stats:
+            from MC_stats import RunStats
+            kwargs['stats'] = RunStats()
+        if args.voxels:
+            from MC_voxels import VoxelTally
+            kwargs['voxels'] = VoxelTally(bins=args.voxels)
+        if args.rz:
+            from MC_cylinder import CylinderTally
+            kwargs['cylinder'] = CylinderTally(*args.rz)
+        if args.reflectance:
+            from MC_reflectance import ReflectanceTally
+            xy = args.reflectance_xy
+            kwargs['reflectance'] = ReflectanceTally(*args.reflectance, xy_range=None if xy is None else xy[:2],
+                                                     xy_bins=100 if xy is None else xy[2])
+        try:
+            res = get_data(**kwargs)
+        except (ValueError, KeyError, IndexError) as e:
+            # Неизвестные ткань или слой обнаруживаются только при построении сцены
+            print(f"Ошибка сценария: {e}", file=sys.stderr)
+            return 2
+        elapsed = time.perf_counter() - start
+        npz_path, json_path = write_results(args.output, scenario, res, elapsed, kwargs.get('reservoir'),
+                                            kwargs.get('stats'), kwargs.get('voxels'), kwargs.get('cylinder'),
+                                            kwargs.get('reflectance'))
+        if args.stats:
+            print(kwargs['stats'].report())
+    print(f"Готово за {elapsed:.2f} с: {npz_path}, {json_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import time
+
+import numpy as np
+
+from MC_algo import build_scene, create_simulation, BINS
+
+
+class ConvergenceReport:
+    __slots__ = ('photons', 'batches', 'elapsed', 'reason', 'converged',
+                 'heat_rse', 'max_heat_rse', 'tumor_dose', 'tumor_rse')
+
+    def __init__(self, photons, batches, elapsed, reason, converged, heat_rse, max_heat_rse, tumor_dose,
+                 tumor_rse):
+        self.photons = photons
+        self.batches = batches
+        self.elapsed = elapsed
+        self.reason = reason
+        self.converged = converged
+        self.heat_rse = heat_rse
+        self.max_heat_rse = max_heat_rse
+        self.tumor_dose = tumor_dose
+        self.tumor_rse = tumor_rse
+
+    def __repr__(self):
+        return (f"ConvergenceReport(photons={self.photons}, batches={self.batches}, elapsed={self.elapsed:.2f}s, "
+                f"reason={self.reason!r}, max_heat_rse={self.max_heat_rse:.4f}, tumor_rse={self.tumor_rse:.4f})")
+
+
+def batch_means_rse(samples):
+    # Относительная стандартная ошибка среднего по методу средних по пакетам
+    samples = np.asarray(samples, dtype=float)
+    k = samples.shape[0]
+    mean = samples.mean(axis=0)
+    if k < 2:
+        return np.full(mean.shape, np.inf)
+    se = samples.std(axis=0, ddof=1) / np.sqrt(k)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(mean > 0, se / mean, np.inf)
+
+
+def _max_heat_rse(heat_batches, heat_rse, min_fraction):
+    # Учитываются только бины с заметным нагревом; последний бин — «лишний», в нём всё, что дальше сетки
+    mean_heat = np.mean(heat_batches, axis=0)[:BINS - 1]
+    significant = mean_heat >= min_fraction * mean_heat.max() if mean_heat.max() > 0 else mean_heat > 0
+    return float(heat_rse[:BINS - 1][significant].max()) if significant.any() else np.inf
+
+
+def get_data_converged(new_mu_a, new_mu_s, new_g, new_n, new_is_vessel=True, new_is_heterogeneous=True,
+                       new_is_tumor=True, new_wave=680, new_cx=7.5, new_cz=4.5, new_rx=2.5, new_rz=1.5,
+                       new_mode=None, tt_index=0, ps_index=0, engine='python', seed=None, grid_step=None,
+                       tolerance=0.05, batch_photons=10000, max_photons=10_000_000, max_time=None,
+                       min_batches=4, min_fraction=0.01, reservoir=None, stats=None, voxels=None,
+                       cylinder=None, reflectance=None, progress=None, cancel=None):
+    # Считает пакетами по batch_photons, пока относительная ошибка heat (в бинах, где нагрев не меньше
+    # min_fraction от максимума) и дозы в опухоли не станет меньше tolerance, либо не кончится бюджет.
+    # Число фотонов задаётся в тех же единицах, что и new_photons в get_data.
+    scene = build_scene(new_mu_a, new_mu_s, new_g, new_n, new_is_vessel=new_is_vessel,
+                        new_is_heterogeneous=new_is_heterogeneous, new_is_tumor=new_is_tumor, new_wave=new_wave,
+                        new_cx=new_cx, new_cz=new_cz, new_rx=new_rx, new_rz=new_rz, new_mode=new_mode,
+                        tt_index=tt_index, ps_index=ps_index)
+    if grid_step and scene.is_heterogeneous:
+        scene = scene.compile(grid_step)
+
+    if max_photons < 2:
+        raise ValueError("max_photons должно быть не меньше 2 (моделируется max_photons // 2 фотонов)")
+    # Бюджет меньше пакета — один пакет размером во весь бюджет
+    batch_photons = min(batch_photons, max_photons)
+    seeds = np.random.SeedSequence(seed)
+    start = time.perf_counter()
+    heat_batches = []
+    dose_batches = []
+    bit = 0.0
+    final_x = []
+    final_z = []
+    photons = 0
+    reason = 'max_photons'
+    converged = False
+    heat_rse = np.full(BINS, np.inf)
+    max_heat_rse = np.inf
+    tumor_rse = np.inf
+
+    while photons + batch_photons <= max_photons:
+        sim = create_simulation(new_mu_a, new_mu_s, new_g, new_n, new_photons=batch_photons,
+                                seed=seeds.spawn(1)[0], scene=scene, reservoir=reservoir, stats=stats,
+                                voxels=voxels, cylinder=cylinder, reflectance=reflectance)
+        sim.run(engine, cancel=cancel)
+        photons += batch_photons
+        heat_batches.append(sim.heat)
+        dose_batches.append(sim.tumor_dose)
+        bit += sim.bit
+        final_x.append(np.asarray(sim.final_x))
+        final_z.append(np.asarray(sim.final_z))
+        if progress is not None:
+            progress(photons, max_photons)
+
+        heat_rse = batch_means_rse(heat_batches)
+        # Опухоль без дозы (глубоко, мала или свет поглощается раньше) не мешает сходимости по нагреву
+        tumor_rse = float(batch_means_rse(dose_batches)) if scene.is_tumor and np.sum(dose_batches) > 0 else 0.0
+        max_heat_rse = _max_heat_rse(heat_batches, heat_rse, min_fraction)
+
+        if len(heat_batches) >= min_batches and max_heat_rse <= tolerance and tumor_rse <= tolerance:
+            reason = 'tolerance'
+            converged = True
+            break
+        if max_time is not None and time.perf_counter() - start >= max_time:
+            reason = 'max_time'
+            break
+
+    heat = np.sum(heat_batches, axis=0).tolist() if heat_batches else [0.0] * BINS
+    report = ConvergenceReport(photons, len(heat_batches), time.perf_counter() - start, reason, converged,
+                               heat_rse, max_heat_rse, float(np.sum(dose_batches)), tumor_rse)
+    res = (heat, bit, np.concatenate(final_x) if final_x else np.zeros(0),
+           np.concatenate(final_z) if final_z else np.zeros(0))
+    return res, report
@@ -0,0 +1,84 @@
+import math
+
+import numpy as np
+
+# Сетка по умолчанию: шаг по r и z и число бинов, в координатах движка (как границы слоёв)
+DR = 0.1
+DZ = 0.1
+NR = 100
+NZ = 100
+
+
+class CylinderTally:
+    # Поглощённый вес по ячейкам (r, z), r = sqrt(x^2 + y^2), и по слоям сцены, как A_rz и A_l в MCML.
+    # Бины равной ширины dr, dz; всё, что дальше nr * dr или глубже nz * dz, попадает в последний бин
+    # по этой оси, так что сумма по сетке — весь поглощённый вес
+    __slots__ = ('dr', 'dz', 'nr', 'nz', 'absorbed', 'layers')
+
+    def __init__(self, dr=DR, dz=DZ, nr=NR, nz=NZ):
+        self.dr, self.dz = float(dr), float(dz)
+        self.nr, self.nz = int(nr), int(nz)
+        self.absorbed = np.zeros((self.nr, self.nz))
+        # Поглощённый вес по номеру слоя (Scene.layer_index); массив растёт до наибольшего номера
+        self.layers = np.zeros(0)
+
+    def spec(self):
+        return self.dr, self.dz, self.nr, self.nz
+
+    def empty(self):
+        return CylinderTally(*self.spec())
+
+    def add(self, r, z, weights, layer=None):
+        r = np.asarray(r, dtype=float).ravel()
+        z = np.asarray(z, dtype=float).ravel()
+        weights = np.asarray(weights, dtype=float).ravel()
+        if r.size == 0:
+            return
+        ir = np.minimum((r * (1.0 / self.dr)).astype(np.int64), self.nr - 1)
+        iz = np.clip((z * (1.0 / self.dz)).astype(np.int64), 0, self.nz - 1)
+        self.absorbed += np.bincount(ir * self.nz + iz, weights=weights,
+                                     minlength=self.nr * self.nz).reshape(self.nr, self.nz)
+        if layer is not None:
+            self._add_layers(np.bincount(np.asarray(layer).ravel(), weights=weights))
+
+    def _add_layers(self, values):
+        if values.size > self.layers.size:
+            self.layers = np.concatenate((self.layers, np.zeros(values.size - self.layers.size)))
+        self.layers[:values.size] += values
+
+    def merge(self, other):
+        if other.spec() != self.spec():
+            raise ValueError("Сетки (r, z) с разным шагом нельзя сложить")
+        self.absorbed += other.absorbed
+        self._add_layers(other.layers)
+        return self
+
+    def r_centers(self):
+        return (np.arange(self.nr) + 0.5) * self.dr
+
+    def z_centers(self):
+        return (np.arange(self.nz) + 0.5) * self.dz
+
+    # ---- нормировка как в MCML: на число запущенных фотонов ----
+
+    def rz_density(self, photons):
+        # A_rz: поглощённая доля на единицу объёма кольца 2π r dr dz, r — середина бина
+        volume = 2.0 * math.pi * self.r_centers() * self.dr * self.dz
+        return self.absorbed / volume[:, None] / max(photons, 1)
+
+    def depth_profile(self, photons):
+        # A_z: поглощённая доля на единицу глубины
+        return self.absorbed.sum(axis=0) / (self.dz * max(photons, 1))
+
+    def layer_fractions(self, photons):
+        # A_l: доля веса, поглощённая в каждом слое
+        return self.layers / max(photons, 1)
+
+    def absorbed_fraction(self, photons):
+        return float(self.absorbed.sum()) / max(photons, 1)
+
+    def arrays(self, photons, prefix='rz_'):
+        # Для сохранения в .npz
+        return {prefix + 'absorbed': self.absorbed, prefix + 'density': self.rz_density(photons),
+                prefix + 'depth': self.depth_profile(photons), prefix + 'layers': self.layer_fractions(photons),
+                prefix + 'r': self.r_centers(), prefix + 'z': self.z_centers()}
@@ -0,0 +1,70 @@
+import numpy as np
+
+# Сетка окна программы: 250×250 бинов, x от -30 до 30
+X_RANGE = (-30.0, 30.0)
+Z_RANGE = (-0.2, 10.0)
+GRID_BINS = (250, 250)
+
+
+def bin_index(values, value_range, bins):
+    # Номера бинов равной ширины и маска попавших в диапазон; правая граница относится к последнему бину
+    lo, hi = value_range
+    # Округление может дать bins не только при values == hi, но и на ulp ниже, поэтому номер ограничивается
+    idx = np.minimum(((values - lo) * (bins / (hi - lo))).astype(np.int64), bins - 1)
+    return idx, (values >= lo) & (values <= hi)
+
+
+class PositionHistogram:
+    # Гистограмма конечных точек фотонов (x, z) фиксированного размера, как np.histogram2d: бины
+    # равной ширины, правая граница последнего бина включается, точки вне диапазона не считаются.
+    # Память — только counts, сколько бы фотонов ни было.
+    __slots__ = ('x_range', 'z_range', 'bins', 'counts', 'total')
+
+    def __init__(self, x_range=X_RANGE, z_range=Z_RANGE, bins=GRID_BINS):
+        self.x_range = (float(x_range[0]), float(x_range[1]))
+        self.z_range = (float(z_range[0]), float(z_range[1]))
+        self.bins = (bins, bins) if isinstance(bins, int) else (int(bins[0]), int(bins[1]))
+        self.counts = np.zeros(self.bins)
+        # Все добавленные точки, включая вышедшие за диапазон
+        self.total = 0
+
+    def spec(self):
+        return self.x_range, self.z_range, self.bins
+
+    def empty(self):
+        return PositionHistogram(*self.spec())
+
+    def copy(self):
+        other = self.empty()
+        other.counts = self.counts.copy()
+        other.total = self.total
+        return other
+
+    def edges(self):
+        return (np.linspace(self.x_range[0], self.x_range[1], self.bins[0] + 1),
+                np.linspace(self.z_range[0], self.z_range[1], self.bins[1] + 1))
+
+    def add(self, x, z):
+        x = np.asarray(x, dtype=float).ravel()
+        z = np.asarray(z, dtype=float).ravel()
+        self.total += x.size
+        if x.size == 0:
+            return
+        nx, nz = self.bins
+        ix, in_x = bin_index(x, self.x_range, nx)
+        iz, in_z = bin_index(z, self.z_range, nz)
+        inside = in_x & in_z
+        flat = ix[inside] * nz + iz[inside]
+        counts = self.counts.reshape(-1)
+        # Малую порцию дешевле добавить по индексам, большую — через bincount по всей сетке
+        if flat.size < counts.size // 16:
+            np.add.at(counts, flat, 1.0)
+        else:
+            counts += np.bincount(flat, minlength=counts.size)
+
+    def merge(self, other):
+        if other.spec() != self.spec():
+            raise ValueError("Гистограммы с разной сеткой нельзя сложить")
+        self.counts += other.counts
+        self.total += other.total
+        return self
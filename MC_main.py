@@ -1,12 +1,17 @@
+import os
 import sys
-import numpy as np
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QComboBox,
-    QGroupBox, QLabel, QCheckBox, QSpinBox
+    QGroupBox, QLabel, QCheckBox, QSpinBox, QProgressBar
 )
 
 from PySide6.QtCore import Qt
-from MC_algo import get_data
+from MC_cache import ResultCache
+from MC_histogram import PositionHistogram
+from MC_perturb import PhotonHistory
+from MC_scaled import TrajectoryDatabase
+from MC_stats import RunStats
+from MC_worker import SimulationRunner
 from MC_set_layers import get_config
 from MC_set_tumor import get_config_for_tumor
 
@@ -38,9 +43,15 @@ class MainWindow(QMainWindow):
         self.heat = []
         self.bit_value = 1.0
         self.photons_value = 10000
+        self.heat_photons = self.photons_value
+        self.live_updates = 10
         self.wavelength = 650
-        self.final_x = []
-        self.final_z = []
+        # Гистограмма конечных точек фотонов 250×250 считается прямо в движке
+        self.photon_bins = 250
+        self.photon_x_range = (-30, 30)
+        # Глубина окна для изотропного рассеяния, где слоёв нет
+        self.isotropic_depth = 40.0
+        self.final_hist = None
 
         self.mu_a = 5.0
         self.mu_s = 95.0
@@ -52,10 +63,21 @@ class MainWindow(QMainWindow):
         self.is_tumor = True
         self.tumor_type_index = 0
         self.ps_type_index = 0
+        self.engine = 'numpy'
+        self.workers = 1
+        self.result_cache = ResultCache()
+        # При изменении только поглощения (тип опухоли, ФС) результат пересчитывается по истории фотонов
+        self.photon_history = PhotonHistory()
+        # В однородной среде — по базовым траекториям для каждого g при любых mu_a, mu_s, n
+        self.trajectory_db = TrajectoryDatabase()
+        # Счётчики переноса последнего расчёта; с ними кэш и пересчёт по истории не используются
+        self.show_stats = False
+        self.run_stats = None
 
         self.tumor_params = {'cx': 7.5, 'cz': 4.5, 'rx': 2.6, 'rz': 4.0}
-        self.layers_a = [("Эпидермис", 0.0, 3.5), ("Дерма", 3.5, 10.0)]
-        self.layers_b = [("Эпидермис", 0.0, 2.5), ("Дерма", 2.5, 7.0), ("Гипподерма", 7.0, 12.0)]
+        self.layers_a = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+        self.layers_b = [("Эпидермис", 0.0, 2.5, "Эпидермис_светлый"), ("Дерма", 2.5, 7.0, "Дерма_человека"),
+                         ("Гипподерма", 7.0, 12.0, "Подкожный_жир_n10")]
 
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -77,6 +99,11 @@ class MainWindow(QMainWindow):
 
         self.btn_update = QPushButton("Update data")
         self.btn_save = QPushButton("Save plot")
+        self.btn_cancel = QPushButton("Cancel")
+        self.btn_cancel.setEnabled(False)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(0)
 
         self.canvas1 = MplCanvas(self, width=8, height=6, dpi=100)
         self.canvas2 = MplCanvas(self, width=8, height=6, dpi=100)
@@ -104,6 +131,8 @@ class MainWindow(QMainWindow):
         settings_layout.addWidget(self.tumor_params_btn)
         settings_layout.addWidget(self.layers_btn)
         settings_layout.addWidget(self.btn_update)
+        settings_layout.addWidget(self.btn_cancel)
+        settings_layout.addWidget(self.progress_bar)
         settings_layout.addWidget(self.btn_save)
         settings_layout.addStretch()
 
@@ -147,22 +176,62 @@ class MainWindow(QMainWindow):
         p_layout_2.addWidget(self.wave_input)
         wave_box.setLayout(p_layout_2)
 
+        # Блок справа: выбор движка моделирования
+        engine_box = QGroupBox("Движок:")
+        p_layout_3 = QHBoxLayout()
+        self.engine_input = QComboBox()
+        self.engine_input.addItem("NumPy (пакетный)", 'numpy')
+        self.engine_input.addItem("Python (по фотону)", 'python')
+        self.engine_input.setCurrentIndex(self.engine_input.findData(self.engine))
+        p_layout_3.addWidget(self.engine_input)
+        self.workers_input = QSpinBox()
+        self.workers_input.setRange(1, os.cpu_count() or 1)
+        self.workers_input.setValue(self.workers)
+        p_layout_3.addWidget(QLabel("Процессы:"))
+        p_layout_3.addWidget(self.workers_input)
+        self.cb_stats = QCheckBox("Счётчики")
+        self.cb_stats.setChecked(self.show_stats)
+        self.cb_stats.setToolTip("Счётчики переноса и время этапов; расчёт медленнее, кэш не используется")
+        p_layout_3.addWidget(self.cb_stats)
+        engine_box.setLayout(p_layout_3)
+
         opts_widget = QWidget()
         opts_layout = QHBoxLayout(opts_widget)
         opts_layout.addWidget(flags_box)
         opts_layout.addWidget(photons_box)
         opts_layout.addWidget(wave_box)
+        opts_layout.addWidget(engine_box)
         opts_layout.addStretch()
         params_layout.insertWidget(0, opts_widget)
 
+        # Панель счётчиков, видна при включённом флажке «Счётчики»
+        self.stats_box = QGroupBox("Счётчики последнего расчёта:")
+        stats_layout = QVBoxLayout(self.stats_box)
+        self.stats_label = QLabel("Нет данных")
+        self.stats_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        stats_layout.addWidget(self.stats_label)
+        self.stats_box.setVisible(self.show_stats)
+        params_layout.addWidget(self.stats_box)
+
         self.photons_input.valueChanged.connect(self._on_photons_changed)
         self.wave_input.valueChanged.connect(self._on_wavelength_changed)
+        self.engine_input.currentIndexChanged.connect(self._on_engine_changed)
+        self.workers_input.valueChanged.connect(self._on_workers_changed)
+        self.cb_stats.stateChanged.connect(self._on_stats_changed)
         # ---- end ----
 
         # Подключения
         self.combo.currentIndexChanged.connect(self.update_plot)
         self.combo_2.currentIndexChanged.connect(self.update_mode)
         self.btn_update.clicked.connect(self.update_data)
+        self.btn_cancel.clicked.connect(self.cancel_update)
+
+        self.runner = SimulationRunner(self)
+        self.runner.progress.connect(self.progress_bar.setValue)
+        self.runner.partial.connect(self._on_partial_data)
+        self.runner.finished.connect(self._on_data_ready)
+        self.runner.cancelled.connect(self._on_run_stopped)
+        self.runner.failed.connect(self._on_run_failed)
 
         self.btn_save.clicked.connect(self.save_plot)
 
@@ -209,6 +278,16 @@ class MainWindow(QMainWindow):
     def _on_wavelength_changed(self, value):
         self.wavelength = int(value)
 
+    def _on_engine_changed(self, index):
+        self.engine = self.engine_input.itemData(index)
+
+    def _on_workers_changed(self, value):
+        self.workers = int(value)
+
+    def _on_stats_changed(self, state):
+        self.show_stats = bool(state)
+        self.stats_box.setVisible(self.show_stats)
+
     def _on_flag_changed(self, attr_name, state):
         setattr(self, attr_name, bool(state))
 
@@ -246,17 +325,58 @@ class MainWindow(QMainWindow):
             curr_mode = ('A', self.layers_a)
         elif self.combo_2.currentIndex() == 1:
             curr_mode = ('B', self.layers_b)
-        res = get_data(self.mu_a, self.mu_s, self.g, self.n, new_is_vessel=self.is_vessel,
-                       new_is_heterogeneous=self.is_heterogeneous, new_is_tumor=self.is_tumor,
-                       new_photons=self.photons_value, new_wave=self.wavelength, new_cx=self.tumor_params['cx'],
-                       new_cz=self.tumor_params['cz'], new_rx=self.tumor_params['rx'], new_rz=self.tumor_params['rz'],
-                       new_mode=curr_mode, tt_index=self.tumor_type_index, ps_index=self.ps_type_index)
-        heat_res, bit_res, self.final_x, self.final_z = res
+        self.progress_bar.setValue(0)
+        self.btn_cancel.setEnabled(True)
+        self._run_photons = self.photons_value
+        chunk = max(self.photons_value // 2 // self.live_updates, 1000) if self.live_updates else None
+        history = self.photon_history if self.is_heterogeneous else self.trajectory_db
+        histogram = PositionHistogram(self.photon_x_range, (-0.2, self._photons_depth()), self.photon_bins)
+        self.run_stats = RunStats() if self.show_stats else None
+        # Новый запуск вытесняет ещё не закончившийся старый
+        self.runner.start(self.mu_a, self.mu_s, self.g, self.n, new_is_vessel=self.is_vessel,
+                          new_is_heterogeneous=self.is_heterogeneous, new_is_tumor=self.is_tumor,
+                          new_photons=self.photons_value, new_wave=self.wavelength,
+                          new_cx=self.tumor_params['cx'], new_cz=self.tumor_params['cz'],
+                          new_rx=self.tumor_params['rx'], new_rz=self.tumor_params['rz'],
+                          new_mode=curr_mode, tt_index=self.tumor_type_index, ps_index=self.ps_type_index,
+                          engine=self.engine, workers=self.workers, cache=self.result_cache,
+                          histogram=histogram, stats=self.run_stats, history=history, chunk=chunk)
+
+    def cancel_update(self):
+        self.runner.cancel()
+
+    def _on_partial_data(self, done, res):
+        # Промежуточная картина: нормировка по уже посчитанным фотонам
+        heat_res, bit_res, self.final_hist, _ = res
+        self.heat = heat_res
+        self.bit_value = bit_res
+        self.heat_photons = 2 * done
+        self.update_plot()
 
+    def _on_data_ready(self, res):
+        heat_res, bit_res, self.final_hist, _ = res
         self.heat = heat_res
         self.bit_value = bit_res
+        self.heat_photons = self._run_photons
+        self.progress_bar.setValue(100)
+        self.btn_cancel.setEnabled(False)
+        if self.run_stats is not None:
+            self.stats_label.setText(self.run_stats.report())
         self.update_plot()
 
+    def _on_run_stopped(self):
+        self.progress_bar.setValue(0)
+        self.btn_cancel.setEnabled(False)
+        print('Моделирование отменено')
+
+    def _on_run_failed(self, message):
+        self.btn_cancel.setEnabled(False)
+        print(message)
+
+    def closeEvent(self, event):
+        self.runner.wait()
+        super().closeEvent(event)
+
     def plot_heat_density_0(self):
         depths = [i * self.microns_per_bin / 1000 for i in range(self.BINS - 1)]
         densities = []
@@ -327,7 +447,7 @@ class MainWindow(QMainWindow):
     def plot_heat_density(self):
         depths = []
         densities = []
-        t = 4 * 3.14159 * (self.microns_per_bin ** 3) * self.photons_value / 1e12
+        t = 4 * 3.14159 * (self.microns_per_bin ** 3) * self.heat_photons / 1e12
         for i in range(self.BINS - 1):
             r = i * self.microns_per_bin
             val = self.heat[i] / t / (i * i + i + 1.0 / 3.0)
@@ -347,12 +467,17 @@ class MainWindow(QMainWindow):
 
         self.canvas1.draw()
 
+    def _photons_depth(self):
+        if self.combo_2.currentIndex() == 0:
+            return max(layer[2] for layer in self.layers_a)
+        elif self.combo_2.currentIndex() == 1:
+            return max(layer[2] for layer in self.layers_b)
+        return self.isotropic_depth
+
     def plot_photons(self):
         from matplotlib.colors import LinearSegmentedColormap
 
-        nbins = 250
-        xs = np.array(self.final_x)
-        zs = np.array(self.final_z)
+        hist = self.final_hist
 
         colors = [
             '#0b1f4a',
@@ -369,22 +494,15 @@ class MainWindow(QMainWindow):
         contrast_cmap = LinearSegmentedColormap.from_list('contrast_rainbow', colors, N=256)
 
         self.canvas2.axes.clear()
-        if xs.size == 0:
+        if hist is None or hist.total == 0:
             self.canvas2.axes.text(0.5, 0.5, 'Нет данных для графика',
                                    transform=self.canvas2.axes.transAxes,
                                    ha='center', va='center')
             self.canvas2.draw()
             return
-        mx_z = 0.6 * max(zs)
-        if self.combo_2.currentIndex() == 0:
-            mx_z = self.layers_a[1][2]
-        elif self.combo_2.currentIndex() == 1:
-            mx_z = self.layers_b[2][2]
-        mx_xs = [-30, 30]
 
-        H, xedges, zedges = np.histogram2d(xs, zs, bins=[nbins, nbins],
-                                           range=[mx_xs, [-0.2, mx_z]])
-        H *= 2
+        xedges, zedges = hist.edges()
+        H = hist.counts * 2
         extent = [xedges[0], xedges[-1], zedges[0], zedges[-1]]
         im = self.canvas2.axes.imshow(H.T, extent=extent, origin='lower', aspect='auto', cmap=contrast_cmap)
 
@@ -401,7 +519,7 @@ class MainWindow(QMainWindow):
         self.canvas2.axes.set_ylim(extent[2], extent[3])
 
         from matplotlib.ticker import MultipleLocator
-        self.canvas2.axes.xaxis.set_major_locator(MultipleLocator((0.75 * max(xs) - 0.75 * min(xs)) // 10))
+        self.canvas2.axes.xaxis.set_major_locator(MultipleLocator((0.75 * extent[1] - 0.75 * extent[0]) // 10))
         self.canvas2.axes.yaxis.set_major_locator(MultipleLocator(2))
 
         self.canvas2.draw()
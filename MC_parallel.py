@@ -0,0 +1,137 @@
+import os
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+_pools = {}
+_manager = None
+
+
+def _get_pool(workers):
+    # Пул переиспользуется между запусками, чтобы не платить за старт процессов каждый раз
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        _pools[workers] = pool
+    return pool
+
+
+def _shared_event():
+    # Событие отмены, видимое процессам пула: уже запущенные доли останавливаются, а не досчитываются в фоне.
+    # Менеджер запускается один раз, событие — своё у каждого расчёта
+    global _manager
+    if _manager is None:
+        _manager = multiprocessing.get_context('spawn').Manager()
+    return _manager.Event()
+
+
+def wait_shards(futures, shards, total, stop=None, progress=None, cancel=None):
+    # Ждёт futures, сообщая о готовых долях; при отмене останавливает процессы через stop
+    pending = set(futures)
+    while pending:
+        if cancel is not None and cancel.is_set():
+            if stop is not None:
+                stop.set()
+            for future in pending:
+                future.cancel()
+            from MC_vector import SimulationCancelled
+            raise SimulationCancelled()
+        _, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+        if progress is not None:
+            progress(sum(shard for shard, future in zip(shards, futures) if future.done()), total)
+    return [future.result() for future in futures]
+
+
+def split_photons(total, workers):
+    base, extra = divmod(total, workers)
+    return [base + (1 if i < extra else 0) for i in range(workers)]
+
+
+def _run_shard(args, kwargs):
+    from MC_algo import create_simulation
+    kwargs = dict(kwargs)
+    engine = kwargs.pop('engine', 'python')
+    kwargs.pop('workers', None)
+    cancel = kwargs.pop('cancel', None)
+    sim = create_simulation(*args, **kwargs)
+    sim.run(engine, cancel=cancel)
+    final_x, final_z = sim.end_points()
+    if final_z is None:
+        # Гистограмма конечных точек
+        return (list(sim.heat), sim.bit, final_x, None, sim.rd, sim.reservoir, sim.stats, sim.voxels, sim.cylinder,
+                sim.reflectance)
+    return (list(sim.heat), sim.bit, np.asarray(final_x), np.asarray(final_z), sim.rd, sim.reservoir, sim.stats,
+            sim.voxels, sim.cylinder, sim.reflectance)
+
+
+def get_data_parallel(*args, workers=None, seed=None, progress=None, cancel=None, **kwargs):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    photons = kwargs.pop('new_photons', 20000)
+    # Каждый процесс собирает свою выборку конечных точек, в конце они объединяются в reservoir
+    reservoir = kwargs.pop('reservoir', None)
+    # Счётчики процессов складываются в stats, время этапов — суммарное по процессам
+    stats = kwargs.pop('stats', None)
+    # Сетки вокселей, (r, z) и отражения процессов складываются в voxels, cylinder и reflectance
+    voxels = kwargs.pop('voxels', None)
+    cylinder = kwargs.pop('cylinder', None)
+    reflectance = kwargs.pop('reflectance', None)
+
+    # get_data моделирует new_photons // 2 фотонов, поэтому делим именно их
+    shards = split_photons(photons // 2, workers)
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    stop = _shared_event() if cancel is not None else None
+    jobs = []
+    for shard, child in zip(shards, seeds):
+        if shard == 0 and jobs:
+            continue
+        shard_kwargs = dict(kwargs, new_photons=2 * shard, seed=child, workers=1, cancel=stop)
+        if reservoir is not None:
+            shard_kwargs['reservoir'] = reservoir.empty(child.spawn(1)[0])
+        if stats is not None:
+            shard_kwargs['stats'] = type(stats)()
+        if voxels is not None:
+            shard_kwargs['voxels'] = voxels.empty()
+        if cylinder is not None:
+            shard_kwargs['cylinder'] = cylinder.empty()
+        if reflectance is not None:
+            shard_kwargs['reflectance'] = reflectance.empty()
+        jobs.append((args, shard_kwargs))
+
+    start = time.perf_counter()
+    pool = _get_pool(workers)
+    futures = [pool.submit(_run_shard, job_args, job_kwargs) for job_args, job_kwargs in jobs]
+    results = wait_shards(futures, [job[1]['new_photons'] // 2 for job in jobs], photons // 2, stop, progress,
+                          cancel)
+    if stats is not None:
+        stats.add_time('pool', time.perf_counter() - start)
+
+    # Слияние в порядке номеров процессов: одинаковые seed и workers дают одинаковый результат
+    heat = np.zeros(len(results[0][0]))
+    bit = 0.0
+    rd = 0.0
+    for (shard_heat, shard_bit, _, _, shard_rd, shard_reservoir, shard_stats, shard_voxels, shard_cylinder,
+         shard_reflectance) in results:
+        heat += shard_heat
+        bit += shard_bit
+        rd += shard_rd
+        if reservoir is not None:
+            reservoir.merge(shard_reservoir)
+        if stats is not None:
+            stats.merge(shard_stats)
+        if voxels is not None:
+            voxels.merge(shard_voxels)
+        if cylinder is not None:
+            cylinder.merge(shard_cylinder)
+        if reflectance is not None:
+            reflectance.merge(shard_reflectance)
+    if results[0][3] is None:
+        final_x, final_z = results[0][2].empty(), None
+        for res in results:
+            final_x.merge(res[2])
+    else:
+        final_x = np.concatenate([res[2] for res in results])
+        final_z = np.concatenate([res[3] for res in results])
+    return heat.tolist(), bit, final_x, final_z, rd
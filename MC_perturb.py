@@ -0,0 +1,211 @@
+import math
+
+import numpy as np
+
+from MC_scene import Scene
+from MC_vector import (PhotonBatch, SimulationCancelled, _hop, _bounce, _drop, _roulette, _spin, _snapshot, BINS,
+                       BATCH_SIZE, microns_per_bin)
+
+# Поля сцены, от которых зависит только поглощение. Траектории (шаги в длинах свободного пробега общего
+# mu_a + mu_s, рассеяние, отражение на границе) от них не зависят, поэтому при их изменении историю
+# можно пересчитать с новыми весами без повторной трассировки.
+ABSORPTION_FIELDS = ('mu_a', 'mu_a_bg', 'mu_a_bg_layers', 'mu_a_bg_rows', 'mu_a_vessel', 'coef', 'coef_rows',
+                     'mu_a_tumor', 'mu_s_tumor', 'g_tumor', 'n_tumor')
+GRID_FIELDS = ('grid_x0', 'grid_z0', 'grid_nx', 'grid_nz', 'inv_dx', 'inv_dz')
+# Байт на одно взаимодействие во время записи: номер фотона и пять float32
+EVENT_BYTES = 24
+
+
+def _same(a, b):
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return np.array_equal(np.asarray(a), np.asarray(b))
+    return a == b
+
+
+class PhotonHistory:
+    # Сжатая история взаимодействий фотонов для пересчёта при другом поглощении (пертурбационный Монте-Карло).
+    # Для каждого взаимодействия хранятся точка (x, z), расстояние от точки входа, косинус угла к нормали
+    # при отражении от границы перед ним (cos, 0 — если фотон границы не касался) и множитель рулетки после
+    # него (q: 1, 1/шанс или 0). Взаимодействия одного фотона идут подряд, counts — их число у каждого
+    # фотона; последнее взаимодействие — гибель в рулетке, его точка — конечная точка фотона.
+    # Все записанные данные заменяются одной ссылкой, поэтому историю можно читать из другого потока,
+    # пока новая запись ещё идёт.
+    __slots__ = ('_data', 'max_bytes')
+    FIELDS = ('scene', 'photons', 'counts', 'x', 'z', 'dist', 'cos', 'q')
+
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self._data = None
+        self.max_bytes = max_bytes
+
+    def __len__(self):
+        return 0 if self._data is None else self._data['x'].size
+
+    @property
+    def data(self):
+        return self._data
+
+    def nbytes(self):
+        data = self._data
+        if data is None:
+            return 0
+        return sum(data[name].nbytes for name in self.FIELDS[2:])
+
+    def matches(self, scene, photons):
+        return self._matches(self._data, scene, photons)
+
+    @staticmethod
+    def _matches(data, scene, photons):
+        # История подходит, если новая сцена отличается от записанной только поглощением
+        if data is None or photons != data['photons'] or type(scene) is not type(data['scene']):
+            return False
+        recorded = data['scene']
+        for name in Scene.__slots__ + GRID_FIELDS:
+            if name in ABSORPTION_FIELDS:
+                continue
+            if not _same(getattr(scene, name, None), getattr(recorded, name, None)):
+                return False
+        return _same(scene.coef[:, 1:], recorded.coef[:, 1:])
+
+    def record(self, scene, photons, seed=None, batch_size=BATCH_SIZE, progress=None, cancel=None):
+        for snapshot in self.iter_record(scene, photons, seed, batch_size=batch_size, progress=progress,
+                                         cancel=cancel):
+            pass
+        return snapshot[1:]
+
+    def iter_record(self, scene, photons, seed=None, chunk=None, batch_size=BATCH_SIZE, progress=None, cancel=None,
+                    stop_on_overflow=False):
+        # Тот же цикл, что и iter_mc_vectorized (и тот же поток случайных чисел), с записью множителей веса.
+        # История заполняется, только если цикл дошёл до конца; если запись превысила max_bytes, она
+        # бросается, а моделирование продолжается как обычно. С stop_on_overflow моделирование сразу
+        # прекращается без итога — и при превышении, и когда после первой партии фотонов уже записанное
+        # в пересчёте на все фотоны (по запущенным, то есть с запасом вниз) больше max_bytes
+        rng = np.random.default_rng(seed)
+        if not chunk:
+            chunk = max(photons, 1)
+        n = scene.n
+        rs = (n - 1.0) * (n - 1.0) / ((n + 1.0) * (n + 1.0))
+        crit_angle = math.sqrt(max(0.0, 1.0 - 1.0 / (n * n)))
+        bins_per_mfp = 1e4 / microns_per_bin / (scene.mu_a + scene.mu_s)
+
+        heat = np.zeros(BINS)
+        rd = bit = tumor_dose = 0.0
+        final_x = []
+        final_z = []
+        steps = []
+        recorded = 0
+
+        b = PhotonBatch()
+        ids = np.zeros(0, dtype=np.int32)
+        launched = 0
+        next_yield = min(chunk, photons)
+        percent = -1
+        while launched < photons or len(b):
+            if cancel is not None and cancel.is_set():
+                raise SimulationCancelled()
+            completed = launched - len(b)
+            if (stop_on_overflow and completed >= min(batch_size, photons) > 0
+                    and recorded * photons > self.max_bytes * launched):
+                return
+            if progress is not None:
+                done = completed * 100 // max(photons, 1)
+                if done != percent:
+                    percent = done
+                    progress(completed, photons)
+            if completed >= next_yield and completed < photons:
+                next_yield = min(next_yield + chunk, photons)
+                yield _snapshot(completed, heat, bit, final_x, final_z, rd, tumor_dose)
+
+            count = min(batch_size - len(b), photons - launched)
+            if count > 0:
+                b.refill(count, 1.0 - rs)
+                ids = np.concatenate((ids, np.arange(launched, launched + count, dtype=np.int32)))
+                launched += count
+
+            _hop(b, rng)
+            hit = b.z <= 0.0
+            rd += _bounce(scene, b, crit_angle)
+            tumor_dose += _drop(scene, b, heat, bins_per_mfp)
+            dropped = b.weight.copy()
+            bit += _roulette(b, rng, final_x, final_z)
+            if steps is not None:
+                steps.append((ids, b.x.astype(np.float32), b.z.astype(np.float32),
+                              np.sqrt(b.x * b.x + b.y * b.y + b.z * b.z).astype(np.float32),
+                              np.where(hit, b.w, 0.0).astype(np.float32), (b.weight / dropped).astype(np.float32)))
+                recorded += EVENT_BYTES * len(b)
+                if recorded > self.max_bytes:
+                    if stop_on_overflow:
+                        return
+                    print('История фотонов не записана: превышен max_bytes')
+                    steps = None
+            _spin(scene, b, rng)
+
+            if not b.alive.all():
+                ids = ids[b.alive]
+                b.compact()
+        if progress is not None:
+            progress(photons, photons)
+
+        fx = np.concatenate(final_x) if final_x else np.zeros(0)
+        fz = np.concatenate(final_z) if final_z else np.zeros(0)
+        if steps is not None:
+            # Сортировка по номеру фотона; устойчивая, поэтому взаимодействия остаются в порядке времени
+            columns = [np.concatenate(column) for column in zip(*steps)] if steps else [np.zeros(0)] * 6
+            steps = None
+            order = np.argsort(columns[0], kind='stable')
+            self._data = dict(zip(self.FIELDS, [scene, photons, np.bincount(columns[0], minlength=photons)
+                                                .astype(np.int32)] + [column[order] for column in columns[1:]]))
+        yield photons, heat.tolist(), bit, fx, fz, rd, tumor_dose
+
+    def reweight(self, scene, photons=None):
+        # Пересчёт накопленных величин для сцены с другим поглощением. Если передано photons и история
+        # к сцене не подходит, возвращает None
+        data = self._data
+        if photons is not None and not self._matches(data, scene, photons):
+            return None
+        return tally(data, scene, data['photons'])
+
+
+def tally(data, scene, photons):
+    # Накопленные величины по записанной истории первых photons фотонов для сцены scene: вес перед
+    # взаимодействием — произведение множителей всех предыдущих взаимодействий фотона
+    counts = data['counts'][:photons]
+    end = int(counts.sum())
+    x = data['x'][:end].astype(float)
+    z = data['z'][:end].astype(float)
+    cos = data['cos'][:end].astype(float)
+    q = data['q'][:end].astype(float)
+
+    n = scene.n
+    rs = (n - 1.0) * (n - 1.0) / ((n + 1.0) * (n + 1.0))
+    crit_angle = math.sqrt(max(0.0, 1.0 - 1.0 / (n * n)))
+    rf = np.ones(end)
+    out = cos > crit_angle
+    if out.any():
+        w = cos[out]
+        n_local = scene.n_array(x[out], z[out]) if scene.is_heterogeneous else n
+        t = np.sqrt(np.maximum(0.0, 1.0 - n_local * n_local * (1.0 - w * w)))
+        temp1 = (w - n_local * t) / (w + n_local * t)
+        temp = (t - n_local * w) / (t + n_local * w)
+        rf[out] = (temp1 * temp1 + temp * temp) / 2.0
+    if scene.is_heterogeneous:
+        albedo = scene.albedo_array(x, z)
+    else:
+        albedo = np.full(end, scene.mu_s / (scene.mu_a + scene.mu_s))
+
+    # Логарифмы множителей, накопленные внутри каждого фотона (гибель в рулетке — всегда последнее
+    # взаимодействие, после неё вес уже не нужен)
+    log_factor = np.log(rf) + np.log(albedo) + np.log(np.where(q > 0.0, q, 1.0))
+    total = np.cumsum(log_factor) - log_factor
+    starts = np.repeat(total[np.cumsum(counts) - counts], counts)
+    before = (1.0 - rs) * np.exp(total - starts)
+
+    bins_per_mfp = 1e4 / microns_per_bin / (scene.mu_a + scene.mu_s)
+    bin_idx = np.minimum((data['dist'][:end] * bins_per_mfp).astype(np.int64), BINS - 1)
+    bounced = before * rf
+    deposit = (1.0 - albedo) * bounced
+    heat = np.bincount(bin_idx, weights=deposit, minlength=BINS)
+    rd = float(((1.0 - rf) * before).sum())
+    bit = float((bounced * albedo * (q - 1.0)).sum())
+    tumor_dose = float(deposit[scene.in_tumor_array(x, z)].sum()) if scene.is_tumor else 0.0
+    last = np.cumsum(counts) - 1
+    return heat.tolist(), bit, x[last], z[last], rd, tumor_dose
@@ -1,10 +1,16 @@
 import csv
-from typing import Dict, List, Tuple
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
 
 CoeffEntry = Dict[str, float]
 TissueData = List[Tuple[float, CoeffEntry]]
 AllData = Dict[str, TissueData]
 
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "MC_parameters.csv")
+COEFF_NAMES = ('mu_a', 'mu_s', 'g', 'n')
+
 
 def _to_float_safe(s: str) -> float:
     s = s.strip()
@@ -54,48 +60,76 @@ def load_coefficients_csv(path: str, delimiter: str = ';') -> AllData:
     return data
 
 
-def get_coefficients_for(tissue: str, wavelength: float, method: str = 'nearest') -> CoeffEntry:
-    data = load_coefficients_csv("MC_parameters.csv", delimiter=';')
+class CoefficientStore:
+    # Таблица коэффициентов, прочитанная один раз и перечитываемая только при изменении файла
+    def __init__(self, path: str = DEFAULT_PATH, delimiter: str = ';'):
+        self.path = path
+        self.delimiter = delimiter
+        self._mtime: Optional[int] = None
+        self._tables: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def _ensure_loaded(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        data = load_coefficients_csv(self.path, delimiter=self.delimiter)
+        tables = {}
+        for tissue, entries in data.items():
+            lam = np.array([lam for lam, _ in entries], dtype=float)
+            coeffs = np.array([[coeff[k] for k in COEFF_NAMES] for _, coeff in entries], dtype=float)
+            tables[tissue] = (lam, coeffs)
+        self._tables = tables
+        self._mtime = mtime
+
+    def tissues(self) -> List[str]:
+        self._ensure_loaded()
+        return list(self._tables.keys())
+
+    def table(self, tissue: str) -> Tuple[np.ndarray, np.ndarray]:
+        self._ensure_loaded()
+        if tissue not in self._tables:
+            raise KeyError(f"Unknown tissue type: {tissue}")
+        lam, coeffs = self._tables[tissue]
+        if lam.size == 0:
+            raise ValueError(f"No coefficients for tissue {tissue}")
+        return lam, coeffs
+
+    def lookup(self, tissues: Sequence[str], wavelengths, method: str = 'nearest') -> np.ndarray:
+        # Результат: массив (ткани, длины волн, 4) в порядке COEFF_NAMES
+        wl = np.atleast_1d(np.asarray(wavelengths, dtype=float))
+        out = np.empty((len(tissues), wl.size, len(COEFF_NAMES)))
+        for row, tissue in enumerate(tissues):
+            out[row] = _interpolate(*self.table(tissue), wl, method)
+        return out
+
+
+def _interpolate(lam: np.ndarray, coeffs: np.ndarray, wl: np.ndarray, method: str) -> np.ndarray:
+    if method == 'nearest':
+        idx = np.abs(lam[:, None] - wl[None, :]).argmin(axis=0)
+        return coeffs[idx]
 
-    if tissue not in data:
-        raise KeyError(f"Unknown tissue type: {tissue}")
-    entries = data[tissue]
-    if not entries:
-        raise ValueError(f"No coefficients for tissue {tissue}")
+    if method == 'linear':
+        if lam.size == 1:
+            return np.repeat(coeffs, wl.size, axis=0)
+        # Ниже диапазона берётся первая точка, выше — линейная экстраполяция по двум последним
+        i = np.clip(np.searchsorted(lam, wl, side='right') - 1, 0, lam.size - 2)
+        t = np.maximum((wl - lam[i]) / (lam[i + 1] - lam[i]), 0.0)[:, None]
+        return (1.0 - t) * coeffs[i] + t * coeffs[i + 1]
 
-    lam_values = [lam for lam, _ in entries]
-    coeffs_list = [coeff for _, coeff in entries]
+    raise ValueError(f"Unknown method: {method}. Use 'nearest' or 'linear'.")
 
-    if method == 'neares':
-        idx = min(range(len(lam_values)), key=lambda i: abs(lam_values[i] - wavelength))
-        return coeffs_list[idx]
 
-    if method == 'linear':
-        for lam, coeff in entries:
-            if lam == wavelength:
-                return coeff
-        if wavelength <= lam_values[0]:
-            i = 0
-            j = 0
-        elif wavelength >= lam_values[-1]:
-            i = len(lam_values) - 2
-            j = len(lam_values) - 1 if len(lam_values) >= 2 else 0
-        else:
-            i = max(idx for idx in range(len(lam_values)) if lam_values[idx] <= wavelength)
-            j = i + 1
-
-        lam_i = lam_values[i]
-        lam_j = lam_values[j]
-        c_i = coeffs_list[i]
-        c_j = coeffs_list[j]
-
-        if lam_j == lam_i:
-            return c_i
-
-        t = (wavelength - lam_i) / (lam_j - lam_i)
-        interp: CoeffEntry = {}
-        for k in c_i.keys():
-            interp[k] = c_i[k] + (c_j[k] - c_i[k]) * t
-        return interp
+_store = CoefficientStore()
 
-    raise ValueError(f"Unknown method: {method}. Use 'nearest' or 'linear'.")
+
+def get_tissue_names() -> List[str]:
+    return _store.tissues()
+
+
+def get_coefficients_many(tissues: Sequence[str], wavelengths, method: str = 'linear') -> np.ndarray:
+    return _store.lookup(tissues, wavelengths, method)
+
+
+def get_coefficients_for(tissue: str, wavelength: float, method: str = 'nearest') -> CoeffEntry:
+    values = _store.lookup([tissue], [wavelength], method)[0, 0]
+    return {k: float(v) for k, v in zip(COEFF_NAMES, values)}
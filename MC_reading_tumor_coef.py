@@ -1,40 +1,41 @@
 from typing import Dict, Optional
 
+import numpy as np
 
-def get_optical_properties(tumor_type: str, wavelength: float, photosensitizer: Optional[str] = None) -> Dict[
-    str, float]:
-
-    optical_data = {
-        "Меланома": {
-            (350, 400): {"mu_a": 10.0, "mu_s": 350.0, "g": 0.78, "n": 1.41},
-            (400, 500): {"mu_a": 5.0, "mu_s": 300.0, "g": 0.80, "n": 1.40},
-            (500, 600): {"mu_a": 5.0, "mu_s": 220.0, "g": 0.83, "n": 1.395},
-            (600, 700): {"mu_a": 1.0, "mu_s": 180.0, "g": 0.85, "n": 1.39}
-        },
-        "Базалиома": {
-            (350, 400): {"mu_a": 4.0, "mu_s": 190.0, "g": 0.85, "n": 1.39},
-            (400, 500): {"mu_a": 3.5, "mu_s": 180.0, "g": 0.86, "n": 1.385},
-            (500, 600): {"mu_a": 3.0, "mu_s": 170.0, "g": 0.865, "n": 1.382},
-            (600, 700): {"mu_a": 2.5, "mu_s": 160.0, "g": 0.87, "n": 1.38}
-        }
+OPTICAL_DATA = {
+    "Меланома": {
+        (350, 400): {"mu_a": 10.0, "mu_s": 350.0, "g": 0.78, "n": 1.41},
+        (400, 500): {"mu_a": 5.0, "mu_s": 300.0, "g": 0.80, "n": 1.40},
+        (500, 600): {"mu_a": 5.0, "mu_s": 220.0, "g": 0.83, "n": 1.395},
+        (600, 700): {"mu_a": 1.0, "mu_s": 180.0, "g": 0.85, "n": 1.39}
+    },
+    "Базалиома": {
+        (350, 400): {"mu_a": 4.0, "mu_s": 190.0, "g": 0.85, "n": 1.39},
+        (400, 500): {"mu_a": 3.5, "mu_s": 180.0, "g": 0.86, "n": 1.385},
+        (500, 600): {"mu_a": 3.0, "mu_s": 170.0, "g": 0.865, "n": 1.382},
+        (600, 700): {"mu_a": 2.5, "mu_s": 160.0, "g": 0.87, "n": 1.38}
     }
+}
 
-    photosensitizer_absorption = {
-        "PpIX": {
-            (620, 650): 5.0,
-            (400, 420): 10.0
-        },
-        "Вертепорфин": {
-            (680, 690): 4.0
-        },
-        "Фотофрин": {
-            (625, 635): 6.0
-        }
+PHOTOSENSITIZER_ABSORPTION = {
+    "PpIX": {
+        (620, 650): 5.0,
+        (400, 420): 10.0
+    },
+    "Вертепорфин": {
+        (680, 690): 4.0
+    },
+    "Фотофрин": {
+        (625, 635): 6.0
     }
+}
 
+
+def get_optical_properties(tumor_type: str, wavelength: float, photosensitizer: Optional[str] = None) -> Dict[
+    str, float]:
     mu_a, mu_s, g, n = None, None, None, None
 
-    tissue_tumor_properties = optical_data[tumor_type]
+    tissue_tumor_properties = OPTICAL_DATA[tumor_type]
     for (min_wl, max_wl), props in tissue_tumor_properties.items():
         if min_wl <= wavelength <= max_wl:
             mu_a = props["mu_a"]
@@ -44,7 +45,7 @@ def get_optical_properties(tumor_type: str, wavelength: float, photosensitizer:
             break
 
     if photosensitizer:
-        ps_data = photosensitizer_absorption[photosensitizer]
+        ps_data = PHOTOSENSITIZER_ABSORPTION[photosensitizer]
         ps_found_wavelength_range = False
         for (min_wl_ps, max_wl_ps), ps_mu_a_contrib in ps_data.items():
             if min_wl_ps <= wavelength <= max_wl_ps:
@@ -55,3 +56,23 @@ def get_optical_properties(tumor_type: str, wavelength: float, photosensitizer:
             pass
 
     return {"mu_a": mu_a, "mu_s": mu_s, "g": g, "n": n}
+
+
+def get_optical_properties_many(tumor_type: str, wavelengths, photosensitizer: Optional[str] = None) -> np.ndarray:
+    # То же для массива длин волн сразу: строки (mu_a, mu_s, g, n), вне диапазонов — nan.
+    # Как и в get_optical_properties, на границе диапазонов берётся первый подходящий
+    wl = np.asarray(wavelengths, dtype=float)
+    result = np.full((len(wl), 4), np.nan)
+    found = np.zeros(len(wl), dtype=bool)
+    for (min_wl, max_wl), props in OPTICAL_DATA[tumor_type].items():
+        hit = ~found & (min_wl <= wl) & (wl <= max_wl)
+        result[hit] = (props["mu_a"], props["mu_s"], props["g"], props["n"])
+        found |= hit
+
+    if photosensitizer:
+        added = np.zeros(len(wl), dtype=bool)
+        for (min_wl_ps, max_wl_ps), ps_mu_a_contrib in PHOTOSENSITIZER_ABSORPTION[photosensitizer].items():
+            hit = ~added & (min_wl_ps <= wl) & (wl <= max_wl_ps)
+            result[hit, 0] += ps_mu_a_contrib
+            added |= hit
+    return result
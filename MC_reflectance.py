@@ -0,0 +1,100 @@
+import math
+
+import numpy as np
+
+from MC_histogram import bin_index
+
+# Сетка по умолчанию: шаг и число бинов по r (в координатах движка) и число бинов угла выхода на [0, π/2]
+DR = 0.1
+NR = 100
+NA = 30
+XY_BINS = 100
+
+
+class ReflectanceTally:
+    # Диффузное отражение в момент выхода фотона через поверхность, как Rd_ra в MCML: по расстоянию r от точки
+    # входа и углу выхода наружу (после преломления), при xy_range — ещё и изображение поверхности x–y.
+    # Всё дальше nr * dr попадает в последний бин по r; total — весь вышедший вес, равный rd движка
+    __slots__ = ('dr', 'nr', 'na', 'xy_range', 'xy_bins', 'rd_ra', 'image', 'total')
+
+    def __init__(self, dr=DR, nr=NR, na=NA, xy_range=None, xy_bins=XY_BINS):
+        self.dr = float(dr)
+        self.nr, self.na = int(nr), int(na)
+        self.xy_range = None if xy_range is None else (float(xy_range[0]), float(xy_range[1]))
+        self.xy_bins = int(xy_bins)
+        self.rd_ra = np.zeros((self.nr, self.na))
+        self.image = None if xy_range is None else np.zeros((self.xy_bins, self.xy_bins))
+        self.total = 0.0
+
+    def spec(self):
+        return self.dr, self.nr, self.na, self.xy_range, self.xy_bins
+
+    def empty(self):
+        return ReflectanceTally(*self.spec())
+
+    def add(self, x, y, w, n, weights):
+        # x, y — точка выхода, w — косинус угла к нормали внутри среды, n — показатель преломления в точке
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+        w = np.asarray(w, dtype=float).ravel()
+        weights = np.asarray(weights, dtype=float).ravel()
+        if x.size == 0:
+            return
+        self.total += float(weights.sum())
+        ir = np.minimum((np.hypot(x, y) * (1.0 / self.dr)).astype(np.int64), self.nr - 1)
+        # Угол снаружи по закону Снелла: sin = n sin внутри
+        n = np.asarray(n, dtype=float)
+        t = np.sqrt(np.maximum(0.0, 1.0 - n * n * (1.0 - w * w)))
+        ia = np.minimum((np.arccos(np.minimum(t, 1.0)) * (self.na / (0.5 * math.pi))).astype(np.int64), self.na - 1)
+        self.rd_ra += np.bincount(ir * self.na + ia, weights=weights,
+                                  minlength=self.nr * self.na).reshape(self.nr, self.na)
+        if self.image is not None:
+            ix, in_x = bin_index(x, self.xy_range, self.xy_bins)
+            iy, in_y = bin_index(y, self.xy_range, self.xy_bins)
+            inside = in_x & in_y
+            self.image += np.bincount(ix[inside] * self.xy_bins + iy[inside], weights=weights[inside],
+                                      minlength=self.image.size).reshape(self.image.shape)
+
+    def merge(self, other):
+        if other.spec() != self.spec():
+            raise ValueError("Сетки отражения с разным шагом нельзя сложить")
+        self.rd_ra += other.rd_ra
+        if self.image is not None:
+            self.image += other.image
+        self.total += other.total
+        return self
+
+    def r_centers(self):
+        return (np.arange(self.nr) + 0.5) * self.dr
+
+    def angle_centers(self):
+        return (np.arange(self.na) + 0.5) * (0.5 * math.pi / self.na)
+
+    # ---- нормировка как в MCML: на число запущенных фотонов ----
+
+    def radial(self, photons):
+        # Rd(r): доля на единицу площади кольца 2π r dr
+        return self.rd_ra.sum(axis=1) / (2.0 * math.pi * self.r_centers() * self.dr) / max(photons, 1)
+
+    def angular(self, photons):
+        # Rd(a): доля на стерадиан, телесный угол бина 4π sin(a) sin(da / 2)
+        da = 0.5 * math.pi / self.na
+        solid = 4.0 * math.pi * np.sin(self.angle_centers()) * math.sin(0.5 * da)
+        return self.rd_ra.sum(axis=0) / solid / max(photons, 1)
+
+    def surface(self, photons):
+        # Изображение x–y: доля на единицу площади пикселя
+        lo, hi = self.xy_range
+        pixel = ((hi - lo) / self.xy_bins) ** 2
+        return self.image / pixel / max(photons, 1)
+
+    def fraction(self, photons):
+        return self.total / max(photons, 1)
+
+    def arrays(self, photons, prefix='rd_'):
+        # Для сохранения в .npz
+        data = {prefix + 'ra': self.rd_ra, prefix + 'r': self.radial(photons), prefix + 'a': self.angular(photons),
+                prefix + 'r_centers': self.r_centers(), prefix + 'a_centers': self.angle_centers()}
+        if self.image is not None:
+            data[prefix + 'xy'] = self.surface(photons)
+        return data
@@ -0,0 +1,81 @@
+import numpy as np
+
+CAPACITY = 10000
+
+
+class EndPointReservoir:
+    # Равномерная выборка не больше capacity конечных точек фотонов (x, y, z, вес перед гибелью, число
+    # взаимодействий) из любого их числа — резервуарная выборка. Массивы выделяются сразу на capacity,
+    # seen — сколько точек через неё прошло. Выборки разных процессов объединяются merge.
+    __slots__ = ('capacity', 'seen', 'x', 'y', 'z', 'weight', 'steps', '_rng')
+    FIELDS = ('x', 'y', 'z', 'weight', 'steps')
+
+    def __init__(self, capacity=CAPACITY, seed=None):
+        self.capacity = int(capacity)
+        self.seen = 0
+        self.x = np.zeros(self.capacity)
+        self.y = np.zeros(self.capacity)
+        self.z = np.zeros(self.capacity)
+        self.weight = np.zeros(self.capacity)
+        self.steps = np.zeros(self.capacity, dtype=np.int32)
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return min(self.seen, self.capacity)
+
+    def empty(self, seed=None):
+        return EndPointReservoir(self.capacity, seed)
+
+    def data(self):
+        size = len(self)
+        return {name: getattr(self, name)[:size] for name in self.FIELDS}
+
+    def _put(self, slots, columns, rows):
+        for name, column in zip(self.FIELDS, columns):
+            getattr(self, name)[slots] = column[rows]
+
+    def add(self, x, y, z, weight, steps):
+        columns = [np.asarray(column).ravel() for column in (x, y, z, weight, steps)]
+        count = columns[0].size
+        if count == 0:
+            return
+        # Пока выборка не заполнена, точки просто дописываются
+        fill = min(max(self.capacity - self.seen, 0), count)
+        if fill:
+            self._put(slice(self.seen, self.seen + fill), columns, slice(0, fill))
+        # Точка с номером i (с нуля) заменяет случайную ячейку с вероятностью capacity / (i + 1)
+        if fill < count:
+            index = self.seen + np.arange(fill, count)
+            slots = self._rng.integers(0, index + 1)
+            taken = np.flatnonzero(slots < self.capacity)
+            # Если несколько точек пакета попали в одну ячейку, остаётся последняя, как при добавлении по одной
+            slots = slots[taken]
+            _, last = np.unique(slots[::-1], return_index=True)
+            keep = taken.size - 1 - last
+            self._put(slots[keep], columns, fill + taken[keep])
+        self.seen += count
+
+    def merge(self, other):
+        # Объединённая выборка равномерна по всем seen + other.seen точкам: сколько взять из каждой,
+        # определяет гипергеометрическое распределение
+        if other.capacity != self.capacity:
+            raise ValueError("Выборки разного размера нельзя объединить")
+        total = self.seen + other.seen
+        size = min(self.capacity, total)
+        if other.seen == 0:
+            return self
+        if self.seen == 0:
+            own = 0
+        else:
+            own = int(self._rng.hypergeometric(self.seen, other.seen, size))
+        mine = self._rng.choice(len(self), own, replace=False)
+        theirs = self._rng.choice(len(other), size - own, replace=False)
+        for name in self.FIELDS:
+            column = getattr(self, name)
+            merged = np.concatenate((column[mine], getattr(other, name)[theirs]))
+            column[:size] = merged
+        self.seen = total
+        return self
+
+    def save(self, path):
+        np.savez(path, seen=np.int64(self.seen), **self.data())
@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from MC_perturb import PhotonHistory, tally
+from MC_scene import Scene
+from MC_vector import iter_mc_vectorized
+
+
+class TrajectoryDatabase:
+    # Масштабируемый Монте-Карло для однородной среды. В однородной среде траектория фотона в длинах
+    # свободного пробега зависит только от g: mu_s и mu_a меняют лишь альбедо и масштаб глубины, n — только
+    # отражение на границе. Поэтому для каждого g хранится одна базовая история, записанная с поглощением
+    # reference_fraction от запрошенного, и любые коэффициенты с таким же g и не меньшей долей поглощения
+    # mu_a / mu_s пересчитываются по ней без трассировки. Меньшее число фотонов берётся из начала истории.
+    # Хранится не больше max_entries историй (каждая до max_bytes), давно не использованные вытесняются
+    __slots__ = ('reference_fraction', 'max_bytes', 'max_entries', '_entries', '_lock')
+
+    def __init__(self, reference_fraction=0.25, max_bytes=128 * 1024 * 1024, max_entries=4):
+        self.reference_fraction = reference_fraction
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _entry(self, scene, photons):
+        if scene.is_heterogeneous:
+            return None
+        with self._lock:
+            entry = self._entries.get(scene.g)
+            if entry is not None:
+                self._entries.move_to_end(scene.g)
+        if entry is None or entry['photons'] < photons:
+            return None
+        recorded = entry['scene']
+        # Перевзвешивание к меньшему поглощению, чем у базовой истории, дало бы большую дисперсию
+        if scene.mu_a * recorded.mu_s < recorded.mu_a * scene.mu_s * (1.0 - 1e-12):
+            return None
+        return entry
+
+    def reweight(self, scene, photons):
+        entry = self._entry(scene, photons)
+        if entry is None:
+            return None
+        return tally(entry, scene, photons)
+
+    def record(self, scene, photons, seed=None, progress=None, cancel=None):
+        for snapshot in self.iter_record(scene, photons, seed, progress=progress, cancel=cancel):
+            pass
+        return snapshot[1:]
+
+    def iter_record(self, scene, photons, seed=None, chunk=None, progress=None, cancel=None):
+        # Базовая история считается с уменьшенным поглощением, поэтому промежуточных результатов нет:
+        # отдаётся только итог, пересчитанный к запрошенной сцене
+        if scene.is_heterogeneous:
+            raise ValueError("TrajectoryDatabase работает только с однородной средой")
+        reference = _reference_scene(scene, self.reference_fraction)
+        history = PhotonHistory(self.max_bytes)
+        for _ in history.iter_record(reference, photons, seed, progress=progress, cancel=cancel,
+                                     stop_on_overflow=True):
+            pass
+        entry = history.data
+        if entry is None:
+            # История не уместится в max_bytes — базовый расчёт остановлен на первой партии (или раньше),
+            # запрошенная сцена считается обычным способом
+            yield from iter_mc_vectorized(scene, photons, chunk, rng=np.random.default_rng(seed), progress=progress,
+                                          cancel=cancel)
+            return
+        with self._lock:
+            self._entries[scene.g] = entry
+            self._entries.move_to_end(scene.g)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        yield (photons,) + tuple(tally(entry, scene, photons))
+
+
+def _reference_scene(scene, fraction):
+    reference = Scene.__new__(Scene)
+    for name in Scene.__slots__:
+        setattr(reference, name, getattr(scene, name))
+    reference.mu_a = scene.mu_a * fraction
+    return reference
@@ -0,0 +1,377 @@
+import math
+from array import array
+from bisect import bisect_right
+
+import numpy as np
+
+# Множители фонового поглощения для сосуда по слоям (см. Scene.mu_a_at)
+VESSEL_BG_FACTORS = (1.0, 3.0, 1.5)
+
+# Ткань из MC_parameters.csv для слоёв, заданных без явного указания ткани
+LAYER_TISSUES = {
+    "Эпидермис": "Эпидермис_светлый",
+    "Дерма": "Дерма_человека",
+    "Гипподерма": "Подкожный_жир_n10",
+}
+
+# Область растеризации сетки свойств по умолчанию, мм
+GRID_X_RANGE = (-30.0, 30.0)
+GRID_Z_RANGE = (0.0, 20.0)
+GRID_STEP = 0.1
+
+
+def layer_tissue(layer):
+    # Слой: (название, верх_мм, низ_мм[, ткань из MC_parameters.csv])
+    if len(layer) > 3 and layer[3]:
+        return layer[3]
+    return LAYER_TISSUES.get(layer[0], layer[0])
+
+
+class Scene:
+    __slots__ = ('mu_a', 'mu_s', 'g', 'n',
+                 'is_vessel', 'is_heterogeneous', 'is_tumor',
+                 'mode', 'layers', 'coef', 'coef_rows', 'albedo_rows', 'bounds', 'bounds_list', 'last_layer',
+                 'mu_a_bg', 'mu_s_bg', 'g_bg', 'n_bg', 'mu_a_bg_layers', 'mu_a_bg_rows',
+                 'mu_a_vessel', 'mu_s_vessel', 'g_vessel', 'n_vessel',
+                 'vessel_x', 'vessel_z', 'vessel_r', 'vessel_t',
+                 'tumor_x', 'tumor_z', 'tumor_rx', 'tumor_rz',
+                 'mu_a_tumor', 'mu_s_tumor', 'g_tumor', 'n_tumor')
+
+    def __init__(self, mu_a=5.0, mu_s=95.0, g=0.5, n=1.5,
+                 is_vessel=True, is_heterogeneous=True, is_tumor=True,
+                 mode='A', layers=(), coef=(),
+                 mu_a_vessel=None, mu_s_vessel=None, g_vessel=0.35, n_vessel=1.36,
+                 vessel_x=-8.0, vessel_z=3.5, vessel_r=0.2, vessel_t=0.2,
+                 tumor_x=7.5, tumor_z=4.4, tumor_rx=2.6, tumor_rz=1.7,
+                 mu_a_tumor=5.0, mu_s_tumor=180.0, g_tumor=0.85, n_tumor=1.39):
+        self.mu_a, self.mu_s, self.g, self.n = mu_a, mu_s, g, n
+        self.is_vessel = is_vessel
+        self.is_heterogeneous = is_heterogeneous
+        self.is_tumor = is_tumor
+        self.mode = mode
+        # coef[i] = (mu_a, mu_s, g, n) для layers[i]
+        order = sorted(range(len(layers)), key=lambda i: layers[i][1])
+        self.layers = [layers[i] for i in order]
+        coef = np.array(coef, dtype=float).reshape(-1, 4)
+        self.coef = coef[order] if len(coef) == len(order) else coef
+        self.coef_rows = [tuple(row) for row in self.coef.tolist()]
+        # Альбедо слоёв без сосуда и опухоли — на шаге фотона тогда нужен только номер слоя
+        self.albedo_rows = [mu_s_layer / (mu_a_layer + mu_s_layer) if mu_a_layer + mu_s_layer > 0 else 0.0
+                            for mu_a_layer, mu_s_layer, _, _ in self.coef_rows]
+        # Нижние границы всех слоёв, кроме последнего: всё, что глубже, относится к нему.
+        # Слой в точке ищется двоичным поиском по этому отсортированному массиву.
+        self.bounds = np.array([layer[2] for layer in self.layers[:-1]], dtype=float)
+        self.bounds_list = self.bounds.tolist()
+        self.last_layer = max(len(self.coef) - 1, 0)
+
+        self.mu_a_bg, self.mu_s_bg, self.g_bg, self.n_bg = mu_a, mu_s, g, n
+        n_layers = max(len(self.coef), 1)
+        factors = list(VESSEL_BG_FACTORS[:n_layers])
+        factors += [VESSEL_BG_FACTORS[-1]] * (n_layers - len(factors))
+        self.mu_a_bg_layers = mu_a * np.array(factors)
+        self.mu_a_bg_rows = self.mu_a_bg_layers.tolist()
+        self.mu_a_vessel = mu_a * 20.0 if mu_a_vessel is None else mu_a_vessel
+        self.mu_s_vessel = mu_s * 0.9 if mu_s_vessel is None else mu_s_vessel
+        self.g_vessel, self.n_vessel = g_vessel, n_vessel
+        self.vessel_x, self.vessel_z = vessel_x, vessel_z
+        self.vessel_r, self.vessel_t = vessel_r, vessel_t
+
+        self.tumor_x, self.tumor_z = tumor_x, tumor_z
+        self.tumor_rx, self.tumor_rz = tumor_rx, tumor_rz
+        self.mu_a_tumor, self.mu_s_tumor = mu_a_tumor, mu_s_tumor
+        self.g_tumor, self.n_tumor = g_tumor, n_tumor
+
+    # ---- коэффициенты в точке для одного фотона ----
+
+    def layer_index(self, z):
+        i = bisect_right(self.bounds_list, z)
+        return i if i < self.last_layer else self.last_layer
+
+    def vessel_weight(self, x, z):
+        r = math.hypot(x - self.vessel_x, z - self.vessel_z)
+        return 1.0 / (1.0 + math.exp(min((r - self.vessel_r) / self.vessel_t, 700.0)))
+
+    def tumor_factor(self, x, z):
+        r2 = ((x - self.tumor_x) / self.tumor_rx) ** 2 + ((z - self.tumor_z) / self.tumor_rz) ** 2
+        # При r2 > 40 добавка 4 exp(-r2) меньше половины ulp единицы, экспоненту можно не считать
+        return 1.0 if r2 > 40.0 else 1.0 + 4.0 * math.exp(-r2)
+
+    def in_tumor(self, x, z):
+        return ((x - self.tumor_x) / self.tumor_rx) ** 2 + ((z - self.tumor_z) / self.tumor_rz) ** 2 <= 1.0
+
+    def mu_a_at(self, x, z):
+        if not self.is_heterogeneous:
+            return self.mu_a
+        i = self.layer_index(z)
+        main = self.coef_rows[i][0]
+        if self.is_vessel:
+            vw = self.vessel_weight(x, z)
+            if self.is_tumor and vw < 1e-3:
+                return main * self.tumor_factor(x, z)
+            return self.mu_a_bg_rows[i] * (1.0 - vw) + self.mu_a_vessel * vw
+        if self.is_tumor:
+            return main * self.tumor_factor(x, z)
+        return main
+
+    def mu_a_s_at(self, x, z):
+        # (mu_a, mu_s) за один поиск слоя и одно вычисление сосуда и опухоли; то же, что mu_a_at и mu_s_at
+        if not self.is_heterogeneous:
+            return self.mu_a, self.mu_s
+        i = bisect_right(self.bounds_list, z)
+        if i > self.last_layer:
+            i = self.last_layer
+        if self.is_vessel:
+            vw = self.vessel_weight(x, z)
+            mu_s = self.mu_s_bg * (1.0 - vw) + self.mu_s_vessel * vw
+            if self.is_tumor and vw < 1e-3:
+                return self.coef_rows[i][0] * self.tumor_factor(x, z), mu_s
+            return self.mu_a_bg_rows[i] * (1.0 - vw) + self.mu_a_vessel * vw, mu_s
+        mu_a, mu_s = self.coef_rows[i][:2]
+        if self.is_tumor:
+            mu_a *= self.tumor_factor(x, z)
+        return mu_a, mu_s
+
+    def albedo_at(self, x, z):
+        if self.is_heterogeneous and not (self.is_vessel or self.is_tumor):
+            i = bisect_right(self.bounds_list, z)
+            return self.albedo_rows[i if i < self.last_layer else self.last_layer]
+        mu_a, mu_s = self.mu_a_s_at(x, z)
+        return mu_s / (mu_a + mu_s)
+
+    def mu_s_at(self, x, z):
+        if not self.is_heterogeneous:
+            return self.mu_s
+        if self.is_vessel:
+            vw = self.vessel_weight(x, z)
+            return self.mu_s_bg * (1.0 - vw) + self.mu_s_vessel * vw
+        return self.coef_rows[self.layer_index(z)][1]
+
+    def g_at(self, x, z):
+        # В режиме с сосудом g_at возвращает глобальное g
+        if not self.is_heterogeneous or self.is_vessel:
+            return self.g
+        return self.coef_rows[self.layer_index(z)][2]
+
+    def n_at(self, x, z):
+        if not self.is_heterogeneous:
+            return self.n
+        if self.is_vessel:
+            vw = self.vessel_weight(x, z)
+            return self.n_bg * (1.0 - vw) + self.n_vessel * vw
+        return self.coef_rows[self.layer_index(z)][3]
+
+    # ---- векторные версии mu_a_at / mu_s_at / g_at / n_at ----
+
+    def layer_index_array(self, z):
+        idx = np.searchsorted(self.bounds, z, side='right')
+        return np.minimum(idx, self.last_layer)
+
+    def vessel_weight_array(self, x, z):
+        r = np.hypot(x - self.vessel_x, z - self.vessel_z)
+        return 1.0 / (1.0 + np.exp(np.minimum((r - self.vessel_r) / self.vessel_t, 700.0)))
+
+    def tumor_factor_array(self, x, z):
+        r2 = ((x - self.tumor_x) / self.tumor_rx) ** 2 + ((z - self.tumor_z) / self.tumor_rz) ** 2
+        return 1.0 + 4.0 * np.exp(-r2)
+
+    def in_tumor_array(self, x, z):
+        return ((x - self.tumor_x) / self.tumor_rx) ** 2 + ((z - self.tumor_z) / self.tumor_rz) ** 2 <= 1.0
+
+    def mu_a_array(self, x, z):
+        if not self.is_heterogeneous:
+            return np.full(x.shape, self.mu_a)
+        idx = self.layer_index_array(z)
+        main = self.coef[idx, 0]
+        if not (self.is_vessel or self.is_tumor):
+            return main
+        if self.is_vessel:
+            vw = self.vessel_weight_array(x, z)
+            vessel = self.mu_a_bg_layers[idx] * (1.0 - vw) + self.mu_a_vessel * vw
+            if not self.is_tumor:
+                return vessel
+            return np.where(vw < 1e-3, main * self.tumor_factor_array(x, z), vessel)
+        return main * self.tumor_factor_array(x, z)
+
+    def albedo_array(self, x, z):
+        mu_s_local = self.mu_s_array(x, z)
+        return mu_s_local / (self.mu_a_array(x, z) + mu_s_local)
+
+    def mu_s_array(self, x, z):
+        if not self.is_heterogeneous:
+            return np.full(x.shape, self.mu_s)
+        if self.is_vessel:
+            vw = self.vessel_weight_array(x, z)
+            return self.mu_s_bg * (1.0 - vw) + self.mu_s_vessel * vw
+        return self.coef[self.layer_index_array(z), 1]
+
+    def g_array(self, x, z):
+        if not self.is_heterogeneous or self.is_vessel:
+            return np.full(x.shape, self.g)
+        return self.coef[self.layer_index_array(z), 2]
+
+    def n_array(self, x, z):
+        if not self.is_heterogeneous:
+            return np.full(x.shape, self.n)
+        if self.is_vessel:
+            vw = self.vessel_weight_array(x, z)
+            return self.n_bg * (1.0 - vw) + self.n_vessel * vw
+        return self.coef[self.layer_index_array(z), 3]
+
+    def mu_t_at(self, x, z):
+        mu_a, mu_s = self.mu_a_s_at(x, z)
+        return mu_a + mu_s
+
+    def mu_t_array(self, x, z):
+        return self.mu_a_array(x, z) + self.mu_s_array(x, z)
+
+    # ---- мажоранта для дельта-трекинга ----
+
+    def layer_slabs(self):
+        # Верх и низ каждого слоя так, как их видит layer_index: выше первой границы — первый слой,
+        # ниже последней — последний
+        bottoms = np.append(self.bounds, np.inf)[:self.last_layer + 1]
+        tops = np.concatenate(([0.0], bottoms[:-1]))
+        return tops, bottoms
+
+    def majorant_layers(self):
+        # Наибольшее mu_a + mu_s в каждом слое
+        if not self.is_heterogeneous:
+            return np.array([self.mu_a + self.mu_s])
+        # tumor_factor не больше 5
+        mu_a = self.coef[:, 0] * (5.0 if self.is_tumor else 1.0)
+        if self.is_vessel:
+            vessel = np.maximum(self.mu_a_bg_layers[:len(self.coef)], self.mu_a_vessel)
+            mu_a = np.maximum(mu_a, vessel) if self.is_tumor else vessel
+            mu_s = np.full(len(self.coef), max(self.mu_s_bg, self.mu_s_vessel))
+        else:
+            mu_s = self.coef[:, 1]
+        return mu_a + mu_s
+
+    # ---- значения g и n для таблиц MC_tables ----
+
+    def g_values(self):
+        # Все значения, которые может вернуть g_at
+        if not self.is_heterogeneous or self.is_vessel or not len(self.coef):
+            return [self.g]
+        return sorted(set(self.coef[:, 2].tolist()))
+
+    def n_values(self):
+        # Все значения, которые может вернуть n_at; None, если n меняется непрерывно (режим с сосудом)
+        if not self.is_heterogeneous:
+            return [self.n]
+        if self.is_vessel:
+            return None
+        return sorted(set(self.coef[:, 3].tolist()))
+
+    def compile(self, step=GRID_STEP, x_range=GRID_X_RANGE, z_range=GRID_Z_RANGE):
+        return CompiledScene(self, step, x_range, z_range)
+
+
+class CompiledScene(Scene):
+    # Сцена, растеризованная в сетку (x, z): коэффициенты в точке берутся по индексу ячейки
+    __slots__ = ('grid_x0', 'grid_z0', 'grid_nx', 'grid_nz', 'inv_dx', 'inv_dz',
+                 'mu_a_grid', 'mu_s_grid', 'g_grid', 'n_grid', 'albedo_grid',
+                 'mu_a_flat', 'mu_s_flat', 'g_flat', 'n_flat', 'albedo_flat')
+
+    def __init__(self, scene, step=GRID_STEP, x_range=GRID_X_RANGE, z_range=GRID_Z_RANGE):
+        for name in Scene.__slots__:
+            setattr(self, name, getattr(scene, name))
+
+        dx, dz = step if isinstance(step, (tuple, list)) else (step, step)
+        self.grid_nx = max(int(round((x_range[1] - x_range[0]) / dx)), 1)
+        self.grid_nz = max(int(round((z_range[1] - z_range[0]) / dz)), 1)
+        self.grid_x0, self.grid_z0 = x_range[0], z_range[0]
+        self.inv_dx, self.inv_dz = 1.0 / dx, 1.0 / dz
+
+        # Значения берутся в центрах ячеек
+        xc = self.grid_x0 + (np.arange(self.grid_nx) + 0.5) * dx
+        zc = self.grid_z0 + (np.arange(self.grid_nz) + 0.5) * dz
+        zz, xx = np.meshgrid(zc, xc, indexing='ij')
+        xx, zz = xx.ravel(), zz.ravel()
+        self.mu_a_grid = scene.mu_a_array(xx, zz)
+        self.mu_s_grid = scene.mu_s_array(xx, zz)
+        self.g_grid = scene.g_array(xx, zz)
+        self.n_grid = scene.n_array(xx, zz)
+        self.albedo_grid = self.mu_s_grid / (self.mu_a_grid + self.mu_s_grid)
+        self.mu_a_flat = array('d', self.mu_a_grid.tobytes())
+        self.mu_s_flat = array('d', self.mu_s_grid.tobytes())
+        self.g_flat = array('d', self.g_grid.tobytes())
+        self.n_flat = array('d', self.n_grid.tobytes())
+        self.albedo_flat = array('d', self.albedo_grid.tobytes())
+
+    def cell(self, x, z):
+        i = int((x - self.grid_x0) * self.inv_dx)
+        if i < 0:
+            i = 0
+        elif i >= self.grid_nx:
+            i = self.grid_nx - 1
+        k = int((z - self.grid_z0) * self.inv_dz)
+        if k < 0:
+            k = 0
+        elif k >= self.grid_nz:
+            k = self.grid_nz - 1
+        return k * self.grid_nx + i
+
+    def cell_array(self, x, z):
+        i = np.clip(((x - self.grid_x0) * self.inv_dx).astype(np.int64), 0, self.grid_nx - 1)
+        k = np.clip(((z - self.grid_z0) * self.inv_dz).astype(np.int64), 0, self.grid_nz - 1)
+        return k * self.grid_nx + i
+
+    def mu_a_at(self, x, z):
+        return self.mu_a_flat[self.cell(x, z)]
+
+    def mu_a_s_at(self, x, z):
+        cell = self.cell(x, z)
+        return self.mu_a_flat[cell], self.mu_s_flat[cell]
+
+    def albedo_at(self, x, z):
+        return self.albedo_flat[self.cell(x, z)]
+
+    def mu_s_at(self, x, z):
+        return self.mu_s_flat[self.cell(x, z)]
+
+    def g_at(self, x, z):
+        return self.g_flat[self.cell(x, z)]
+
+    def n_at(self, x, z):
+        return self.n_flat[self.cell(x, z)]
+
+    def mu_a_array(self, x, z):
+        return self.mu_a_grid[self.cell_array(x, z)]
+
+    def albedo_array(self, x, z):
+        return self.albedo_grid[self.cell_array(x, z)]
+
+    def mu_s_array(self, x, z):
+        return self.mu_s_grid[self.cell_array(x, z)]
+
+    def g_array(self, x, z):
+        return self.g_grid[self.cell_array(x, z)]
+
+    def n_array(self, x, z):
+        return self.n_grid[self.cell_array(x, z)]
+
+    def g_values(self):
+        if not self.is_heterogeneous:
+            return [self.g]
+        return np.unique(self.g_grid).tolist()
+
+    def n_values(self):
+        if not self.is_heterogeneous:
+            return [self.n]
+        if self.is_vessel:
+            return None
+        return np.unique(self.n_grid).tolist()
+
+    def majorant_layers(self):
+        # Ячейка на границе слоёв берёт значение по своему центру, поэтому максимум ищется по всем строкам
+        # сетки, задевающим слой (за пределами сетки действует крайняя строка)
+        if not self.is_heterogeneous:
+            return np.array([self.mu_a + self.mu_s])
+        rows = (self.mu_a_grid + self.mu_s_grid).reshape(self.grid_nz, self.grid_nx).max(axis=1)
+        row_top = self.grid_z0 + np.arange(self.grid_nz) / self.inv_dz
+        row_bottom = row_top + 1.0 / self.inv_dz
+        row_top[0], row_bottom[-1] = -np.inf, np.inf
+        tops, bottoms = self.layer_slabs()
+        tops = np.where(np.arange(len(tops)) == 0, -np.inf, tops)
+        return np.array([rows[(row_top < bottom) & (row_bottom > top)].max() for top, bottom in zip(tops, bottoms)])
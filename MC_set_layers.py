@@ -3,30 +3,41 @@ from typing import Dict, List, Tuple, Optional
 
 from PySide6.QtWidgets import (
     QApplication, QDialog, QLabel, QPushButton, QVBoxLayout, QHBoxLayout,
-    QTabWidget, QWidget, QGridLayout, QGroupBox, QDoubleSpinBox, QLineEdit, QCheckBox
+    QTabWidget, QWidget, QGridLayout, QGroupBox, QDoubleSpinBox, QLineEdit, QCheckBox, QComboBox
 )
 
 from PySide6.QtCore import Signal
-from MC_reading_csv import get_coefficients_for
+from MC_reading_csv import get_coefficients_for, get_tissue_names
+from MC_scene import layer_tissue
+
+# Слой: (название, верх_мм, низ_мм, ткань из MC_parameters.csv)
+Layer = Tuple[str, float, float, str]
 
 COEF = []
 
 
 class LayerEditor(QWidget):
     boundaries_changed = Signal()
+    tissue_changed = Signal()
 
-    def __init__(self, name: str, start_mm: float, end_mm: float, parent=None):
+    def __init__(self, name: str, start_mm: float, end_mm: float, tissue: str = "", parent=None):
         super().__init__(parent)
         self.name = name
-        self._build_ui(start_mm, end_mm)
+        self._build_ui(start_mm, end_mm, tissue)
 
-    def _build_ui(self, start_mm: float, end_mm: float):
+    def _build_ui(self, start_mm: float, end_mm: float, tissue: str):
         layout = QHBoxLayout(self)
         layout.setContentsMargins(0, 0, 0, 0)
 
         self.lbl_name = QLabel(self.name)
         self.lbl_name.setFixedWidth(150)
 
+        self.cb_tissue = QComboBox()
+        self.cb_tissue.addItems(get_tissue_names())
+        if tissue and self.cb_tissue.findText(tissue) < 0:
+            self.cb_tissue.addItem(tissue)
+        self.cb_tissue.setCurrentText(tissue)
+
         self.sb_start = QDoubleSpinBox()
         self.sb_start.setRange(0.0, 50.0)
         self.sb_start.setSingleStep(0.1)
@@ -47,9 +58,11 @@ class LayerEditor(QWidget):
         layout.addWidget(self.lbl_mm_start)
         layout.addWidget(self.sb_end)
         layout.addWidget(self.lbl_mm_end)
+        layout.addWidget(self.cb_tissue)
 
         self.sb_start.valueChanged.connect(self._on_boundary_changed)
         self.sb_end.valueChanged.connect(self._on_boundary_changed)
+        self.cb_tissue.currentIndexChanged.connect(self.tissue_changed.emit)
 
     def _on_boundary_changed(self):
         self.boundaries_changed.emit()
@@ -57,6 +70,9 @@ class LayerEditor(QWidget):
     def get_boundaries(self) -> Tuple[float, float]:
         return float(self.sb_start.value()), float(self.sb_end.value())
 
+    def get_tissue(self) -> str:
+        return self.cb_tissue.currentText()
+
     def set_boundaries(self, start_mm: float, end_mm: float):
         self.sb_start.blockSignals(True)
         self.sb_end.blockSignals(True)
@@ -369,11 +385,11 @@ class LayerCoeffEditor(QWidget):
 
 
 class ScenarioPanel(QWidget):
-    def __init__(self, name: str, layers_def: List[Tuple[str, float, float]], wave=650, parent=None):
+    def __init__(self, name: str, layers_def: List[Layer], wave=650, parent=None):
         super().__init__(parent)
         self.name = name
         self.wave = wave
-        self.layers_def = layers_def  # list of (layer_name, start_mm, end_mm)
+        self.layers_def = layers_def  # list of (layer_name, start_mm, end_mm[, tissue])
         self.layer_editors: List[LayerEditor] = []
         self.coeffs_displays: List[LayerCoeffsDisplay] = []
         self._build_ui()
@@ -385,35 +401,61 @@ class ScenarioPanel(QWidget):
 
         # Раздел коэффициентов
         coeffs_box = QGroupBox(f"Коэффициенты оптических свойств (для выбранной λ = {self.wave} нм)")
-        coeffs_layout = QVBoxLayout(coeffs_box)
-
-        for (layer_name, _, _) in self.layers_def:
-            disp = LayerCoeffsDisplay(layer_name, self)
-            self.coeffs_displays.append(disp)
-            coeffs_layout.addWidget(disp)
-
+        self.coeffs_layout = QVBoxLayout(coeffs_box)
         main_layout.addWidget(coeffs_box)
 
-        layers_box = QGroupBox("Слои и их границы (верх/низ, мм)")
-        layers_layout = QVBoxLayout(layers_box)
-
-        for name, s, e in self.layers_def:
-            editor = LayerEditor(name, s, e, self)
-            editor.boundaries_changed.connect(self._on_boundaries_changed)
-            self.layer_editors.append(editor)
-            layers_layout.addWidget(editor)
-
+        layers_box = QGroupBox("Слои и их границы (верх/низ, мм) и ткань")
+        self.layers_layout = QVBoxLayout(layers_box)
         main_layout.addWidget(layers_box)
 
+        for layer in self.layers_def:
+            self._add_layer_row(layer[0], layer[1], layer[2], layer_tissue(layer))
+
         ctrl_layout = QHBoxLayout()
         self.cb_link = QCheckBox(
             "Синхронизировать границы слоёв (верхний границы следующего слоя = нижняя граница предыдущего)")
         self.cb_link.setChecked(True)
         ctrl_layout.addWidget(self.cb_link)
         ctrl_layout.addStretch()
+        self.btn_add_layer = QPushButton("Добавить слой")
+        self.btn_remove_layer = QPushButton("Удалить слой")
+        self.btn_add_layer.clicked.connect(self.add_layer)
+        self.btn_remove_layer.clicked.connect(self.remove_layer)
+        ctrl_layout.addWidget(self.btn_add_layer)
+        ctrl_layout.addWidget(self.btn_remove_layer)
         main_layout.addLayout(ctrl_layout)
         main_layout.addStretch()
 
+    def _add_layer_row(self, name: str, start_mm: float, end_mm: float, tissue: str):
+        disp = LayerCoeffsDisplay(name, self)
+        self.coeffs_displays.append(disp)
+        self.coeffs_layout.addWidget(disp)
+
+        editor = LayerEditor(name, start_mm, end_mm, tissue, self)
+        editor.boundaries_changed.connect(self._on_boundaries_changed)
+        editor.tissue_changed.connect(self.refresh_coeffs)
+        self.layer_editors.append(editor)
+        self.layers_layout.addWidget(editor)
+
+    def add_layer(self):
+        if self.layer_editors:
+            last = self.layer_editors[-1]
+            start = last.get_boundaries()[1]
+            tissue = last.get_tissue()
+        else:
+            start, tissue = 0.0, ""
+        self._add_layer_row(f"Слой {len(self.layer_editors) + 1}", start, start + 1.0, tissue)
+        self.refresh_coeffs()
+
+    def remove_layer(self):
+        if len(self.layer_editors) <= 1:
+            return
+        editor = self.layer_editors.pop()
+        disp = self.coeffs_displays.pop()
+        for widget in (editor, disp):
+            widget.setParent(None)
+            widget.deleteLater()
+
     def _on_boundaries_changed(self):
         if not self.cb_link.isChecked():
             return
@@ -425,13 +467,22 @@ class ScenarioPanel(QWidget):
                 self.layer_editors[i].sb_end.setValue(start_next)
                 self.layer_editors[i].sb_end.blockSignals(False)
 
-    def get_layers(self) -> List[Tuple[str, float, float]]:
+    def get_layers(self) -> List[Layer]:
         res = []
         for ed in self.layer_editors:
             s, e = ed.get_boundaries()
-            res.append((ed.name, s, e))
+            res.append((ed.name, s, e, ed.get_tissue()))
         return res
 
+    def refresh_coeffs(self):
+        for editor, disp in zip(self.layer_editors, self.coeffs_displays):
+            try:
+                d = get_coefficients_for(tissue=editor.get_tissue(), wavelength=self.wave, method='linear')
+            except (KeyError, ValueError):
+                disp.clear()
+                continue
+            disp.update_values(d["mu_a"], d["mu_s"], d["g"], d["n"])
+
     def set_wave_coeffs(self, coeffs_per_layer: Dict[str, Dict[str, float]]):
         for disp in self.coeffs_displays:
             layer = disp.layer_name
@@ -492,32 +543,9 @@ class OpticalLayersDialog(QDialog):
         else:
             wave = 650
 
-        mu_a_1, mu_s_1, g_1, n_1 = get_coefficients_for(tissue="Эпидермис_светлый", wavelength=wave,
-                                                        method='linear').values()
-        mu_a_2, mu_s_2, g_2, n_2 = get_coefficients_for(tissue="Дерма_человека", wavelength=wave,
-                                                        method='linear').values()
-        mu_a_3, mu_s_3, g_3, n_3 = get_coefficients_for(tissue="Подкожный_жир_n10", wavelength=wave,
-                                                        method='linear').values()
-        example_data = {
-            "Сценарий A: поверхностная задача": {
-                "Эпидермис": {"mu_a": mu_a_1, "mu_s": mu_s_1, "g": g_1, "n": n_1},
-                "Дерма": {"mu_a": mu_a_2, "mu_s": mu_s_2, "g": g_2, "n": n_2},
-            },
-            "Сценарий B: глубинная терапия": {
-                "Эпидермис": {"mu_a": mu_a_1, "mu_s": mu_s_1, "g": g_1, "n": n_1},
-                "Дерма": {"mu_a": mu_a_2, "mu_s": mu_s_2, "g": g_2, "n": n_2},
-                "Гипподерма": {"mu_a": mu_a_3, "mu_s": mu_s_3, "g": g_3, "n": n_3},
-            },
-        }
-
-        if self.wave_length_nm is not None:
-            for sc_name, sc_data in example_data.items():
-                if sc_name == "Сценарий A: поверхностная задача":
-                    self.panel_a.set_wave_coeffs(sc_data)
-                    for layer_name, vals in sc_data.items():
-                        pass
-                elif sc_name == "Сценарий B: глубинная терапия":
-                    self.panel_b.set_wave_coeffs(sc_data)
+        for panel in (self.panel_a, self.panel_b):
+            panel.wave = wave
+            panel.refresh_coeffs()
 
     def get_configuration(self) -> Dict[str, object]:
         cfg = {"wave_length_nm": self.wave_length_nm, "scenarios": {}}
@@ -0,0 +1,94 @@
+import time
+
+# Методы сцены, которые движки вызывают на каждом шаге фотона
+LOOKUPS = ('albedo_at', 'g_at', 'n_at', 'in_tumor', 'mu_t_at', 'layer_index',
+           'albedo_array', 'g_array', 'n_array', 'in_tumor_array', 'mu_t_array', 'layer_index_array')
+
+
+class RunStats:
+    # Счётчики одного или нескольких расчётов. Заполняются на месте, если передать get_data(..., stats=RunStats());
+    # без stats движки работают без проверок и замеров. phases — время этапов в секундах: внешние (setup,
+    # transport) включают внутренние (move, absorb, ...), lookups — вызовы методов сцены и время в них
+    __slots__ = ('photons', 'steps', 'scatters', 'bounces', 'internal_reflections',
+                 'roulette_kills', 'roulette_survivals', 'lookups', 'phases')
+    COUNTERS = ('photons', 'steps', 'scatters', 'bounces', 'internal_reflections',
+                'roulette_kills', 'roulette_survivals')
+
+    def __init__(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.lookups = {}
+        self.phases = {}
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def lookup_time(self):
+        return sum(seconds for _, seconds in self.lookups.values())
+
+    def steps_per_photon(self):
+        return self.steps / self.photons if self.photons else 0.0
+
+    def merge(self, other):
+        # Для процессов MC_parallel время этапов суммируется, то есть это процессорное время всех процессов
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name, (calls, seconds) in other.lookups.items():
+            own = self.lookups.get(name, (0, 0.0))
+            self.lookups[name] = (own[0] + calls, own[1] + seconds)
+        for name, seconds in other.phases.items():
+            self.add_time(name, seconds)
+        return self
+
+    def as_dict(self):
+        data = {name: getattr(self, name) for name in self.COUNTERS}
+        data['steps_per_photon'] = self.steps_per_photon()
+        data['lookup_time'] = self.lookup_time()
+        data['lookups'] = {name: {'calls': calls, 'seconds': seconds}
+                           for name, (calls, seconds) in sorted(self.lookups.items())}
+        data['phases'] = dict(self.phases)
+        return data
+
+    def report(self):
+        lines = [f"Фотоны: {self.photons}, взаимодействий: {self.steps} ({self.steps_per_photon():.1f} на фотон)",
+                 f"Рассеяния: {self.scatters}",
+                 f"Отражения от поверхности: {self.bounces}, из них полных внутренних: {self.internal_reflections}",
+                 f"Рулетка: погибли {self.roulette_kills}, выжили {self.roulette_survivals}"]
+        if self.lookups:
+            calls = sum(calls for calls, _ in self.lookups.values())
+            lines.append(f"Коэффициенты сцены: {calls} вызовов, {self.lookup_time():.3f} с")
+        lines.extend(f"  {name}: {seconds:.3f} с" for name, seconds in self.phases.items())
+        return '\n'.join(lines)
+
+
+class TimedScene:
+    # Обёртка сцены для расчёта со счётчиками: методы LOOKUPS замеряются, остальное берётся у сцены
+    def __init__(self, scene, stats):
+        self.__dict__['_scene'] = scene
+        self.__dict__['_stats'] = stats
+
+    def __getattr__(self, name):
+        value = getattr(self._scene, name)
+        if name in LOOKUPS:
+            value = self._timed(name, value)
+        # Свойства сцены за расчёт не меняются, поэтому значение запоминается
+        self.__dict__[name] = value
+        return value
+
+    def _timed(self, name, method):
+        lookups = self._stats.lookups
+        perf_counter = time.perf_counter
+
+        def timed(*args):
+            start = perf_counter()
+            value = method(*args)
+            calls, seconds = lookups.get(name, (0, 0.0))
+            lookups[name] = (calls + 1, seconds + perf_counter() - start)
+            return value
+        return timed
+
+
+def timed_scene(scene, stats):
+    if stats is None or isinstance(scene, TimedScene):
+        return scene
+    return TimedScene(scene, stats)
@@ -0,0 +1,97 @@
+import math
+import os
+
+import numpy as np
+
+from MC_algo import make_scene, PhotonTransport, TUMOR_TYPES, PS_TYPES
+from MC_reading_csv import get_coefficients_many
+from MC_reading_tumor_coef import get_optical_properties_many
+from MC_scene import layer_tissue
+
+
+def wavelength_range(start, stop, step):
+    # Включая stop, если он попадает в сетку, и ничего за stop
+    count = int(math.floor((stop - start) / step + 1e-9)) + 1
+    return start + step * np.arange(max(count, 0), dtype=float)
+
+
+def sweep_scenes(wavelengths, new_mu_a, new_mu_s, new_g, new_n, new_is_vessel=True, new_is_heterogeneous=True,
+                 new_is_tumor=True, new_cx=7.5, new_cz=4.5, new_rx=2.5, new_rz=1.5, new_mode=None,
+                 tt_index=0, ps_index=0):
+    # Коэффициенты всех слоёв и опухоли для всех длин волн находятся одним проходом по таблицам
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    mode, layers = new_mode if new_mode is not None else ("", [])
+    if layers:
+        coef = get_coefficients_many([layer_tissue(layer) for layer in layers], wavelengths, method='linear')
+    else:
+        coef = np.zeros((0, len(wavelengths), 4))
+    tumor = get_optical_properties_many(TUMOR_TYPES[tt_index], wavelengths, PS_TYPES[ps_index])
+    if new_is_tumor and np.isnan(tumor).any():
+        bad = wavelengths[np.isnan(tumor).any(axis=1)]
+        raise ValueError(f"Нет свойств опухоли для длин волн: {bad.tolist()}")
+
+    scenes = []
+    for i in range(len(wavelengths)):
+        tumor_props = dict(zip(('mu_a', 'mu_s', 'g', 'n'), tumor[i].tolist()))
+        scenes.append(make_scene(new_mu_a, new_mu_s, new_g, new_n, new_is_vessel, new_is_heterogeneous,
+                                 new_is_tumor, new_cx, new_cz, new_rx, new_rz, mode, layers, coef[:, i],
+                                 tumor_props))
+    return scenes
+
+
+def _run_wavelength(scene, photons, seed, engine, grid_step, delta_tracking=False, cancel=None):
+    if grid_step and scene.is_heterogeneous:
+        scene = scene.compile(grid_step)
+    sim = PhotonTransport(scene, photons=photons, seed=seed, delta_tracking=delta_tracking)
+    sim.run(engine, cancel=cancel)
+    return list(sim.heat), sim.bit, sim.rd, sim.rs, sim.tumor_dose
+
+
+class SweepResult:
+    __slots__ = ('wavelengths', 'photons', 'heat', 'bit', 'specular', 'reflectance', 'tumor_dose')
+
+    def __init__(self, wavelengths, photons, results):
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.photons = photons
+        # heat — (длина волны × бин глубины), как heat в get_data
+        self.heat = np.array([res[0] for res in results])
+        self.bit = np.array([res[1] for res in results])
+        total = self.bit + photons
+        # Диффузное отражение и доза в опухоли нормированы так же, как в print_results
+        self.reflectance = np.array([res[2] for res in results]) / total
+        self.specular = np.array([res[3] for res in results])
+        self.tumor_dose = np.array([res[4] for res in results]) / total
+
+    def save(self, path):
+        np.savez(path, wavelengths=self.wavelengths, photons=self.photons, heat=self.heat, bit=self.bit,
+                 specular=self.specular, reflectance=self.reflectance, tumor_dose=self.tumor_dose)
+
+
+def run_sweep(wavelengths, new_mu_a, new_mu_s, new_g, new_n, new_photons=20000, engine='python', seed=None,
+              workers=1, grid_step=None, delta_tracking=False, progress=None, cancel=None, **scene_kwargs):
+    # Каждая длина волны — отдельное моделирование со своим потоком случайных чисел;
+    # при workers > 1 они распределяются по пулу процессов
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    scenes = sweep_scenes(wavelengths, new_mu_a, new_mu_s, new_g, new_n, **scene_kwargs)
+    seeds = np.random.SeedSequence(seed).spawn(len(scenes))
+    photons = new_photons // 2
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers > 1:
+        from MC_parallel import _get_pool, _shared_event, wait_shards
+        pool = _get_pool(workers)
+        stop = _shared_event() if cancel is not None else None
+        futures = [pool.submit(_run_wavelength, scene, photons, child, engine, grid_step, delta_tracking, stop)
+                   for scene, child in zip(scenes, seeds)]
+        results = wait_shards(futures, [1] * len(futures), len(futures), stop, progress, cancel)
+    else:
+        results = []
+        for scene, child in zip(scenes, seeds):
+            if cancel is not None and cancel.is_set():
+                from MC_vector import SimulationCancelled
+                raise SimulationCancelled()
+            results.append(_run_wavelength(scene, photons, child, engine, grid_step, delta_tracking))
+            if progress is not None:
+                progress(len(results), len(scenes))
+    return SweepResult(wavelengths, photons, results)
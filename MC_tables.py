@@ -0,0 +1,110 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+
+# Число интервалов таблиц; погрешность линейной интерполяции проверяет tests/test_tables.py
+HG_SIZE = 16384
+FRESNEL_SIZE = 2048
+HG_TOLERANCE = 2e-5
+FRESNEL_TOLERANCE = 1e-5
+
+
+def hg_cos(g, r):
+    # Обратная функция распределения Хение-Гринштейна: косинус угла рассеяния для r из [0, 1]
+    if g == 0.0:
+        return 2.0 * r - 1.0
+    mu = (1.0 - g * g) / (1.0 - g + 2.0 * g * r)
+    return (1.0 + g * g - mu * mu) / (2.0 * g)
+
+
+def fresnel_exact(n, w):
+    # Отражение Френеля неполяризованного света при выходе из среды n, w — косинус угла к нормали
+    t = np.sqrt(np.maximum(0.0, 1.0 - n * n * (1.0 - w * w)))
+    temp1 = (w - n * t) / (w + n * t)
+    temp = (t - n * w) / (t + n * w)
+    return (temp1 * temp1 + temp * temp) / 2.0
+
+
+class HGTable:
+    # Таблицы обратной функции распределения по строке на каждое значение g сцены. Косинус для r
+    # линейно интерполируется между узлами равномерной сетки по r
+    __slots__ = ('g', 'size', 'mu', 'slope', 'rows')
+
+    def __init__(self, g_values, size=HG_SIZE):
+        self.g = np.unique(np.asarray(g_values, dtype=float))
+        self.size = size
+        r = np.linspace(0.0, 1.0, size + 1)
+        self.mu = np.array([hg_cos(g, r) for g in self.g])
+        self.slope = np.diff(self.mu, axis=1)
+        # Для скалярного движка — те же строки списками
+        self.rows = {float(g): (mu.tolist(), slope.tolist()) for g, mu, slope in zip(self.g, self.mu, self.slope)}
+
+    def sample(self, g, r):
+        mu, slope = self.rows[g]
+        t = r * self.size
+        i = int(t)
+        return mu[i] + (t - i) * slope[i]
+
+    def sample_array(self, g, r):
+        t = r * self.size
+        i = t.astype(np.int64)
+        k = 0 if self.g.size == 1 else np.searchsorted(self.g, g)
+        return self.mu[k, i] + (t - i) * self.slope[k, i]
+
+
+class FresnelTable:
+    # Таблицы отражения Френеля по строке на каждое значение n на поверхности. Аргумент таблицы —
+    # косинус угла преломления t = sqrt(1 - n^2 (1 - w^2)): по w отражение у критического угла
+    # растёт с бесконечной производной, а по t гладкое, поэтому хватает равномерной сетки
+    __slots__ = ('n', 'size', 'rf', 'slope', 'rows')
+
+    def __init__(self, n_values, size=FRESNEL_SIZE):
+        self.n = np.unique(np.asarray(n_values, dtype=float))
+        self.size = size
+        t = np.linspace(0.0, 1.0, size + 1)
+        rows = []
+        for n in self.n:
+            w = np.sqrt(np.maximum(0.0, 1.0 - (1.0 - t * t) / (n * n)))
+            rows.append(fresnel_exact(n, w))
+        self.rf = np.array(rows)
+        self.slope = np.diff(self.rf, axis=1)
+        self.rows = {float(n): (n * n, rf.tolist(), slope.tolist())
+                     for n, rf, slope in zip(self.n, self.rf, self.slope)}
+
+    def sample(self, n, w):
+        n2, rf, slope = self.rows[n]
+        s = 1.0 - n2 * (1.0 - w * w)
+        if s <= 0.0:
+            return 1.0
+        t = math.sqrt(s) * self.size
+        i = int(t)
+        if i >= self.size:
+            i = self.size - 1
+        return rf[i] + (t - i) * slope[i]
+
+    def sample_array(self, n, w):
+        t = np.sqrt(np.maximum(0.0, 1.0 - n * n * (1.0 - w * w))) * self.size
+        i = np.minimum(t.astype(np.int64), self.size - 1)
+        k = 0 if self.n.size == 1 else np.searchsorted(self.n, n)
+        return self.rf[k, i] + (t - i) * self.slope[k, i]
+
+
+@lru_cache(maxsize=32)
+def _hg_table(g_values):
+    return HGTable(g_values)
+
+
+@lru_cache(maxsize=32)
+def _fresnel_table(n_values):
+    return FresnelTable(n_values)
+
+
+def hg_table(scene):
+    return _hg_table(tuple(scene.g_values()))
+
+
+def fresnel_table(scene):
+    # None, если n на поверхности меняется непрерывно (режим с сосудом) — тогда отражение считается точно
+    n_values = scene.n_values()
+    return None if n_values is None else _fresnel_table(tuple(n_values))
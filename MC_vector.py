@@ -0,0 +1,395 @@
+import math
+import time
+import numpy as np
+
+from MC_stats import timed_scene
+from MC_tables import hg_table, fresnel_table
+
+BINS = 51
+microns_per_bin = 100.0
+BATCH_SIZE = 8192
+ROULETTE_THRESHOLD = 0.001
+ROULETTE_CHANCE = 0.1
+
+
+class SimulationCancelled(Exception):
+    pass
+
+
+class PhotonBatch:
+    # Структура массивов: по одному буферу на каждую величину пакета фотонов
+    __slots__ = ('x', 'y', 'z', 'u', 'v', 'w', 'weight', 'alive', 'steps')
+
+    def __init__(self, size=0):
+        self.x = np.zeros(size)
+        self.y = np.zeros(size)
+        self.z = np.zeros(size)
+        self.u = np.zeros(size)
+        self.v = np.zeros(size)
+        self.w = np.zeros(size)
+        self.weight = np.zeros(size)
+        self.alive = np.zeros(size, dtype=bool)
+        self.steps = np.zeros(size, dtype=np.int32)
+
+    def __len__(self):
+        return self.x.size
+
+    def compact(self):
+        keep = self.alive
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name)[keep])
+
+    def refill(self, count, start_weight):
+        if count <= 0:
+            return
+        zeros = np.zeros(count)
+        self.x = np.concatenate((self.x, zeros))
+        self.y = np.concatenate((self.y, zeros))
+        self.z = np.concatenate((self.z, zeros))
+        self.u = np.concatenate((self.u, zeros))
+        self.v = np.concatenate((self.v, zeros))
+        self.w = np.concatenate((self.w, np.ones(count)))
+        self.weight = np.concatenate((self.weight, np.full((count,) + self.weight.shape[1:], start_weight)))
+        self.alive = np.concatenate((self.alive, np.ones(count, dtype=bool)))
+        self.steps = np.concatenate((self.steps, np.zeros(count, dtype=np.int32)))
+
+
+def _bounce(scene, b, crit_angle, fresnel=None, reflectance=None):
+    hit = b.z <= 0.0
+    if not hit.any():
+        return 0.0
+    b.w[hit] = -b.w[hit]
+    b.z[hit] = -b.z[hit]
+    return _escape(scene, b, hit & (b.w > crit_angle), fresnel, reflectance)
+
+
+def _escape(scene, b, out, fresnel=None, reflectance=None):
+    # Часть веса, вышедшая наружу по Френелю, у фотонов out, уже отражённых от поверхности.
+    # fresnel — таблица MC_tables.FresnelTable; без неё отражение считается по формуле.
+    # reflectance (MC_reflectance.ReflectanceTally) получает точки выхода, углы и вышедший вес
+    if not out.any():
+        return 0.0
+    w = b.w[out]
+    if scene.is_heterogeneous:
+        n_local = scene.n_array(b.x[out], b.z[out])
+    else:
+        n_local = scene.n
+    if fresnel is not None:
+        rf = fresnel.sample_array(n_local, w)
+    else:
+        t = np.sqrt(np.maximum(0.0, 1.0 - n_local * n_local * (1.0 - w * w)))
+        temp1 = (w - n_local * t) / (w + n_local * t)
+        temp = (t - n_local * w) / (t + n_local * w)
+        rf = (temp1 * temp1 + temp * temp) / 2.0
+    escaped = (1.0 - rf) * b.weight[out]
+    b.weight[out] -= escaped
+    if reflectance is not None:
+        reflectance.add(b.x[out], b.y[out], w, n_local, escaped)
+    return float(escaped.sum())
+
+
+def _hop(b, rng):
+    r = rng.random(len(b))
+    d = -np.log(np.maximum(r, 1e-15))
+    b.x += d * b.u
+    b.y += d * b.v
+    b.z += d * b.w
+
+
+def _hop_delta(scene, b, rng, majorant, tops, bottoms, crit_angle, fresnel=None, stats=None, reflectance=None):
+    # Дельта-трекинг: шаг разыгрывается по мажоранте своего слоя (в длинах свободного пробега общего
+    # mu_a + mu_s), на границе слоя остаток оптической толщины переносится в соседний слой, на поверхности
+    # фотон отражается. В точке столкновения оно принимается как настоящее с вероятностью mu_t / мажоранта,
+    # иначе (фиктивное) фотон летит дальше в том же направлении.
+    escaped = 0.0
+    mu_ref = scene.mu_a + scene.mu_s
+    layer = scene.layer_index_array(b.z)
+    tau = -np.log(np.maximum(rng.random(len(b)), 1e-15))
+    idx = np.arange(len(b))
+    while idx.size:
+        k = layer[idx]
+        z, w = b.z[idx], b.w[idx]
+        m = majorant[k]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            to_bound = np.where(w > 0.0, (bottoms[k] - z) / w, np.where(w < 0.0, (tops[k] - z) / w, np.inf))
+        step = tau[idx] / m
+        collide = step < to_bound
+        step = np.where(collide, step, to_bound)
+        b.x[idx] += step * b.u[idx]
+        b.y[idx] += step * b.v[idx]
+        b.z[idx] += step * w
+
+        cross = idx[~collide]
+        if cross.size:
+            tau[cross] -= m[~collide] * to_bound[~collide]
+            up = b.w[cross] < 0.0
+            b.z[cross] = np.where(up, tops[layer[cross]], bottoms[layer[cross]])
+            surface = cross[up & (layer[cross] == 0)]
+            inner = cross[~(up & (layer[cross] == 0))]
+            layer[inner] += np.where(b.w[inner] > 0.0, 1, -1)
+            if surface.size:
+                b.z[surface] = 0.0
+                b.w[surface] = -b.w[surface]
+                out = np.zeros(len(b), dtype=bool)
+                out[surface[b.w[surface] > crit_angle]] = True
+                if stats is not None:
+                    stats.bounces += surface.size
+                    stats.internal_reflections += surface.size - int(out.sum())
+                escaped += _escape(scene, b, out, fresnel, reflectance)
+
+        hits = idx[collide]
+        if hits.size:
+            real = rng.random(hits.size) * m[collide] * mu_ref <= scene.mu_t_array(b.x[hits], b.z[hits])
+            null = hits[~real]
+            tau[null] = -np.log(np.maximum(rng.random(null.size), 1e-15))
+        else:
+            null = hits
+        idx = np.concatenate((cross, null))
+    return escaped
+
+
+def _drop(scene, b, heat, bins_per_mfp):
+    if scene.is_heterogeneous:
+        albedo = scene.albedo_array(b.x, b.z)
+    else:
+        albedo = scene.mu_s / (scene.mu_a + scene.mu_s)
+
+    dist = np.sqrt(b.x * b.x + b.y * b.y + b.z * b.z)
+    bin_idx = np.minimum((dist * bins_per_mfp).astype(np.int64), BINS - 1)
+    deposit = (1.0 - albedo) * b.weight
+    heat += np.bincount(bin_idx, weights=deposit, minlength=BINS)
+    b.weight *= albedo
+    if scene.is_tumor:
+        return float(deposit[scene.in_tumor_array(b.x, b.z)].sum())
+    return 0.0
+
+
+def _roulette(b, rng, final_x, final_z, reservoir=None):
+    low = np.flatnonzero(b.weight < ROULETTE_THRESHOLD)
+    if low.size == 0:
+        return 0.0
+    old = b.weight[low]
+    survive = rng.random(low.size) <= ROULETTE_CHANCE
+    dead = low[~survive]
+    final_x.append(b.x[dead].copy())
+    final_z.append(b.z[dead].copy())
+    if reservoir is not None:
+        reservoir.add(b.x[dead], b.y[dead], b.z[dead], old[~survive], b.steps[dead])
+    b.weight[dead] = 0.0
+    b.alive[dead] = False
+    b.weight[low[survive]] /= ROULETTE_CHANCE
+    return float(b.weight[low].sum() - old.sum())
+
+
+def _spin(scene, b, rng, table=None):
+    # table — таблица MC_tables.HGTable; без неё косинус рассеяния считается по формуле
+    idx = np.flatnonzero(b.alive)
+    count = idx.size
+    if count == 0:
+        return
+
+    # Отбор точки в единичном круге методом исключения, сразу для всех фотонов
+    x1 = np.empty(count)
+    x2 = np.empty(count)
+    todo = np.arange(count)
+    while todo.size:
+        c1 = 2.0 * rng.random(todo.size) - 1.0
+        c2 = 2.0 * rng.random(todo.size) - 1.0
+        ok = c1 * c1 + c2 * c2 <= 1.0
+        x1[todo[ok]] = c1[ok]
+        x2[todo[ok]] = c2[ok]
+        todo = todo[~ok]
+    x3 = np.maximum(x1 * x1 + x2 * x2, 1e-12)
+
+    if scene.is_heterogeneous:
+        g_local = scene.g_array(b.x[idx], b.z[idx])
+    else:
+        g_local = np.full(count, scene.g)
+    u, v, w = b.u[idx], b.v[idx], b.w[idx]
+
+    # изотропия
+    iso = g_local == 0.0
+    if iso.any():
+        ui = 2.0 * x3[iso] - 1.0
+        factor = np.sqrt(np.maximum(0.0, (1.0 - ui * ui) / x3[iso]))
+        u[iso] = ui
+        v[iso] = x1[iso] * factor
+        w[iso] = x2[iso] * factor
+
+    # Гамма-раскрытие Хение-Гринштейна
+    hg = ~iso
+    if hg.any():
+        gh = g_local[hg]
+        r = rng.random(gh.size)
+        if table is not None:
+            mu = table.sample_array(gh, r)
+        else:
+            mu = (1.0 - gh * gh) / (1.0 - gh + 2.0 * gh * r)
+            mu = (1.0 + gh * gh - mu * mu) / (2.0 * gh)
+        s1, s2, s3 = x1[hg], x2[hg], x3[hg]
+        uh, vh, wh = u[hg], v[hg], w[hg]
+        sin2 = 1.0 - mu * mu
+
+        flat = np.abs(wh) < 0.9
+        steep = ~flat
+
+        denom1 = np.maximum(1.0 - wh * wh, 1e-12)
+        a = np.sqrt(np.maximum(0.0, sin2 / denom1 / s3))
+        c = np.sqrt(np.maximum(0.0, sin2 * (1.0 - wh * wh) / s3))
+        u_f = mu * uh + a * (s1 * uh * wh - s2 * vh)
+        v_f = mu * vh + a * (s1 * vh * wh + s2 * uh)
+        w_f = mu * wh - c * s1
+
+        denom2 = np.maximum(1.0 - vh * vh, 1e-12)
+        a = np.sqrt(np.maximum(0.0, sin2 / denom2 / s3))
+        c = np.sqrt(np.maximum(0.0, sin2 * (1.0 - vh * vh) / s3))
+        u_s = mu * uh + a * (s1 * uh * vh + s2 * wh)
+        w_s = mu * wh + a * (s1 * vh * wh - s2 * uh)
+        v_s = mu * vh - c * s1
+
+        u[hg] = np.where(flat, u_f, u_s)
+        v[hg] = np.where(flat, v_f, v_s)
+        w[hg] = np.where(steep, w_s, w_f)
+
+    b.u[idx], b.v[idx], b.w[idx] = u, v, w
+
+
+def iter_mc_vectorized(scene, photons, chunk=None, batch_size=BATCH_SIZE, rng=None, progress=None, cancel=None,
+                       delta_tracking=False, tables=False, histogram=None, reservoir=None, stats=None,
+                       voxels=None, cylinder=None, reflectance=None):
+    # Каждые chunk завершённых фотонов отдаёт накопленные на этот момент величины. Если задана histogram
+    # (MC_histogram.PositionHistogram), конечные точки сразу раскладываются по копии её сетки и вместо
+    # массивов x и z отдаётся (гистограмма, None). reservoir (MC_reservoir.EndPointReservoir) пополняется
+    # конечными точками на месте, stats (MC_stats.RunStats) — счётчиками и временем этапов, voxels
+    # (MC_voxels.VoxelTally) — поглощённым весом и флюенсом по вокселям, cylinder (MC_cylinder.CylinderTally) —
+    # поглощённым весом по (r, z) и слоям, reflectance (MC_reflectance.ReflectanceTally) — отражением по r, углу
+    # выхода и x–y. По окончании генератор возвращает число взаимодействий
+    tallies = voxels is not None or cylinder is not None
+    if rng is None:
+        rng = np.random.default_rng()
+    # Со счётчиками методы сцены замеряются, а этапы цикла отмечаются _lap
+    scene = timed_scene(scene, stats)
+    if not chunk:
+        chunk = max(photons, 1)
+    n = scene.n
+    rs = (n - 1.0) * (n - 1.0) / ((n + 1.0) * (n + 1.0))
+    crit_angle = math.sqrt(max(0.0, 1.0 - 1.0 / (n * n)))
+    bins_per_mfp = 1e4 / microns_per_bin / (scene.mu_a + scene.mu_s)
+    delta_tracking = delta_tracking and scene.is_heterogeneous
+    if delta_tracking:
+        majorant = scene.majorant_layers() / (scene.mu_a + scene.mu_s)
+        tops, bottoms = scene.layer_slabs()
+    hg = hg_table(scene) if tables else None
+    fresnel = fresnel_table(scene) if tables else None
+
+    heat = np.zeros(BINS)
+    rd = 0.0
+    bit = 0.0
+    tumor_dose = 0.0
+    final_x = []
+    final_z = []
+    hist = None if histogram is None else histogram.empty()
+
+    b = PhotonBatch()
+    launched = 0
+    steps = 0
+    next_yield = min(chunk, photons)
+    marks = {photons // 4: '...25%', photons // 2: '...50%', 3 * photons // 4: '...75%'}
+    percent = -1
+    while launched < photons or len(b):
+        if cancel is not None and cancel.is_set():
+            raise SimulationCancelled()
+        completed = launched - len(b)
+        if progress is not None:
+            done = completed * 100 // max(photons, 1)
+            if done != percent:
+                percent = done
+                progress(completed, photons)
+        if completed >= next_yield and completed < photons:
+            next_yield = min(next_yield + chunk, photons)
+            yield _snapshot(completed, heat, bit, final_x, final_z, rd, tumor_dose, hist)
+
+        if stats is not None:
+            lap = time.perf_counter()
+
+        # Дозаполняем пакет новыми фотонами из очереди запуска
+        count = min(batch_size - len(b), photons - launched)
+        if count > 0:
+            b.refill(count, 1.0 - rs)
+            for mark in sorted(marks):
+                if launched <= mark < launched + count:
+                    print(marks.pop(mark))
+            launched += count
+        if stats is not None:
+            stats.photons += max(count, 0)
+            lap = _lap(stats, 'batch', lap)
+
+        if delta_tracking:
+            rd += _hop_delta(scene, b, rng, majorant, tops, bottoms, crit_angle, fresnel, stats, reflectance)
+        else:
+            _hop(b, rng)
+            if stats is not None:
+                hit = b.z <= 0.0
+                stats.bounces += int(hit.sum())
+                stats.internal_reflections += int((hit & (-b.w <= crit_angle)).sum())
+            rd += _bounce(scene, b, crit_angle, fresnel, reflectance)
+        steps += len(b)
+        if stats is not None:
+            lap = _lap(stats, 'move', lap)
+            stats.steps += len(b)
+        if tallies:
+            arrived = b.weight.copy()
+        tumor_dose += _drop(scene, b, heat, bins_per_mfp)
+        if tallies:
+            absorbed = arrived - b.weight
+        if voxels is not None:
+            # Флюенс — вес, пришедший во взаимодействие, делённый на частоту взаимодействий (см. absorb_tallies)
+            fluence = arrived
+            if delta_tracking:
+                fluence = arrived * (scene.mu_a + scene.mu_s) / scene.mu_t_array(b.x, b.z)
+            voxels.add(b.x, b.y, b.z, absorbed, fluence)
+        if cylinder is not None:
+            cylinder.add(np.hypot(b.x, b.y), b.z, absorbed, scene.layer_index_array(b.z))
+        b.steps += 1
+        if stats is not None:
+            low = int((b.weight < ROULETTE_THRESHOLD).sum())
+        bit += _roulette(b, rng, final_x, final_z, reservoir)
+        if stats is not None:
+            lap = _lap(stats, 'absorb', lap)
+            kills = len(b) - int(b.alive.sum())
+            stats.roulette_kills += kills
+            stats.roulette_survivals += low - kills
+        if hist is not None and final_x:
+            hist.add(np.concatenate(final_x), np.concatenate(final_z))
+            final_x.clear()
+            final_z.clear()
+            if stats is not None:
+                lap = _lap(stats, 'end points', lap)
+        if stats is not None:
+            stats.scatters += len(b) - kills
+        _spin(scene, b, rng, hg)
+        if stats is not None:
+            lap = _lap(stats, 'scatter', lap)
+
+        if not b.alive.all():
+            b.compact()
+        if stats is not None:
+            _lap(stats, 'batch', lap)
+    print('..100%')
+
+    yield _snapshot(photons, heat, bit, final_x, final_z, rd, tumor_dose, hist)
+    return steps
+
+
+def _lap(stats, name, start):
+    now = time.perf_counter()
+    stats.add_time(name, now - start)
+    return now
+
+
+def _snapshot(done, heat, bit, final_x, final_z, rd, tumor_dose, histogram=None):
+    if histogram is not None:
+        return done, heat.tolist(), bit, histogram.copy(), None, rd, tumor_dose
+    fx = np.concatenate(final_x) if final_x else np.zeros(0)
+    fz = np.concatenate(final_z) if final_z else np.zeros(0)
+    return done, heat.tolist(), bit, fx, fz, rd, tumor_dose
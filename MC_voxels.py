@@ -0,0 +1,240 @@
+import json
+
+import numpy as np
+
+from MC_histogram import bin_index
+
+# Область по умолчанию, мм: окно программы по x, такая же ширина по y, глубина слоёв по z
+X_RANGE = (-30.0, 30.0)
+Y_RANGE = (-30.0, 30.0)
+Z_RANGE = (0.0, 10.0)
+VOXEL_BINS = (120, 120, 100)
+# Сетки больше DENSE_LIMIT вокселей по умолчанию хранятся блоками BLOCK³, память — только под задетые блоки
+DENSE_LIMIT = 1 << 24
+BLOCK = 16
+
+
+class VoxelGrid:
+    # Одна величина на сетке shape в float32: целиком (data) или блоками — таблица blocks по BLOCK³ вокселей
+    # и массив lookup с номером строки таблицы для каждого блока сетки (-1, если блок не задет)
+    __slots__ = ('shape', 'block', 'data', 'lookup', 'blocks', 'used')
+
+    def __init__(self, shape, sparse=False, block=BLOCK):
+        self.shape = tuple(int(n) for n in shape)
+        self.block = block
+        self.used = 0
+        if sparse:
+            self.data = None
+            self.lookup = np.full(tuple(-(-n // block) for n in self.shape), -1, dtype=np.int32)
+            self.blocks = np.zeros((0, block ** 3), dtype=np.float32)
+        else:
+            self.data = np.zeros(self.shape, dtype=np.float32)
+            self.lookup = self.blocks = None
+
+    @property
+    def sparse(self):
+        return self.data is None
+
+    @property
+    def nbytes(self):
+        if self.sparse:
+            return self.lookup.nbytes + self.used * self.blocks.shape[1] * self.blocks.itemsize
+        return self.data.nbytes
+
+    def _rows(self, block_ids):
+        # Строки таблицы для номеров блоков; новые блоки получают строки в конце, таблица растёт вдвое
+        lookup = self.lookup.reshape(-1)
+        new = np.unique(block_ids[lookup[block_ids] < 0])
+        if new.size:
+            need = self.used + new.size
+            if need > len(self.blocks):
+                grown = np.zeros((max(need, 2 * len(self.blocks)), self.blocks.shape[1]), dtype=np.float32)
+                grown[:self.used] = self.blocks[:self.used]
+                self.blocks = grown
+            lookup[new] = np.arange(self.used, need, dtype=np.int32)
+            self.used = need
+        return lookup[block_ids].astype(np.int64)
+
+    def add(self, ix, iy, iz, weights):
+        if ix.size == 0:
+            return
+        if self.sparse:
+            b = self.block
+            rows = self._rows(np.ravel_multi_index((ix // b, iy // b, iz // b), self.lookup.shape))
+            flat = rows * b ** 3 + ((ix % b) * b + iy % b) * b + iz % b
+            target = self.blocks[:self.used].reshape(-1)
+        else:
+            flat = np.ravel_multi_index((ix, iy, iz), self.shape)
+            target = self.data.reshape(-1)
+        # Малую порцию дешевле добавить по индексам, большую — через bincount по всей сетке
+        if flat.size < target.size // 16:
+            np.add.at(target, flat, weights)
+        else:
+            target += np.bincount(flat, weights=weights, minlength=target.size).astype(np.float32)
+
+    def merge(self, other):
+        if other.shape != self.shape or other.sparse != self.sparse or other.block != self.block:
+            raise ValueError("Сетки разного размера или формата нельзя сложить")
+        if not self.sparse:
+            self.data += other.data
+            return self
+        block_ids = np.flatnonzero(other.lookup >= 0)
+        rows = self._rows(block_ids)
+        self.blocks[rows] += other.blocks[other.lookup.reshape(-1)[block_ids]]
+        return self
+
+    def _stored(self):
+        # (начало блока в вокселях, блок b×b×b) для всех задетых блоков
+        b = self.block
+        for block in np.argwhere(self.lookup >= 0):
+            yield block * b, self.blocks[self.lookup[tuple(block)]].reshape(b, b, b)
+
+    def __getitem__(self, key):
+        # Часть сетки как обычный массив: срезы и целые индексы по каждой оси, как у numpy
+        if not self.sparse:
+            return self.data[key]
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (3 - len(key))
+        axes = []
+        for k, n in zip(key, self.shape):
+            if isinstance(k, slice):
+                axes.append(np.arange(n)[k])
+            else:
+                axes.append(np.arange(n)[[k]])
+        out = np.zeros(tuple(a.size for a in axes), dtype=np.float32)
+        if out.size:
+            b = self.block
+            lo = [int(a.min()) for a in axes]
+            hi = [int(a.max()) + 1 for a in axes]
+            # Область [lo, hi) собирается из задетых блоков, затем из неё выбираются нужные индексы
+            region = np.zeros([h - l for l, h in zip(lo, hi)], dtype=np.float32)
+            sub = self.lookup[tuple(slice(l // b, (h - 1) // b + 1) for l, h in zip(lo, hi))]
+            for offset in np.argwhere(sub >= 0):
+                start = (offset + [l // b for l in lo]) * b
+                block = self.blocks[sub[tuple(offset)]].reshape(b, b, b)
+                src = tuple(slice(max(l - s, 0), min(h - s, b)) for l, h, s in zip(lo, hi, start))
+                dst = tuple(slice(s + c.start - l, s + c.stop - l) for l, s, c in zip(lo, start, src))
+                region[dst] = block[src]
+            out = region[np.ix_(*[a - l for a, l in zip(axes, lo)])]
+        drop = tuple(i for i, k in enumerate(key) if not isinstance(k, slice))
+        return out.squeeze(axis=drop) if drop else out
+
+    def dense(self):
+        return self.data if not self.sparse else self[:, :, :]
+
+    def project(self, axis):
+        # Сумма вдоль оси (float64) без сборки всей сетки
+        if not self.sparse:
+            return self.data.sum(axis=axis, dtype=np.float64)
+        b = self.block
+        padded = [n * b for n in self.lookup.shape]
+        out = np.zeros([n for i, n in enumerate(padded) if i != axis])
+        for start, block in self._stored():
+            corner = tuple(slice(s, s + b) for i, s in enumerate(start) if i != axis)
+            out[corner] += block.sum(axis=axis, dtype=np.float64)
+        return out[tuple(slice(0, n) for i, n in enumerate(self.shape) if i != axis)]
+
+    def save(self, path):
+        # .npy, который можно открыть np.load(path, mmap_mode='r'); блочная сетка пишется по блокам
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=self.shape)
+        if not self.sparse:
+            out[:] = self.data
+        else:
+            b = self.block
+            for start, block in self._stored():
+                stop = [min(s + b, n) for s, n in zip(start, self.shape)]
+                part = tuple(slice(0, e - s) for s, e in zip(start, stop))
+                out[tuple(slice(s, e) for s, e in zip(start, stop))] = block[part]
+        out.flush()
+        del out
+        return path
+
+
+class VoxelTally:
+    # Трёхмерная сетка x, y, z: поглощённый вес (absorbed) и оценка флюенса по столкновениям (fluence: вес,
+    # с которым фотон пришёл в точку взаимодействия, делённый на частоту взаимодействий относительно mu_a + mu_s
+    # сцены). Бины равной ширины, как у PositionHistogram; точки вне области не считаются.
+    # На фотон и единицу объёма: величина * scale(число фотонов)
+    __slots__ = ('x_range', 'y_range', 'z_range', 'bins', 'block', 'absorbed', 'fluence', 'total')
+    QUANTITIES = ('absorbed', 'fluence')
+
+    def __init__(self, x_range=X_RANGE, y_range=Y_RANGE, z_range=Z_RANGE, bins=VOXEL_BINS, sparse=None,
+                 block=BLOCK):
+        self.x_range = (float(x_range[0]), float(x_range[1]))
+        self.y_range = (float(y_range[0]), float(y_range[1]))
+        self.z_range = (float(z_range[0]), float(z_range[1]))
+        self.bins = (bins,) * 3 if isinstance(bins, int) else tuple(int(n) for n in bins)
+        self.block = block
+        if sparse is None:
+            sparse = int(np.prod(self.bins)) > DENSE_LIMIT
+        self.absorbed = VoxelGrid(self.bins, sparse, block)
+        self.fluence = VoxelGrid(self.bins, sparse, block)
+        # Все добавленные взаимодействия, включая вышедшие за область
+        self.total = 0
+
+    @property
+    def sparse(self):
+        return self.absorbed.sparse
+
+    @property
+    def nbytes(self):
+        return self.absorbed.nbytes + self.fluence.nbytes
+
+    def spec(self):
+        return self.x_range, self.y_range, self.z_range, self.bins, self.sparse, self.block
+
+    def empty(self):
+        x_range, y_range, z_range, bins, sparse, block = self.spec()
+        return VoxelTally(x_range, y_range, z_range, bins, sparse, block)
+
+    def edges(self):
+        return tuple(np.linspace(lo, hi, n + 1)
+                     for (lo, hi), n in zip((self.x_range, self.y_range, self.z_range), self.bins))
+
+    def voxel_volume(self):
+        return float(np.prod([(hi - lo) / n
+                              for (lo, hi), n in zip((self.x_range, self.y_range, self.z_range), self.bins)]))
+
+    def scale(self, photons):
+        return 1.0 / (max(photons, 1) * self.voxel_volume())
+
+    def add(self, x, y, z, absorbed, fluence):
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+        z = np.asarray(z, dtype=float).ravel()
+        self.total += x.size
+        if x.size == 0:
+            return
+        nx, ny, nz = self.bins
+        ix, in_x = bin_index(x, self.x_range, nx)
+        iy, in_y = bin_index(y, self.y_range, ny)
+        iz, in_z = bin_index(z, self.z_range, nz)
+        inside = in_x & in_y & in_z
+        ix, iy, iz = ix[inside], iy[inside], iz[inside]
+        self.absorbed.add(ix, iy, iz, np.asarray(absorbed, dtype=float).ravel()[inside])
+        self.fluence.add(ix, iy, iz, np.asarray(fluence, dtype=float).ravel()[inside])
+
+    def merge(self, other):
+        if other.spec() != self.spec():
+            raise ValueError("Сетки вокселей с разной областью нельзя сложить")
+        self.absorbed.merge(other.absorbed)
+        self.fluence.merge(other.fluence)
+        self.total += other.total
+        return self
+
+    def save(self, base):
+        # base_absorbed.npy, base_fluence.npy и base.json с областью и числом бинов
+        paths = [getattr(self, name).save(f'{base}_{name}.npy') for name in self.QUANTITIES]
+        spec = {'x_range': self.x_range, 'y_range': self.y_range, 'z_range': self.z_range, 'bins': self.bins,
+                'total': self.total}
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(spec, f, indent=2)
+        return paths + [base + '.json']
+
+
+def load_voxels(base):
+    # Сохранённая сетка без чтения в память: (описание области, {величина: np.memmap})
+    with open(base + '.json', encoding='utf-8') as f:
+        spec = json.load(f)
+    return spec, {name: np.load(f'{base}_{name}.npy', mmap_mode='r') for name in VoxelTally.QUANTITIES}
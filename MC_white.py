@@ -0,0 +1,139 @@
+import math
+
+import numpy as np
+
+from MC_vector import (PhotonBatch, SimulationCancelled, _hop, _spin, BINS, BATCH_SIZE, ROULETTE_THRESHOLD,
+                       ROULETTE_CHANCE, microns_per_bin)
+from MC_sweep import sweep_scenes, SweepResult
+
+
+class WhiteBatch(PhotonBatch):
+    # weight — матрица (фотон × длина волны), траектория у всех длин волн общая
+
+    def __init__(self, size=0, waves=1):
+        super().__init__(size)
+        self.weight = np.zeros((size, waves))
+
+
+def _bounce_white(scenes, b, crit_angle):
+    hit = b.z <= 0.0
+    if not hit.any():
+        return 0.0
+    b.w[hit] = -b.w[hit]
+    b.z[hit] = -b.z[hit]
+    out = hit & (b.w > crit_angle)
+    if not out.any():
+        return 0.0
+    w = b.w[out][:, None]
+    if scenes[0].is_heterogeneous:
+        n_local = np.stack([scene.n_array(b.x[out], b.z[out]) for scene in scenes], axis=1)
+    else:
+        n_local = np.array([scene.n for scene in scenes])
+    t = np.sqrt(np.maximum(0.0, 1.0 - n_local * n_local * (1.0 - w * w)))
+    temp1 = (w - n_local * t) / (w + n_local * t)
+    temp = (t - n_local * w) / (t + n_local * w)
+    rf = (temp1 * temp1 + temp * temp) / 2.0
+    escaped = (1.0 - rf) * b.weight[out]
+    b.weight[out] -= escaped
+    return escaped.sum(axis=0)
+
+
+def _drop_white(scenes, b, heat, bins_per_mfp):
+    if scenes[0].is_heterogeneous:
+        albedo = np.stack([scene.albedo_array(b.x, b.z) for scene in scenes], axis=1)
+    else:
+        albedo = np.array([scene.mu_s / (scene.mu_a + scene.mu_s) for scene in scenes])
+
+    dist = np.sqrt(b.x * b.x + b.y * b.y + b.z * b.z)
+    bin_idx = np.minimum((dist * bins_per_mfp).astype(np.int64), BINS - 1)
+    deposit = (1.0 - albedo) * b.weight
+    waves = len(scenes)
+    # Все длины волн одним bincount: бин k-й длины волны сдвинут на k * BINS
+    flat_idx = (bin_idx[:, None] + BINS * np.arange(waves)).ravel()
+    heat += np.bincount(flat_idx, weights=deposit.ravel(), minlength=waves * BINS).reshape(waves, BINS)
+    b.weight *= albedo
+    if scenes[0].is_tumor:
+        return deposit[scenes[0].in_tumor_array(b.x, b.z)].sum(axis=0)
+    return 0.0
+
+
+def _roulette_white(b, rng, final_x, final_z):
+    # Рулетка по наибольшему из весов: выживший фотон увеличивает веса всех длин волн одинаково
+    low = np.flatnonzero(b.weight.max(axis=1) < ROULETTE_THRESHOLD)
+    if low.size == 0:
+        return 0.0
+    old = b.weight[low]
+    survive = rng.random(low.size) <= ROULETTE_CHANCE
+    dead = low[~survive]
+    final_x.append(b.x[dead].copy())
+    final_z.append(b.z[dead].copy())
+    b.weight[dead] = 0.0
+    b.alive[dead] = False
+    b.weight[low[survive]] /= ROULETTE_CHANCE
+    return b.weight[low].sum(axis=0) - old.sum(axis=0)
+
+
+def run_mc_white(scenes, photons, reference=None, batch_size=BATCH_SIZE, rng=None, progress=None, cancel=None):
+    # Одна траектория на фотон для всех сцен (длин волн) сразу. Шаги отсчитываются в длинах свободного
+    # пробега общего mu_a + mu_s сцены и от коэффициентов слоёв не зависят; от длины волны зависят только
+    # альбедо при взаимодействии и отражение Френеля на границе — они считаются для каждой сцены.
+    # Рассеяние (g) берётся из сцены reference.
+    if rng is None:
+        rng = np.random.default_rng()
+    if reference is None:
+        reference = len(scenes) // 2
+    ref = scenes[reference]
+    waves = len(scenes)
+    n = ref.n
+    rs = (n - 1.0) * (n - 1.0) / ((n + 1.0) * (n + 1.0))
+    crit_angle = math.sqrt(max(0.0, 1.0 - 1.0 / (n * n)))
+    bins_per_mfp = 1e4 / microns_per_bin / (ref.mu_a + ref.mu_s)
+
+    heat = np.zeros((waves, BINS))
+    rd = np.zeros(waves)
+    bit = np.zeros(waves)
+    tumor_dose = np.zeros(waves)
+    final_x = []
+    final_z = []
+
+    b = WhiteBatch(waves=waves)
+    launched = 0
+    while launched < photons or len(b):
+        if cancel is not None and cancel.is_set():
+            raise SimulationCancelled()
+        if progress is not None:
+            progress(launched - len(b), photons)
+
+        count = min(batch_size - len(b), photons - launched)
+        if count > 0:
+            b.refill(count, 1.0 - rs)
+            launched += count
+
+        _hop(b, rng)
+        rd += _bounce_white(scenes, b, crit_angle)
+        tumor_dose += _drop_white(scenes, b, heat, bins_per_mfp)
+        bit += _roulette_white(b, rng, final_x, final_z)
+        _spin(ref, b, rng)
+
+        if not b.alive.all():
+            b.compact()
+    if progress is not None:
+        progress(photons, photons)
+
+    fx = np.concatenate(final_x) if final_x else np.zeros(0)
+    fz = np.concatenate(final_z) if final_z else np.zeros(0)
+    return heat, bit, rd, rs, tumor_dose, fx, fz
+
+
+def run_white(wavelengths, new_mu_a, new_mu_s, new_g, new_n, new_photons=20000, seed=None, reference_wave=None,
+              progress=None, cancel=None, **scene_kwargs):
+    # То же, что run_sweep, но за один проход; результат — SweepResult
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    scenes = sweep_scenes(wavelengths, new_mu_a, new_mu_s, new_g, new_n, **scene_kwargs)
+    reference = None if reference_wave is None else int(np.argmin(np.abs(wavelengths - reference_wave)))
+    photons = new_photons // 2
+    heat, bit, rd, rs, tumor_dose, _, _ = run_mc_white(scenes, photons, reference,
+                                                       rng=np.random.default_rng(seed),
+                                                       progress=progress, cancel=cancel)
+    results = [(heat[i].tolist(), bit[i], rd[i], rs, tumor_dose[i]) for i in range(len(scenes))]
+    return SweepResult(wavelengths, photons, results)
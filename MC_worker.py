@@ -0,0 +1,138 @@
+import threading
+import traceback
+
+from PySide6.QtCore import QObject, QThread, Signal
+
+from MC_algo import get_data, iter_data, SimulationCancelled
+
+
+class SimulationWorker(QObject):
+    progress = Signal(int, int)  # run_id, проценты
+    partial = Signal(int, int, object)  # run_id, готово фотонов, (heat, bit, final_x, final_z)
+    finished = Signal(int, object)  # run_id, (heat, bit, final_x, final_z)
+    cancelled = Signal(int)
+    failed = Signal(int, str)
+    done = Signal()
+
+    def __init__(self, run_id, args, kwargs, chunk=None):
+        super().__init__()
+        self.run_id = run_id
+        self.args = args
+        self.kwargs = kwargs
+        self.chunk = chunk
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def _on_progress(self, done, total):
+        self.progress.emit(self.run_id, int(100 * done / max(total, 1)))
+
+    def run(self):
+        try:
+            if self.chunk and self.kwargs.get('workers', 1) == 1:
+                res = self._run_streaming()
+            else:
+                res = get_data(*self.args, progress=self._on_progress, cancel=self._cancel, **self.kwargs)
+        except SimulationCancelled:
+            self.cancelled.emit(self.run_id)
+        except Exception:
+            self.failed.emit(self.run_id, traceback.format_exc())
+        else:
+            if self._cancel.is_set():
+                self.cancelled.emit(self.run_id)
+            else:
+                self.finished.emit(self.run_id, res)
+        self.done.emit()
+
+    def _run_streaming(self):
+        kwargs = dict(self.kwargs)
+        kwargs.pop('workers', None)
+        res = None
+        for done, res in iter_data(*self.args, chunk=self.chunk, progress=self._on_progress, cancel=self._cancel,
+                                   **kwargs):
+            if done < kwargs.get('new_photons', 20000) // 2:
+                self.partial.emit(self.run_id, done, res)
+        return res
+
+
+class SimulationRunner(QObject):
+    # Запускает моделирования в фоновых потоках; новый запуск отменяет устаревший
+    progress = Signal(int)
+    partial = Signal(int, object)
+    finished = Signal(object)
+    cancelled = Signal()
+    failed = Signal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._run_id = 0
+        self._worker = None
+        self._threads = {}
+
+    def is_running(self):
+        return self._worker is not None
+
+    def start(self, *args, chunk=None, **kwargs):
+        # chunk: раз в сколько фотонов присылать промежуточный результат (только для одного процесса)
+        self.cancel()
+        self._run_id += 1
+        thread = QThread(self)
+        worker = SimulationWorker(self._run_id, args, kwargs, chunk)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.progress.connect(self._on_progress)
+        worker.partial.connect(self._on_partial)
+        worker.finished.connect(self._on_finished)
+        worker.cancelled.connect(self._on_cancelled)
+        worker.failed.connect(self._on_failed)
+        worker.done.connect(thread.quit)
+        thread.finished.connect(lambda run_id=self._run_id: self._on_thread_finished(run_id))
+        self._threads[self._run_id] = (thread, worker)
+        self._worker = worker
+        thread.start()
+
+    def cancel(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def wait(self):
+        self.cancel()
+        for thread, _ in list(self._threads.values()):
+            thread.wait()
+
+    def _current(self, run_id):
+        return self._worker is not None and run_id == self._worker.run_id
+
+    def _on_progress(self, run_id, percent):
+        if self._current(run_id):
+            self.progress.emit(percent)
+
+    def _on_partial(self, run_id, done, res):
+        if self._current(run_id):
+            self.partial.emit(done, res)
+
+    def _on_finished(self, run_id, res):
+        if self._current(run_id):
+            self._worker = None
+            self.finished.emit(res)
+
+    def _on_cancelled(self, run_id):
+        # Устаревший запуск, вытесненный новым, молча отбрасывается
+        if run_id == self._run_id:
+            self._worker = None
+            self.cancelled.emit()
+
+    def _on_failed(self, run_id, message):
+        if self._current(run_id):
+            self._worker = None
+            self.failed.emit(message)
+
+    def _on_thread_finished(self, run_id):
+        thread, worker = self._threads.pop(run_id)
+        worker.deleteLater()
+        thread.deleteLater()
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+import MC_benchmark
+
+
+def _record(photons_per_s):
+    return {'time': '2026-01-01T00:00:00', 'revision': None, 'engine': 'python', 'delta_tracking': False,
+            'photons': 1000, 'results': {'scene': {'photons_per_s': photons_per_s}}}
+
+
+def test_regression_against_history_file(tmp_path, monkeypatch, capsys):
+    history = tmp_path / 'history.jsonl'
+    history.write_text(json.dumps(_record(1000.0)) + '\n', encoding='utf-8')
+    monkeypatch.setattr(MC_benchmark, 'run_suite', lambda *args, **kwargs: _record(500.0))
+    code = MC_benchmark.main(['--suite', '--photons', '1000', '--history', str(history),
+                              '--baseline', str(history)])
+    assert code == 1
+    assert 'REGRESSION' in capsys.readouterr().out
+    # Замер всё равно дописан в историю
+    assert len(history.read_text(encoding='utf-8').splitlines()) == 2
+
+
+def test_no_regression_within_threshold(tmp_path, monkeypatch):
+    history = tmp_path / 'history.jsonl'
+    history.write_text(json.dumps(_record(1000.0)) + '\n', encoding='utf-8')
+    monkeypatch.setattr(MC_benchmark, 'run_suite', lambda *args, **kwargs: _record(950.0))
+    assert MC_benchmark.main(['--suite', '--photons', '1000', '--history', str(history),
+                              '--baseline', str(history)]) == 0
+
+
+def test_time_case_counts_steps_of_the_timed_run():
+    params = dict(MC_benchmark.SUITE[0][1])
+    result = MC_benchmark.time_case(500, 'numpy', params, repeat=1)
+    assert result['steps_per_photon'] > 1.0
+    assert result['steps_per_s'] == pytest.approx(result['steps_per_photon'] * result['photons_per_s'])
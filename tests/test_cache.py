@@ -0,0 +1,72 @@
+import contextlib
+import io
+
+import numpy as np
+
+from MC_algo import get_data
+from MC_cache import ResultCache, result_key
+from MC_scene import Scene
+from MC_stats import RunStats
+
+
+def _result():
+    return [1.0, 2.0, 3.0], 0.5, np.array([0.1, 0.2]), np.array([1.0, 2.0])
+
+
+def test_put_and_get_from_disk(tmp_path):
+    ResultCache(directory=str(tmp_path)).put('key', _result())
+    heat, bit, final_x, final_z = ResultCache(directory=str(tmp_path)).get('key')
+    assert heat == [1.0, 2.0, 3.0]
+    assert bit == 0.5
+    assert np.array_equal(final_z, [1.0, 2.0])
+
+
+def test_corrupted_file_is_a_miss_and_removed(tmp_path):
+    ResultCache(directory=str(tmp_path)).put('key', _result())
+    path = tmp_path / 'key.npz'
+    path.write_bytes(path.read_bytes()[:40])
+    assert ResultCache(directory=str(tmp_path)).get('key') is None
+    assert not path.exists()
+
+
+def test_missing_file_is_a_miss(tmp_path):
+    assert ResultCache(directory=str(tmp_path)).get('absent') is None
+
+
+def _get(cache, seed=1, **params):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return get_data(5.0, 95.0, 0.5, 1.5, new_is_heterogeneous=False, new_is_tumor=False, new_is_vessel=False,
+                        new_photons=200, seed=seed, cache=cache, **params)
+
+
+def test_get_data_reuses_cached_result():
+    cache = ResultCache(directory=None)
+    first = _get(cache)
+    assert len(cache._memory) == 1
+    second = _get(cache)
+    assert second is cache._memory[next(iter(cache._memory))]
+    assert second[0] == first[0]
+    _get(cache, seed=2)
+    _get(cache, engine='numpy')
+    assert len(cache._memory) == 3
+
+
+def test_tallies_bypass_cache():
+    cache = ResultCache(directory=None)
+    _get(cache, stats=RunStats())
+    assert len(cache._memory) == 0
+
+
+def test_key_depends_on_engine_version():
+    scene = Scene()
+    assert result_key(scene, seed=1, version=1) != result_key(scene, seed=1, version=2)
+    assert result_key(scene, seed=1, version=1) == result_key(Scene(), seed=1, version=1)
+
+
+def test_memory_and_disk_eviction(tmp_path):
+    cache = ResultCache(max_entries=1, directory=str(tmp_path), max_disk_bytes=1)
+    cache.put('a', _result())
+    cache.put('b', _result())
+    assert list(cache._memory) == ['b']
+    # На диске не помещается ни одна запись: последняя тоже удаляется
+    assert not list(tmp_path.glob('*.npz'))
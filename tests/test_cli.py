@@ -0,0 +1,39 @@
+import json
+
+from MC_cli import main
+
+
+def test_empty_scenario_runs_with_defaults(tmp_path):
+    scenario = tmp_path / 'empty.json'
+    scenario.write_text('{}', encoding='utf-8')
+    output = tmp_path / 'result'
+    assert main([str(scenario), '-o', str(output), '--photons', '200', '--seed', '1']) == 0
+    summary = json.loads((tmp_path / 'result.json').read_text(encoding='utf-8'))
+    assert summary['photons'] == 200
+    assert summary['scenario']['layers']
+
+
+def test_heterogeneous_without_layers_is_rejected(tmp_path, capsys):
+    scenario = tmp_path / 'no_layers.json'
+    scenario.write_text('{"layers": []}', encoding='utf-8')
+    assert main([str(scenario), '-o', str(tmp_path / 'result')]) == 2
+    assert "Ошибка сценария" in capsys.readouterr().err
+
+
+def _run(tmp_path, text, capsys):
+    scenario = tmp_path / 'scenario.json'
+    scenario.write_text(text, encoding='utf-8')
+    code = main([str(scenario), '-o', str(tmp_path / 'result'), '--photons', '100'])
+    return code, capsys.readouterr().err
+
+
+def test_tumor_type_out_of_range_is_a_scenario_error(tmp_path, capsys):
+    code, err = _run(tmp_path, '{"tumor": {"type": 99}}', capsys)
+    assert code == 2
+    assert "Ошибка сценария" in err
+
+
+def test_unknown_tissue_is_a_scenario_error(tmp_path, capsys):
+    code, err = _run(tmp_path, '{"layers": [["Слой", 0.0, 10.0, "Нет такой ткани"]]}', capsys)
+    assert code == 2
+    assert "Ошибка сценария" in err
@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pytest
+
+from MC_reading_csv import CoefficientStore, get_coefficients_for, get_coefficients_many, get_tissue_names
+
+CSV = "Ткань;600;1,0;100;0,8;1,4\nТкань;700;3,0;80;0,9;1,4\nплохая строка\nДругая;650;2;50;0,7;1,3\n"
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / 'coef.csv'
+    path.write_text(CSV, encoding='utf-8')
+    return CoefficientStore(str(path))
+
+
+def test_lookup_nearest_and_linear(store):
+    assert store.tissues() == ["Ткань", "Другая"]
+    assert store.lookup(["Ткань"], [640])[0, 0].tolist() == [1.0, 100.0, 0.8, 1.4]
+    linear = store.lookup(["Ткань", "Другая"], [650, 750], method='linear')
+    assert linear.shape == (2, 2, 4)
+    assert np.allclose(linear[0, 0], [2.0, 90.0, 0.85, 1.4])
+    # Выше диапазона — продолжение прямой по двум последним точкам
+    assert np.allclose(linear[0, 1], [4.0, 70.0, 0.95, 1.4])
+    # Одна точка — одно значение на любой длине волны
+    assert np.allclose(linear[1], [[2.0, 50.0, 0.7, 1.3]] * 2)
+
+
+def test_errors(store):
+    with pytest.raises(KeyError):
+        store.lookup(["Нет такой"], [650])
+    with pytest.raises(ValueError):
+        store.lookup(["Ткань"], [650], method='cubic')
+
+
+def test_file_is_reread_only_after_change(store):
+    store.tissues()
+    tables = store._tables
+    store.tissues()
+    assert store._tables is tables
+    with open(store.path, 'a', encoding='utf-8') as f:
+        f.write("Новая;650;1;1;0;1\n")
+    stat = os.stat(store.path)
+    os.utime(store.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert "Новая" in store.tissues()
+
+
+def test_module_lookup_agrees_with_single_lookup():
+    tissue = get_tissue_names()[0]
+    many = get_coefficients_many([tissue], [650], method='nearest')[0, 0]
+    assert list(get_coefficients_for(tissue, 650).values()) == many.tolist()
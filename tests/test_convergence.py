@@ -0,0 +1,29 @@
+import pytest
+
+from MC_convergence import get_data_converged
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+
+
+def test_tumor_without_dose_does_not_block_convergence():
+    # Маленькая опухоль далеко от пучка: доза нулевая, сходимость — только по нагреву
+    _, report = get_data_converged(5.0, 95.0, 0.5, 1.5, new_cx=25.0, new_cz=9.5, new_rx=0.1, new_rz=0.1,
+                                   new_mode=('A', LAYERS_A), engine='numpy', seed=1, tolerance=0.2,
+                                   batch_photons=2000, max_photons=200000)
+    assert report.tumor_dose == 0.0
+    assert report.converged
+    assert report.reason == 'tolerance'
+    assert report.photons < 200000
+
+
+def test_budget_smaller_than_batch_runs_one_batch():
+    res, report = get_data_converged(5.0, 95.0, 0.5, 1.5, new_mode=('A', LAYERS_A), engine='numpy', seed=1,
+                                     batch_photons=10000, max_photons=2000)
+    assert report.batches == 1
+    assert report.photons == 2000
+    assert sum(res[0]) > 0.0
+
+
+def test_empty_budget_is_rejected():
+    with pytest.raises(ValueError):
+        get_data_converged(5.0, 95.0, 0.5, 1.5, new_mode=('A', LAYERS_A), max_photons=0)
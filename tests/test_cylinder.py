@@ -0,0 +1,57 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from MC_algo import create_simulation
+from MC_cylinder import CylinderTally
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+
+
+def _run(engine, **tallies):
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = create_simulation(5.0, 95.0, 0.5, 1.5, new_photons=2000, seed=3, new_wave=650,
+                                new_mode=('A', LAYERS_A), **tallies)
+        sim.run(engine)
+    return sim
+
+
+@pytest.mark.parametrize('engine', ['python', 'numpy'])
+def test_cylinder_holds_all_absorption_by_cell_and_layer(engine):
+    plain = _run(engine)
+    cylinder = CylinderTally(nr=20, nz=20)
+    tallied = _run(engine, cylinder=cylinder)
+    assert tallied.heat == plain.heat
+    assert cylinder.absorbed.sum() == pytest.approx(sum(plain.heat), rel=1e-9)
+    assert cylinder.layers.sum() == pytest.approx(cylinder.absorbed.sum(), rel=1e-9)
+    assert cylinder.layers.size >= 2
+
+
+def test_normalization_matches_absorbed_weight():
+    cylinder = CylinderTally(dr=0.5, dz=0.25, nr=4, nz=4)
+    cylinder.add([0.1, 0.7, 10.0], [0.1, 0.3, 10.0], [1.0, 2.0, 4.0], layer=[0, 1, 1])
+    # Дальние точки попадают в последний бин по обеим осям
+    assert cylinder.absorbed[0, 0] == 1.0 and cylinder.absorbed[1, 1] == 2.0 and cylinder.absorbed[3, 3] == 4.0
+    assert cylinder.layer_fractions(2).tolist() == [0.5, 3.0]
+    assert cylinder.absorbed_fraction(2) == 3.5
+    assert cylinder.depth_profile(2).sum() * cylinder.dz == pytest.approx(3.5)
+    volume = 2.0 * np.pi * cylinder.r_centers() * cylinder.dr * cylinder.dz
+    assert (cylinder.rz_density(2) * volume[:, None]).sum() == pytest.approx(3.5)
+
+
+def test_merge_equals_single_tally():
+    rng = np.random.default_rng(2)
+    r, z, w = rng.uniform(0, 3, 1000), rng.uniform(0, 3, 1000), rng.random(1000)
+    layer = (z > 1.5).astype(int)
+    whole, part = CylinderTally(nr=10, nz=10), CylinderTally(nr=10, nz=10)
+    whole.add(r, z, w, layer)
+    part.add(r[:400], z[:400], w[:400], layer[:400])
+    rest = part.empty()
+    rest.add(r[400:], z[400:], w[400:], layer[400:])
+    part.merge(rest)
+    assert np.allclose(part.absorbed, whole.absorbed)
+    assert np.allclose(part.layers, whole.layers)
+    with pytest.raises(ValueError):
+        part.merge(CylinderTally(nr=5, nz=10))
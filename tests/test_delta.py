@@ -0,0 +1,55 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from MC_algo import PhotonTransport, build_scene
+from MC_scene import Scene
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+
+
+def _layers_scene(**params):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return build_scene(5.0, 95.0, 0.5, 1.5, new_wave=650, new_mode=('A', LAYERS_A), **params)
+
+
+def _run(scene, engine, delta_tracking, photons=5000, seed=2):
+    sim = PhotonTransport(scene, photons=photons, seed=seed, delta_tracking=delta_tracking)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim.run(engine)
+    return sim
+
+
+@pytest.mark.parametrize('vessel', [False, True])
+def test_majorant_bounds_extinction(vessel):
+    scene = _layers_scene(new_is_vessel=vessel)
+    rng = np.random.default_rng(0)
+    x, z = rng.uniform(-15.0, 15.0, 20000), rng.uniform(0.0, 15.0, 20000)
+    majorant = scene.majorant_layers()[scene.layer_index_array(z)]
+    assert (scene.mu_t_array(x, z) <= majorant * (1.0 + 1e-12)).all()
+
+
+@pytest.mark.parametrize('engine', ['python', 'numpy'])
+def test_homogeneous_scene_ignores_delta_tracking(engine):
+    scene = Scene(is_vessel=False, is_heterogeneous=False, is_tumor=False)
+    plain, delta = _run(scene, engine, False, 500), _run(scene, engine, True, 500)
+    assert delta.heat == plain.heat
+    assert delta.rd == plain.rd
+
+
+def test_delta_matches_analog_when_extinction_is_global():
+    # Слои с тем же mu_a + mu_s, что и у сцены: длины пробега совпадают, отличаются только альбедо
+    scene = Scene(is_vessel=False, is_tumor=False, layers=[("a", 0.0, 0.5), ("b", 0.5, 1.0), ("c", 1.0, 5.0)],
+                  coef=[(2.0, 98.0, 0.5, 1.5), (10.0, 90.0, 0.5, 1.5), (5.0, 95.0, 0.5, 1.5)])
+    plain, delta = _run(scene, 'numpy', False, 20000), _run(scene, 'numpy', True, 20000)
+    assert sum(delta.heat) / delta.photons == pytest.approx(sum(plain.heat) / plain.photons, rel=0.02)
+    assert delta.rd / delta.photons == pytest.approx(plain.rd / plain.photons, rel=0.04)
+
+
+def test_engines_agree_with_delta_tracking():
+    scene = _layers_scene(new_is_vessel=False)
+    python, numpy = _run(scene, 'python', True), _run(scene, 'numpy', True, 20000)
+    assert sum(numpy.heat) / numpy.photons == pytest.approx(sum(python.heat) / python.photons, rel=0.03)
+    assert numpy.rd / numpy.photons == pytest.approx(python.rd / python.photons, rel=0.1)
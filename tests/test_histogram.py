@@ -0,0 +1,53 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from MC_algo import get_data
+from MC_histogram import PositionHistogram, bin_index
+
+
+def test_value_just_below_upper_edge_stays_in_last_bin():
+    value_range = (-0.2, 31.977488744372184)
+    z = np.array([np.nextafter(value_range[1], -np.inf), value_range[1]])
+    idx, inside = bin_index(z, value_range, 250)
+    assert inside.all()
+    assert (idx == 249).all()
+
+
+def test_histogram_counts_edge_values_in_last_row():
+    hist = PositionHistogram(x_range=(-1.0, 1.0), z_range=(-0.2, 31.977488744372184), bins=(4, 250))
+    z = np.full(1000, np.nextafter(31.977488744372184, -np.inf))
+    hist.add(np.zeros_like(z), z)
+    assert hist.counts[:, -1].sum() == 1000
+    assert hist.counts.sum() == 1000
+
+
+def test_matches_histogram2d():
+    rng = np.random.default_rng(0)
+    x, z = rng.uniform(-35, 35, 5000), rng.uniform(-1, 12, 5000)
+    hist = PositionHistogram(bins=(50, 40))
+    hist.add(x[:100], z[:100])
+    hist.add(x[100:], z[100:])
+    expected, _, _ = np.histogram2d(x, z, bins=hist.edges())
+    assert np.array_equal(hist.counts, expected)
+    assert hist.total == 5000
+
+
+@pytest.mark.parametrize('engine', ['python', 'numpy'])
+def test_get_data_bins_end_points(engine):
+    hist = PositionHistogram(bins=(60, 50))
+    with contextlib.redirect_stdout(io.StringIO()):
+        kwargs = dict(new_is_heterogeneous=False, new_is_tumor=False, new_is_vessel=False, new_photons=1000, seed=1,
+                      engine=engine)
+        heat, bit, binned, final_z = get_data(5.0, 95.0, 0.5, 1.5, histogram=hist, **kwargs)
+        plain = get_data(5.0, 95.0, 0.5, 1.5, **kwargs)
+    assert final_z is None
+    assert heat == plain[0]
+    # Сетка, переданная в get_data, не меняется: точки раскладываются по её копии
+    assert hist.total == 0
+    expected = hist.empty()
+    expected.add(plain[2], plain[3])
+    assert np.array_equal(binned.counts, expected.counts)
+    assert binned.total == 500
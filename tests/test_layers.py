@@ -0,0 +1,38 @@
+import numpy as np
+
+from MC_scene import Scene
+
+# Четыре слоя, заданные не по порядку
+LAYERS = [("Дерма", 0.1, 2.0), ("Эпидермис", 0.0, 0.1), ("Мышца", 5.0, 9.0), ("Гипподерма", 2.0, 5.0)]
+COEF = [(2.0, 200.0, 0.8, 1.4), (4.0, 300.0, 0.9, 1.5), (1.0, 50.0, 0.7, 1.37), (0.5, 100.0, 0.75, 1.44)]
+
+
+def _scene():
+    return Scene(is_vessel=False, is_tumor=False, layers=LAYERS, coef=COEF)
+
+
+def test_layers_are_sorted_by_depth_with_their_coefficients():
+    scene = _scene()
+    assert [layer[0] for layer in scene.layers] == ["Эпидермис", "Дерма", "Гипподерма", "Мышца"]
+    assert scene.coef[:, 0].tolist() == [4.0, 2.0, 0.5, 1.0]
+    assert scene.bounds_list == [0.1, 2.0, 5.0]
+
+
+def test_layer_index_at_bounds_and_beyond_last_layer():
+    scene = _scene()
+    z = [-1.0, 0.0, 0.05, 0.1, 1.0, 2.0, 4.99, 5.0, 9.0, 50.0]
+    expected = [0, 0, 0, 1, 1, 2, 2, 3, 3, 3]
+    assert [scene.layer_index(value) for value in z] == expected
+    assert scene.layer_index_array(np.array(z)).tolist() == expected
+
+
+def test_coefficients_follow_layer():
+    scene = _scene()
+    for z, row in ((0.05, 1), (1.0, 0), (3.0, 3), (7.0, 2)):
+        assert (scene.mu_a_at(0.0, z), scene.mu_s_at(0.0, z), scene.g_at(0.0, z), scene.n_at(0.0, z)) == COEF[row]
+
+
+def test_layer_slabs_cover_depth():
+    tops, bottoms = _scene().layer_slabs()
+    assert tops.tolist() == [0.0, 0.1, 2.0, 5.0]
+    assert bottoms.tolist() == [0.1, 2.0, 5.0, np.inf]
@@ -0,0 +1,49 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from MC_algo import create_simulation
+from MC_cylinder import CylinderTally
+from MC_parallel import get_data_parallel, split_photons
+from MC_stats import RunStats
+
+ARGS = (5.0, 95.0, 0.5, 1.5)
+KWARGS = dict(new_is_heterogeneous=False, new_is_tumor=False, new_is_vessel=False, new_photons=1000)
+
+
+def _parallel(**tallies):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return get_data_parallel(*ARGS, workers=2, seed=5, **KWARGS, **tallies)
+
+
+def test_split_photons():
+    assert split_photons(10, 3) == [4, 3, 3]
+    assert split_photons(2, 4) == [1, 1, 0, 0]
+
+
+def test_same_seed_and_workers_give_same_result():
+    first, second = _parallel(), _parallel()
+    assert first[0] == second[0]
+    assert first[1] == second[1]
+    assert np.array_equal(first[2], second[2])
+
+
+def test_merge_in_shard_order_matches_serial_shards():
+    cylinder, stats = CylinderTally(nr=10, nz=10), RunStats()
+    heat, bit, final_x, final_z, rd = _parallel(cylinder=cylinder, stats=stats)
+    expected_heat = np.zeros(len(heat))
+    expected_x = []
+    steps = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for shard, child in zip(split_photons(500, 2), np.random.SeedSequence(5).spawn(2)):
+            sim = create_simulation(*ARGS, **dict(KWARGS, new_photons=2 * shard), seed=child)
+            sim.run()
+            expected_heat += sim.heat
+            expected_x.append(np.asarray(sim.end_points()[0]))
+            steps += sim.steps
+    assert heat == expected_heat.tolist()
+    assert np.array_equal(final_x, np.concatenate(expected_x))
+    assert cylinder.absorbed.sum() == pytest.approx(sum(heat), rel=1e-9)
+    assert stats.steps == steps
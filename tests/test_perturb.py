@@ -0,0 +1,65 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from MC_algo import build_scene
+from MC_perturb import PhotonHistory
+from MC_vector import iter_mc_vectorized
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+
+
+def _scene(mu_a=5.0, mu_s=95.0, tumor=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        scene = build_scene(mu_a, mu_s, 0.5, 1.5, new_wave=650, new_mode=('A', LAYERS_A), new_is_vessel=False)
+    if tumor is not None:
+        scene.mu_a_tumor = tumor
+    return scene
+
+
+def _vectorized(scene, photons, seed):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return list(iter_mc_vectorized(scene, photons, rng=np.random.default_rng(seed)))[-1][1:]
+
+
+def test_recording_does_not_change_the_run():
+    scene = _scene()
+    history = PhotonHistory()
+    recorded = history.record(scene, 1000, seed=1)
+    plain = _vectorized(scene, 1000, 1)
+    assert recorded[0] == plain[0]
+    assert recorded[1] == plain[1]
+    assert history.nbytes() > 0
+
+
+def test_reweight_same_scene_reproduces_run():
+    scene = _scene()
+    history = PhotonHistory()
+    heat, bit, _, _, rd, dose = history.record(scene, 1000, seed=1)
+    again = history.reweight(scene, 1000)
+    # Расстояния хранятся во float32, поэтому редкие взаимодействия у границы бина попадают в соседний
+    assert sum(again[0]) == pytest.approx(sum(heat), rel=1e-6)
+    assert np.abs(np.subtract(again[0], heat)).sum() < 1e-3 * sum(heat)
+    assert again[4] == pytest.approx(rd, rel=1e-4)
+    assert again[5] == pytest.approx(dose, rel=1e-4)
+
+
+def test_reweight_to_other_tumor_absorption_agrees_with_new_run():
+    history = PhotonHistory()
+    history.record(_scene(tumor=2.0), 4000, seed=1)
+    target = _scene(tumor=6.0)
+    reweighted = history.reweight(target, 4000)
+    direct = _vectorized(target, 4000, 2)
+    assert sum(reweighted[0]) == pytest.approx(sum(direct[0]), rel=0.03)
+    assert reweighted[5] == pytest.approx(direct[5], rel=0.15)
+
+
+def test_history_does_not_match_other_scattering():
+    history = PhotonHistory()
+    history.record(_scene(), 200, seed=1)
+    assert history.matches(_scene(mu_a=7.0), 200)
+    assert not history.matches(_scene(mu_s=120.0), 200)
+    assert not history.matches(_scene(), 100)
+    assert history.reweight(_scene(mu_s=120.0), 200) is None
@@ -0,0 +1,50 @@
+import contextlib
+import io
+
+import numpy as np
+
+from MC_algo import PhotonTransport, RandomStream, build_scene
+
+
+def _scene():
+    with contextlib.redirect_stdout(io.StringIO()):
+        return build_scene(5.0, 95.0, 0.5, 1.5, new_is_heterogeneous=False,
+                           new_is_tumor=False, new_is_vessel=False)
+
+
+def _run(seed):
+    sim = PhotonTransport(_scene(), photons=200, seed=seed)
+    sim.run()
+    return sim
+
+
+def test_same_seed_same_run():
+    a, b = _run(11), _run(11)
+    assert np.array_equal(a.heat, b.heat)
+    assert a.bit == b.bit
+    assert a.rd == b.rd
+
+
+def test_different_seeds_differ():
+    assert not np.array_equal(_run(11).heat, _run(12).heat)
+
+
+def test_streams_continue_across_blocks():
+    # Маленький блок: значения идут подряд из одного генератора, как при одном большом блоке
+    small, large = RandomStream(5, block=7), RandomStream(5, block=100)
+    assert [small.random() for _ in range(30)] == [large.random() for _ in range(30)]
+
+
+def test_disk_points_inside_unit_circle():
+    rng = RandomStream(3, block=1000)
+    for _ in range(5000):
+        x1, x2, x3 = rng.disk()
+        assert x3 == x1 * x1 + x2 * x2
+        assert x3 <= 1.0
+
+
+def test_exponential_mean():
+    rng = RandomStream(4)
+    values = [rng.exponential() for _ in range(100000)]
+    assert min(values) >= 0.0
+    assert abs(np.mean(values) - 1.0) < 0.02
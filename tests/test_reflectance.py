@@ -0,0 +1,76 @@
+import contextlib
+import io
+import json
+import math
+
+import numpy as np
+import pytest
+
+from MC_algo import create_simulation
+from MC_cli import main
+from MC_reflectance import ReflectanceTally
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+
+
+def _run(engine, **tallies):
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = create_simulation(5.0, 95.0, 0.5, 1.5, new_photons=2000, seed=3, new_wave=650,
+                                new_mode=('A', LAYERS_A), **tallies)
+        sim.run(engine)
+    return sim
+
+
+@pytest.mark.parametrize('engine', ['python', 'numpy'])
+def test_reflectance_total_is_engine_rd(engine):
+    plain = _run(engine)
+    reflectance = ReflectanceTally(xy_range=(-50.0, 50.0))
+    tallied = _run(engine, reflectance=reflectance)
+    assert tallied.heat == plain.heat
+    assert tallied.rd == plain.rd
+    assert reflectance.total == pytest.approx(plain.rd, rel=1e-9)
+    assert reflectance.rd_ra.sum() == pytest.approx(plain.rd, rel=1e-9)
+
+
+def test_normalization():
+    reflectance = ReflectanceTally(dr=1.0, nr=3, na=3, xy_range=(-2.0, 2.0), xy_bins=4)
+    # n = 1: угол выхода равен углу внутри
+    reflectance.add([0.5, 1.5, 10.0], [0.0, 0.0, 0.0], [1.0, math.cos(0.7), 0.0], 1.0, [1.0, 2.0, 4.0])
+    assert reflectance.rd_ra[0, 0] == 1.0 and reflectance.rd_ra[1, 1] == 2.0 and reflectance.rd_ra[2, 2] == 4.0
+    assert reflectance.fraction(2) == 3.5
+    ring = 2.0 * np.pi * reflectance.r_centers() * reflectance.dr
+    assert (reflectance.radial(2) * ring).sum() == pytest.approx(3.5)
+    da = 0.5 * math.pi / reflectance.na
+    solid = 4.0 * math.pi * np.sin(reflectance.angle_centers()) * math.sin(0.5 * da)
+    assert (reflectance.angular(2) * solid).sum() == pytest.approx(3.5)
+    # Пиксель 1 x 1; точка x = 10 за пределами изображения
+    assert reflectance.surface(2).sum() == pytest.approx(1.5)
+
+
+def test_merge_equals_single_tally():
+    rng = np.random.default_rng(4)
+    x, y, w, weights = rng.uniform(-5, 5, 1000), rng.uniform(-5, 5, 1000), rng.random(1000), rng.random(1000)
+    whole, part = ReflectanceTally(xy_range=(-5, 5)), ReflectanceTally(xy_range=(-5, 5))
+    whole.add(x, y, w, 1.4, weights)
+    part.add(x[:300], y[:300], w[:300], 1.4, weights[:300])
+    rest = part.empty()
+    rest.add(x[300:], y[300:], w[300:], 1.4, weights[300:])
+    part.merge(rest)
+    assert np.allclose(part.rd_ra, whole.rd_ra)
+    assert np.allclose(part.image, whole.image)
+    assert part.total == pytest.approx(whole.total)
+    with pytest.raises(ValueError):
+        part.merge(ReflectanceTally())
+
+
+def test_cli_writes_reflectance(tmp_path):
+    scenario = tmp_path / 'scenario.json'
+    scenario.write_text('{}', encoding='utf-8')
+    output = tmp_path / 'result'
+    assert main([str(scenario), '-o', str(output), '--photons', '200', '--seed', '1',
+                 '--reflectance', '0.5', '20', '10', '--reflectance-xy', '-10', '10', '8']) == 0
+    summary = json.loads((tmp_path / 'result.json').read_text(encoding='utf-8'))
+    data = np.load(tmp_path / 'result.npz')
+    assert data['rd_ra'].shape == (20, 10)
+    assert data['rd_xy'].shape == (8, 8)
+    assert summary['reflectance_fraction'] == pytest.approx(data['rd_ra'].sum() / 200)
@@ -0,0 +1,60 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from MC_algo import create_simulation
+from MC_reservoir import EndPointReservoir
+
+
+def _sample(values, capacity, seed, batch=1000):
+    reservoir = EndPointReservoir(capacity, seed)
+    for start in range(0, values.size, batch):
+        chunk = values[start:start + batch]
+        reservoir.add(chunk, chunk, chunk, chunk, chunk)
+    return reservoir
+
+
+def test_keeps_everything_below_capacity():
+    values = np.arange(50.0)
+    reservoir = _sample(values, 100, 0, batch=7)
+    assert len(reservoir) == 50
+    assert reservoir.data()['x'].tolist() == values.tolist()
+
+
+def test_sample_is_uniform():
+    values = np.arange(10000.0)
+    counts = np.zeros(10)
+    for seed in range(200):
+        reservoir = _sample(values, 100, seed, batch=333)
+        assert len(reservoir) == 100 and reservoir.seen == 10000
+        # Все столбцы одной точки остаются вместе
+        assert np.array_equal(reservoir.x, reservoir.steps)
+        counts += np.bincount((reservoir.x // 1000).astype(int), minlength=10)
+    assert np.allclose(counts / counts.sum(), 0.1, atol=0.01)
+
+
+def test_merge_takes_each_part_by_its_size():
+    taken = 0
+    for seed in range(200):
+        first = _sample(np.arange(1000.0), 100, seed)
+        second = _sample(np.arange(1000.0, 4000.0), 100, seed + 1000)
+        first.merge(second)
+        assert first.seen == 4000 and len(first) == 100
+        taken += int((first.x < 1000).sum())
+    assert taken / (200 * 100) == pytest.approx(0.25, abs=0.02)
+    with pytest.raises(ValueError):
+        first.merge(EndPointReservoir(50))
+
+
+@pytest.mark.parametrize('engine', ['python', 'numpy'])
+def test_engine_adds_every_end_point(engine):
+    reservoir = EndPointReservoir(100, seed=1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = create_simulation(5.0, 95.0, 0.5, 1.5, new_is_heterogeneous=False, new_is_tumor=False,
+                                new_is_vessel=False, new_photons=1000, seed=1, reservoir=reservoir)
+        sim.run(engine)
+    assert reservoir.seen == 500
+    assert len(reservoir) == 100
+    assert (reservoir.z >= 0.0).all() and (reservoir.steps > 0).all()
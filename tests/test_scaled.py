@@ -0,0 +1,52 @@
+import contextlib
+import io
+
+import numpy as np
+
+from MC_perturb import PhotonHistory
+from MC_scaled import TrajectoryDatabase
+from MC_scene import Scene
+from MC_vector import iter_mc_vectorized
+
+
+def _scene(g):
+    return Scene(5.0, 95.0, g, 1.5, is_vessel=False, is_heterogeneous=False, is_tumor=False)
+
+
+def test_database_keeps_most_recent_entries():
+    db = TrajectoryDatabase(max_entries=2)
+    for g in (0.1, 0.2):
+        db.record(_scene(g), 200, seed=1)
+    # Обращение к g=0.1 делает её свежей, поэтому вытесняется g=0.2
+    assert db.reweight(_scene(0.1), 200) is not None
+    db.record(_scene(0.3), 200, seed=1)
+    assert len(db) == 2
+    assert db.reweight(_scene(0.1), 200) is not None
+    assert db.reweight(_scene(0.2), 200) is None
+    assert db.reweight(_scene(0.3), 200) is not None
+
+
+def test_database_falls_back_to_one_plain_run_when_history_does_not_fit():
+    scene = _scene(0.5)
+    calls = []
+    db = TrajectoryDatabase(max_bytes=2 * 1024 * 1024)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = db.record(scene, 2000, seed=3, progress=lambda done, total: calls.append(done))
+        plain = list(iter_mc_vectorized(scene, 2000, rng=np.random.default_rng(3)))[-1][1:]
+    assert len(db) == 0
+    # Прогресс начинается заново один раз: базовый расчёт оборван в начале, затем один обычный
+    restarts = [i for i in range(1, len(calls)) if calls[i] < calls[i - 1]]
+    assert len(restarts) == 1
+    assert calls[restarts[0] - 1] < 1000
+    assert np.array_equal(result[0], plain[0])
+    assert result[1] == plain[1]
+
+
+def test_history_stops_once_projection_exceeds_max_bytes():
+    calls = []
+    history = PhotonHistory(max_bytes=4 * 1024 * 1024)
+    for _ in history.iter_record(_scene(0.5), 5000, seed=1, batch_size=500, stop_on_overflow=True,
+                                 progress=lambda done, total: calls.append(done)):
+        pass
+    assert history.data is None
+    assert max(calls) < 1000
@@ -0,0 +1,60 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from MC_algo import BINS, build_scene, create_simulation
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+MODES = {'layers': dict(new_is_tumor=False, new_is_vessel=False),
+         'tumor': dict(new_is_tumor=True, new_is_vessel=False),
+         'vessel': dict(new_is_tumor=False, new_is_vessel=True),
+         'tumor vessel': dict(new_is_tumor=True, new_is_vessel=True)}
+
+
+def _scene(**params):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return build_scene(5.0, 95.0, 0.5, 1.5, new_wave=650, new_mode=('A', LAYERS_A), **params)
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_combined_lookup_matches_separate_coefficients(mode):
+    scene = _scene(**MODES[mode])
+    rng = np.random.default_rng(0)
+    for x, z in zip(rng.uniform(-12.0, 12.0, 2000).tolist(), rng.uniform(0.0, 12.0, 2000).tolist()):
+        mu_a, mu_s = scene.mu_a_at(x, z), scene.mu_s_at(x, z)
+        assert scene.mu_a_s_at(x, z) == (mu_a, mu_s)
+        assert scene.albedo_at(x, z) == mu_s / (mu_a + mu_s)
+        assert scene.mu_t_at(x, z) == mu_a + mu_s
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_compiled_scene_matches_analytic_at_cell_centers(mode):
+    scene = _scene(**MODES[mode])
+    compiled = scene.compile(0.1)
+    x = compiled.grid_x0 + (np.arange(0, compiled.grid_nx, 7) + 0.5) / compiled.inv_dx
+    z = compiled.grid_z0 + (np.arange(0, compiled.grid_nz, 5) + 0.5) / compiled.inv_dz
+    xx, zz = (a.ravel() for a in np.meshgrid(x, z))
+    for name in ('mu_a', 'mu_s', 'g', 'n', 'albedo'):
+        assert np.allclose(getattr(compiled, name + '_array')(xx, zz), getattr(scene, name + '_array')(xx, zz))
+    for px, pz in zip(xx[::50].tolist(), zz[::50].tolist()):
+        assert compiled.albedo_at(px, pz) == pytest.approx(scene.albedo_at(px, pz))
+        assert compiled.mu_t_at(px, pz) == pytest.approx(scene.mu_t_at(px, pz))
+
+
+@pytest.mark.parametrize('mode', ['layers', 'tumor vessel'])
+def test_grid_heat_agrees_with_analytic(mode):
+    # Сетка 0.05 мм меняет нагрев меньше, чем статистический шум расчёта с другим seed
+    scene = _scene(**MODES[mode])
+
+    def heat(seed, grid_step=None):
+        with contextlib.redirect_stdout(io.StringIO()):
+            sim = create_simulation(0, 0, 0, 0, new_photons=40000, seed=seed, scene=scene, grid_step=grid_step)
+            sim.run('numpy')
+        return np.asarray(sim.heat[:BINS - 1])
+
+    reference = heat(1)
+    noise = np.linalg.norm(heat(2) - reference) / np.linalg.norm(reference)
+    grid = np.linalg.norm(heat(1, 0.05) - reference) / np.linalg.norm(reference)
+    assert grid <= max(2.0 * noise, 0.01)
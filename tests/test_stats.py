@@ -0,0 +1,46 @@
+import contextlib
+import io
+
+import pytest
+
+from MC_algo import create_simulation
+from MC_stats import RunStats
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+
+
+def _run(engine, stats=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = create_simulation(5.0, 95.0, 0.5, 1.5, new_photons=1000, seed=1, new_wave=650,
+                                new_mode=('A', LAYERS_A), stats=stats)
+        sim.run(engine)
+    return sim
+
+
+@pytest.mark.parametrize('engine', ['python', 'numpy'])
+def test_counters_are_consistent_and_do_not_change_results(engine):
+    stats = RunStats()
+    counted, plain = _run(engine, stats), _run(engine)
+    assert counted.heat == plain.heat
+    assert counted.rd == plain.rd
+    assert stats.photons == 500
+    assert stats.steps == plain.steps
+    # Каждый фотон гибнет в рулетке, после остальных взаимодействий он рассеивается
+    assert stats.roulette_kills == stats.photons
+    assert stats.scatters == stats.steps - stats.roulette_kills
+    assert stats.internal_reflections <= stats.bounces
+    assert stats.lookups and stats.lookup_time() > 0.0
+    assert stats.phases['transport'] > 0.0
+
+
+def test_merge_and_report():
+    first, second = RunStats(), RunStats()
+    _run('numpy', first)
+    _run('numpy', second)
+    steps, calls = first.steps, first.lookups['albedo_array'][0]
+    first.merge(second)
+    assert first.photons == 1000
+    assert first.steps == steps + second.steps
+    assert first.lookups['albedo_array'][0] == calls + second.lookups['albedo_array'][0]
+    assert first.as_dict()['steps_per_photon'] == pytest.approx(first.steps / 1000)
+    assert "Фотоны: 1000" in first.report()
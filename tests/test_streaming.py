@@ -0,0 +1,37 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from MC_algo import get_data, iter_data
+
+ARGS = (5.0, 95.0, 0.5, 1.5)
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+KWARGS = dict(new_mode=('A', LAYERS_A), new_wave=650, new_photons=1000, seed=4)
+
+
+@pytest.mark.parametrize('engine', ['python', 'numpy'])
+def test_snapshots_accumulate_to_full_run(engine):
+    with contextlib.redirect_stdout(io.StringIO()):
+        snapshots = list(iter_data(*ARGS, engine=engine, chunk=100, **KWARGS))
+        full = get_data(*ARGS, engine=engine, **KWARGS)
+    done = [snapshot[0] for snapshot in snapshots]
+    assert done[-1] == 500
+    # Снимок отдаётся, как только готово не меньше следующих chunk фотонов
+    assert len(done) == 5
+    assert all(100 * (i + 1) <= value < 100 * (i + 2) for i, value in enumerate(done))
+    absorbed = [sum(snapshot[1][0]) for snapshot in snapshots]
+    assert absorbed == sorted(absorbed)
+    heat, bit, final_x, final_z = snapshots[-1][1]
+    assert list(heat) == list(full[0])
+    assert bit == full[1]
+    assert np.array_equal(final_x, full[2])
+
+
+def test_consumer_can_stop_early():
+    with contextlib.redirect_stdout(io.StringIO()):
+        for done, res in iter_data(*ARGS, engine='python', chunk=100, **KWARGS):
+            break
+    assert done == 100
+    assert len(res[2]) <= 100
@@ -0,0 +1,43 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from MC_algo import build_scene
+from MC_sweep import run_sweep, sweep_scenes, wavelength_range
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+SCENE = dict(new_mode=('A', LAYERS_A), new_is_vessel=False)
+
+
+def test_wavelength_range_includes_stop():
+    assert wavelength_range(600, 700, 50).tolist() == [600.0, 650.0, 700.0]
+    assert wavelength_range(600, 690, 50).tolist() == [600.0, 650.0]
+    assert wavelength_range(400, 1000, 0.1)[-1] == pytest.approx(1000.0)
+    assert wavelength_range(700, 600, 50).size == 0
+
+
+def test_sweep_scenes_match_single_scenes():
+    waves = [620.0, 655.0, 700.0]
+    for wave, scene in zip(waves, sweep_scenes(waves, 5.0, 95.0, 0.5, 1.5, **SCENE)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            single = build_scene(5.0, 95.0, 0.5, 1.5, new_wave=wave, **SCENE)
+        assert np.allclose(scene.coef, single.coef)
+        assert scene.mu_a_tumor == pytest.approx(single.mu_a_tumor)
+        assert scene.mu_s_tumor == pytest.approx(single.mu_s_tumor)
+
+
+def test_sweep_is_the_same_with_workers(tmp_path):
+    waves = [620.0, 700.0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        serial = run_sweep(waves, 5.0, 95.0, 0.5, 1.5, new_photons=400, engine='numpy', seed=3, **SCENE)
+        pooled = run_sweep(waves, 5.0, 95.0, 0.5, 1.5, new_photons=400, engine='numpy', seed=3, workers=2,
+                           **SCENE)
+    assert serial.heat.shape[0] == 2
+    assert np.array_equal(serial.heat, pooled.heat)
+    assert np.array_equal(serial.reflectance, pooled.reflectance)
+    serial.save(str(tmp_path / 'sweep.npz'))
+    saved = np.load(tmp_path / 'sweep.npz')
+    assert saved['wavelengths'].tolist() == waves
+    assert np.array_equal(saved['heat'], serial.heat)
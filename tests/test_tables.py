@@ -0,0 +1,36 @@
+import math
+
+import numpy as np
+import pytest
+
+from MC_tables import FresnelTable, HGTable, FRESNEL_TOLERANCE, HG_TOLERANCE, fresnel_exact, hg_cos
+
+G_VALUES = [-0.5, 0.0, 0.35, 0.5, 0.715, 0.7972, 0.85, 0.9, 0.95]
+N_VALUES = [1.33, 1.36, 1.39, 1.4, 1.41, 1.43, 1.5]
+
+
+@pytest.fixture(scope='module')
+def hg():
+    return HGTable(G_VALUES)
+
+
+@pytest.fixture(scope='module')
+def fresnel():
+    return FresnelTable(N_VALUES)
+
+
+@pytest.mark.parametrize('g', G_VALUES)
+def test_hg_table_error_bound(hg, g):
+    rng = np.random.default_rng(0)
+    r = np.concatenate((rng.random(200000), np.linspace(0.0, 1.0, 100001)[:-1]))
+    assert np.abs(hg.sample_array(g, r) - hg_cos(g, r)).max() <= HG_TOLERANCE
+    assert max(abs(hg.sample(g, x) - hg_cos(g, x)) for x in r[:2000].tolist()) <= HG_TOLERANCE
+
+
+@pytest.mark.parametrize('n', N_VALUES)
+def test_fresnel_table_error_bound(fresnel, n):
+    rng = np.random.default_rng(0)
+    crit_angle = math.sqrt(1.0 - 1.0 / (n * n))
+    w = np.concatenate((rng.uniform(crit_angle, 1.0, 200000), np.linspace(crit_angle, 1.0, 100001)))
+    assert np.abs(fresnel.sample_array(n, w) - fresnel_exact(n, w)).max() <= FRESNEL_TOLERANCE
+    assert max(abs(fresnel.sample(n, x) - fresnel_exact(n, x)) for x in w[:2000].tolist()) <= FRESNEL_TOLERANCE
@@ -0,0 +1,43 @@
+import contextlib
+import io
+
+import numpy as np
+
+from MC_algo import PhotonTransport, build_scene
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+
+
+def _scene(**params):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return build_scene(5.0, 95.0, 0.5, 1.5, new_wave=650, new_mode=('A', LAYERS_A), **params)
+
+
+def test_tumor_box_contains_every_tumor_point():
+    scene = _scene(new_is_tumor=True, new_is_vessel=False)
+    x0, x1, z0, z1 = PhotonTransport(scene, photons=1).tumor_box
+    # Точки на самой границе эллипса и рядом с ней
+    angle = np.linspace(0.0, 2.0 * np.pi, 20001)
+    for scale in (1.0 - 1e-12, 1.0, 1.0 + 1e-12):
+        x = scene.tumor_x + scale * scene.tumor_rx * np.cos(angle)
+        z = scene.tumor_z + scale * scene.tumor_rz * np.sin(angle)
+        inside = scene.in_tumor_array(x, z)
+        assert ((x[inside] >= x0) & (x[inside] <= x1) & (z[inside] >= z0) & (z[inside] <= z1)).all()
+
+
+def test_no_tumor_box_without_tumor():
+    assert PhotonTransport(_scene(new_is_tumor=False, new_is_vessel=False), photons=1).tumor_box is None
+
+
+def test_simulations_can_run_interleaved():
+    # Состояние расчёта живёт в объекте, поэтому два расчёта можно вести попеременно
+    scenes = [_scene(new_is_tumor=True, new_is_vessel=False), _scene(new_is_tumor=False, new_is_vessel=True)]
+    alone = []
+    for seed, scene in enumerate(scenes):
+        sim = PhotonTransport(scene, photons=300, seed=seed)
+        sim.run()
+        alone.append((list(sim.heat), sim.bit, sim.rd))
+    runs = [PhotonTransport(scene, photons=300, seed=seed).iter_run(chunk=50) for seed, scene in enumerate(scenes)]
+    for snapshots in zip(*runs):
+        last = snapshots
+    assert [(list(snapshot[1]), snapshot[2], snapshot[5]) for snapshot in last] == alone
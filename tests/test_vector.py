@@ -0,0 +1,43 @@
+import contextlib
+import io
+
+import pytest
+
+from MC_algo import create_simulation
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+SCENES = {
+    'homogeneous': dict(new_is_heterogeneous=False, new_is_tumor=False, new_is_vessel=False),
+    'layers': dict(new_mode=('A', LAYERS_A), new_wave=650),
+}
+
+
+def _run(engine, scene, photons=10000, seed=2):
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = create_simulation(5.0, 95.0, 0.5, 1.5, new_photons=photons, seed=seed, **SCENES[scene])
+        sim.run(engine)
+    return sim
+
+
+@pytest.mark.parametrize('engine', ['python', 'numpy'])
+@pytest.mark.parametrize('scene', sorted(SCENES))
+def test_weight_is_conserved(engine, scene):
+    # Весь вес, вошедший в среду, поглощён или вышел; рулетка меняет его ровно на bit
+    sim = _run(engine, scene, photons=2000)
+    rs = (1.5 - 1.0) ** 2 / (1.5 + 1.0) ** 2
+    assert sum(sim.heat) + sim.rd - sim.bit == pytest.approx(sim.photons * (1.0 - rs), rel=1e-12)
+
+
+@pytest.mark.parametrize('scene', sorted(SCENES))
+def test_numpy_engine_agrees_with_python_engine(scene):
+    python, numpy = _run('python', scene), _run('numpy', scene)
+    assert sum(numpy.heat) / numpy.photons == pytest.approx(sum(python.heat) / python.photons, rel=0.03)
+    assert numpy.rd / numpy.photons == pytest.approx(python.rd / python.photons, rel=0.06)
+    # Профиль нагрева: доля в верхних 500 мкм
+    assert sum(numpy.heat[:5]) / sum(numpy.heat) == pytest.approx(sum(python.heat[:5]) / sum(python.heat), abs=0.03)
+
+
+def test_numpy_engine_is_reproducible():
+    first, second = _run('numpy', 'layers', photons=2000), _run('numpy', 'layers', photons=2000)
+    assert first.heat == second.heat
+    assert first.rd == second.rd
@@ -0,0 +1,68 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from MC_algo import create_simulation
+from MC_stats import RunStats
+from MC_voxels import VoxelTally, load_voxels
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+WIDE = dict(x_range=(-100.0, 100.0), y_range=(-100.0, 100.0), z_range=(0.0, 100.0), bins=(20, 20, 20))
+
+
+def _run(engine, delta_tracking=False, **tallies):
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = create_simulation(5.0, 95.0, 0.5, 1.5, new_photons=2000, seed=3, new_wave=650,
+                                new_mode=('A', LAYERS_A), delta_tracking=delta_tracking, **tallies)
+        sim.run(engine)
+    return sim
+
+
+@pytest.mark.parametrize('engine', ['python', 'numpy'])
+@pytest.mark.parametrize('delta_tracking', [False, True])
+def test_voxels_do_not_change_results_and_hold_all_absorption(engine, delta_tracking):
+    plain = _run(engine, delta_tracking)
+    voxels = VoxelTally(**WIDE)
+    tallied = _run(engine, delta_tracking, voxels=voxels)
+    assert tallied.heat == plain.heat
+    assert voxels.absorbed.dense().sum(dtype=np.float64) == pytest.approx(sum(plain.heat), rel=1e-5)
+    assert voxels.fluence.dense().min() >= 0.0
+
+
+def test_python_voxels_are_the_same_with_stats():
+    voxels, plain = VoxelTally(bins=(20, 20, 20)), VoxelTally(bins=(20, 20, 20))
+    _run('python', voxels=voxels, stats=RunStats())
+    _run('python', voxels=plain)
+    assert np.array_equal(voxels.absorbed.dense(), plain.absorbed.dense())
+    assert np.array_equal(voxels.fluence.dense(), plain.fluence.dense())
+
+
+def test_sparse_grid_matches_dense(tmp_path):
+    rng = np.random.default_rng(0)
+    x, y, z = rng.uniform(-30, 30, 5000), rng.uniform(-30, 30, 5000), rng.uniform(0, 10, 5000)
+    weights = rng.random(5000)
+    dense, sparse = VoxelTally(bins=(40, 40, 40), sparse=False), VoxelTally(bins=(40, 40, 40), sparse=True)
+    for tally in (dense, sparse):
+        tally.add(x, y, z, weights, weights)
+    assert np.allclose(sparse.absorbed.dense(), dense.absorbed.dense())
+    assert np.allclose(sparse.absorbed[3:17, 5, :], dense.absorbed[3:17, 5, :])
+    assert np.allclose(sparse.fluence.project(1), dense.fluence.project(1))
+    sparse.save(str(tmp_path / 'run'))
+    spec, grids = load_voxels(str(tmp_path / 'run'))
+    assert spec['total'] == 5000
+    assert np.allclose(grids['absorbed'], dense.absorbed.dense())
+
+
+def test_merge_equals_single_tally():
+    rng = np.random.default_rng(1)
+    points = rng.uniform(-5, 5, (4, 1000))
+    whole, part = VoxelTally(bins=(10, 10, 10)), VoxelTally(bins=(10, 10, 10))
+    whole.add(points[0], points[1], points[2] + 5, points[3] ** 2, points[3] ** 2)
+    part.add(points[0][:500], points[1][:500], points[2][:500] + 5, points[3][:500] ** 2, points[3][:500] ** 2)
+    rest = part.empty()
+    rest.add(points[0][500:], points[1][500:], points[2][500:] + 5, points[3][500:] ** 2, points[3][500:] ** 2)
+    part.merge(rest)
+    assert np.allclose(part.absorbed.dense(), whole.absorbed.dense())
+    assert part.total == whole.total
@@ -0,0 +1,44 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from MC_sweep import sweep_scenes
+from MC_vector import iter_mc_vectorized
+from MC_white import run_mc_white, run_white
+
+LAYERS_A = [("Эпидермис", 0.0, 3.5, "Эпидермис_светлый"), ("Дерма", 3.5, 10.0, "Дерма_человека")]
+SCENES = {
+    'homogeneous': dict(new_is_heterogeneous=False, new_is_tumor=False, new_is_vessel=False),
+    'layers': dict(new_mode=('A', LAYERS_A), new_is_vessel=False),
+}
+
+
+@pytest.mark.parametrize('scene', sorted(SCENES))
+def test_one_wavelength_matches_vectorized_engine(scene):
+    scenes = sweep_scenes([650.0], 5.0, 95.0, 0.5, 1.5, **SCENES[scene])
+    heat, bit, rd, _, tumor_dose, _, _ = run_mc_white(scenes, 1000, rng=np.random.default_rng(1))
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, expected_heat, expected_bit, _, _, expected_rd, expected_dose = list(
+            iter_mc_vectorized(scenes[0], 1000, rng=np.random.default_rng(1)))[-1]
+    assert np.allclose(heat[0], expected_heat)
+    assert bit[0] == pytest.approx(expected_bit)
+    assert rd[0] == pytest.approx(expected_rd)
+    assert tumor_dose[0] == pytest.approx(expected_dose)
+
+
+def test_weight_is_conserved_at_every_wavelength():
+    scenes = sweep_scenes([600.0, 650.0, 700.0], 5.0, 95.0, 0.5, 1.5, **SCENES['layers'])
+    heat, bit, rd, rs, _, _, _ = run_mc_white(scenes, 1000, rng=np.random.default_rng(2))
+    assert np.allclose(heat.sum(axis=1) + rd - bit, 1000 * (1.0 - rs))
+    # Коэффициенты слоёв зависят от длины волны, значит, и поглощение
+    assert len(set(heat.sum(axis=1).round(6).tolist())) == 3
+
+
+def test_run_white_returns_sweep_result():
+    result = run_white([600.0, 700.0], 5.0, 95.0, 0.5, 1.5, new_photons=400, seed=3, reference_wave=690,
+                       **SCENES['layers'])
+    assert result.photons == 200
+    assert result.heat.shape[0] == 2
+    assert result.wavelengths.tolist() == [600.0, 700.0]
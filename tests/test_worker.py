@@ -0,0 +1,44 @@
+import contextlib
+import io
+import threading
+
+import pytest
+
+from MC_algo import get_data, SimulationCancelled
+
+ARGS = (5.0, 95.0, 0.5, 1.5)
+KWARGS = dict(new_is_heterogeneous=False, new_is_tumor=False, new_is_vessel=False, new_photons=400, seed=1)
+
+
+@pytest.mark.parametrize('engine', ['python', 'numpy'])
+def test_cancel_stops_engine(engine):
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(SimulationCancelled), contextlib.redirect_stdout(io.StringIO()):
+        get_data(*ARGS, engine=engine, cancel=cancel, **KWARGS)
+
+
+def _worker(chunk=None):
+    pytest.importorskip('PySide6')
+    from MC_worker import SimulationWorker
+    worker = SimulationWorker(7, ARGS, dict(KWARGS, engine='numpy'), chunk=chunk)
+    events = []
+    for name in ('partial', 'finished', 'cancelled', 'failed'):
+        getattr(worker, name).connect(lambda run_id, *rest, name=name: events.append((name, run_id)))
+    return worker, events
+
+
+def test_worker_reports_partial_and_final_results():
+    worker, events = _worker(chunk=50)
+    with contextlib.redirect_stdout(io.StringIO()):
+        worker.run()
+    assert events[-1] == ('finished', 7)
+    assert ('partial', 7) in events
+
+
+def test_worker_cancelled_before_start():
+    worker, events = _worker()
+    worker.cancel()
+    with contextlib.redirect_stdout(io.StringIO()):
+        worker.run()
+    assert events == [('cancelled', 7)]